@@ -1,9 +1,13 @@
 # app/api/endpoints.py
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from app.config import get_logger, Settings
-from app.schemas.song_generation import SongGenerationRequest
-from app.controllers.song_generation import song_cover_pipeline, search_song_controller, get_chorus_controller
-from fastapi.responses import FileResponse
+from app.schemas.song_generation import SongGenerationRequest, SongGenerationJob
+from app.controllers.song_generation import search_song_controller, get_chorus_controller, submit_song_job, get_song_job
+from app.services.ai_cover.model_registry import model_registry
+from app.services.job_queue.stage_limiter import CapacityExceeded, stage_limiters
+from app.services.metrics.metrics import stage_metrics
+from fastapi.responses import FileResponse, PlainTextResponse
+import asyncio
 import os
 
 logger = get_logger(__name__)
@@ -31,10 +35,63 @@ async def generate_song(request: SongGenerationRequest):
        Use GET /voice_models API to get the list of available rvc models.
     """
     logger.info(f'generate_song: {request.model_dump_json()}')
-    ai_cover_path = song_cover_pipeline(**request.model_dump())
+    job = submit_job(request)
+    # the pipeline runs on the job queue's workers, the event loop stays free for other requests
+    try:
+        ai_cover_path = await asyncio.wrap_future(job.future)
+    except CapacityExceeded as e:
+        raise capacity_exceeded(e)
     filename = os.path.basename(ai_cover_path)
     return FileResponse(ai_cover_path, media_type='application/octet-stream', filename=filename)
 
+def capacity_exceeded(e: CapacityExceeded):
+    return HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+
+def submit_job(request: SongGenerationRequest):
+    try:
+        return submit_song_job(**request.model_dump())
+    except CapacityExceeded as e:
+        raise capacity_exceeded(e)
+
+def find_job(job_id: str):
+    job = get_song_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'Job {job_id} not found')
+    return job
+
+@router.post("/jobs", status_code=202, response_model=SongGenerationJob)
+async def submit_song_generation_job(request: SongGenerationRequest):
+    """Queue an AI voice cover job with the same payload as POST /generate-song. \n
+       Returns the job id immediately. Poll GET /jobs/{job_id} for progress and fetch the song from GET /jobs/{job_id}/result.
+    """
+    logger.info(f'submit_song_generation_job: {request.model_dump_json()}')
+    job = submit_job(request)
+    return job.to_dict()
+
+@router.get("/jobs/{job_id}", response_model=SongGenerationJob)
+async def get_song_generation_job(job_id: str):
+    """returns the status and progress of a song generation job"""
+    return find_job(job_id).to_dict()
+
+@router.get("/jobs/{job_id}/result")
+async def get_song_generation_job_result(job_id: str):
+    """returns the generated song of a completed job"""
+    job = find_job(job_id)
+    if job.status == 'failed':
+        if isinstance(job.exception, CapacityExceeded):
+            # the job is over and will not run again, only a new submission can succeed
+            raise HTTPException(status_code=500, detail=f'Job {job_id} was rejected: {job.error}. Resubmit it with POST /jobs')
+        raise HTTPException(status_code=500, detail=f'Job {job_id} failed: {job.error}')
+    if job.status != 'completed':
+        raise HTTPException(status_code=409, detail=f'Job {job_id} is {job.status}')
+    filename = os.path.basename(job.result)
+    return FileResponse(job.result, media_type='application/octet-stream', filename=filename)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """returns wall time, CPU time, peak RSS and I/O totals of every pipeline stage in the Prometheus text format"""
+    return PlainTextResponse(stage_metrics.render(), media_type='text/plain; version=0.0.4')
+
 dev_router = APIRouter()
 
 @dev_router.post("/search-song")
@@ -51,3 +108,17 @@ async def get_chorus():
     chorus_path = get_chorus_controller()
     filename = os.path.basename(chorus_path)
     return FileResponse(chorus_path, media_type='application/octet-stream', filename=filename)
+
+
+@dev_router.get("/model-registry")
+async def get_model_registry_stats():
+    """returns hit/miss/eviction counters of the resident voice model registry"""
+    logger.info("Model registry endpoint accessed")
+    return model_registry.stats()
+
+
+@dev_router.get("/stage-limits")
+async def get_stage_limits():
+    """returns active and waiting runs of every concurrency-limited pipeline stage"""
+    logger.info("Stage limits endpoint accessed")
+    return {name: limiter.stats() for name, limiter in stage_limiters.items()}
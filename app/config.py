@@ -1,5 +1,6 @@
 # app/config.py
 import os
+from contextvars import ContextVar
 from dotenv import load_dotenv
 import logging
 from logging.handlers import RotatingFileHandler
@@ -14,6 +15,78 @@ class Settings:
     DEMIX_DIR = os.getenv("DEMIX_DIR", "/tmp/demix")
     SPEC_DIR = os.getenv("SPEC_DIR", "/tmp/spectrogram")
     OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/tmp/song_output")
+    # Memory budget for resident voice model generators, in MB
+    RVC_MODEL_CACHE_MB = int(os.getenv("RVC_MODEL_CACHE_MB", "2048"))
+    # Number of ONNX Runtime sessions kept per MDX model, i.e. how many requests can separate concurrently
+    MDX_SESSION_POOL_SIZE = int(os.getenv("MDX_SESSION_POOL_SIZE", "1"))
+    MDX_WARMUP_ON_STARTUP = os.getenv("MDX_WARMUP_ON_STARTUP", "True").lower() in ("true", "1", "yes")
+    # Number of MDX chunks stacked into a single ONNX Runtime call
+    MDX_BATCH_SIZE = int(os.getenv("MDX_BATCH_SIZE", "1"))
+    # Number of voice model faiss indexes (and their feature matrices) kept loaded
+    FAISS_INDEX_CACHE_SIZE = int(os.getenv("FAISS_INDEX_CACHE_SIZE", "8"))
+    # Search the index once for all segments of a song instead of once per segment (keeps all HuBERT features in memory)
+    FAISS_SEARCH_ALL_SEGMENTS = os.getenv("FAISS_SEARCH_ALL_SEGMENTS", "False").lower() in ("true", "1", "yes")
+    # Search the approximate index variant ("ivfpq" or "hnsw") built by index_convert when present, with these
+    # nprobe / efSearch values (0 = value stored in the index)
+    FAISS_INDEX_PREFER = os.getenv("FAISS_INDEX_PREFER", "")
+    FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "0"))
+    FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0"))
+    # Song generation job queue: concurrent pipeline runs, jobs allowed to wait, finished jobs remembered
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+    JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+    JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "100"))
+    # Content-addressed cache of separated stems, shared by all requests for the same song
+    STEM_CACHE_DIR = os.getenv("STEM_CACHE_DIR", "/tmp/stem_cache")
+    STEM_CACHE_MAX_MB = int(os.getenv("STEM_CACHE_MAX_MB", "5120"))
+    # Content-addressed cache of allin1 song structure analysis, and size limits of the allin1 artifacts kept in
+    # DEMIX_DIR and SPEC_DIR
+    ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", "/tmp/analysis_cache")
+    ANALYSIS_CACHE_MAX_MB = int(os.getenv("ANALYSIS_CACHE_MAX_MB", "64"))
+    DEMIX_MAX_MB = int(os.getenv("DEMIX_MAX_MB", "2048"))
+    SPEC_MAX_MB = int(os.getenv("SPEC_MAX_MB", "512"))
+    # Decode the song once and keep it in memory between the MDX passes instead of round-tripping through WAV files
+    PREPROCESS_IN_MEMORY = os.getenv("PREPROCESS_IN_MEMORY", "True").lower() in ("true", "1", "yes")
+    # Decode RMVPE salience on the model's device instead of copying it to the host first
+    RMVPE_DECODE_ON_DEVICE = os.getenv("RMVPE_DECODE_ON_DEVICE", "False").lower() in ("true", "1", "yes")
+    # Cap RMVPE peak memory by running it over windows of at most this many 10 ms frames (0 = whole vocal at once)
+    RMVPE_MAX_FRAMES = int(os.getenv("RMVPE_MAX_FRAMES", "0"))
+    RMVPE_OVERLAP_FRAMES = int(os.getenv("RMVPE_OVERLAP_FRAMES", "128"))
+    # Process pool for the CPU-bound f0 methods (pm, harvest, dio, hybrid; 0 = off, run in the request thread), the
+    # time slices harvest / dio are split into with their overlap, and the number of f0 contours kept in memory.
+    # Workers are spawned and import the main module, which must guard its startup with if __name__ == '__main__'
+    F0_WORKERS = int(os.getenv("F0_WORKERS", "0"))
+    F0_SLICE_SECONDS = float(os.getenv("F0_SLICE_SECONDS", "20"))
+    F0_OVERLAP_SECONDS = float(os.getenv("F0_OVERLAP_SECONDS", "1"))
+    F0_CACHE_SIZE = int(os.getenv("F0_CACHE_SIZE", "8"))
+    # Content-addressed cache of raw f0 contours, shared by all voice models and pitch settings on the same vocals
+    F0_CACHE_DIR = os.getenv("F0_CACHE_DIR", "/tmp/f0_cache")
+    F0_CACHE_MAX_MB = int(os.getenv("F0_CACHE_MAX_MB", "256"))
+    # Content-addressed cache of HuBERT features per vocal segment, shared by all voice models (0 = disabled)
+    HUBERT_CACHE_DIR = os.getenv("HUBERT_CACHE_DIR", "/tmp/hubert_cache")
+    HUBERT_CACHE_MAX_MB = int(os.getenv("HUBERT_CACHE_MAX_MB", "2048"))
+    # Write converted vocals segment by segment while converting, with RMS matching per segment, instead of
+    # converting the whole song in memory first. Peaks above 0.9 full scale are soft-clipped instead of the whole
+    # song being normalized
+    RVC_STREAM_OUTPUT = os.getenv("RVC_STREAM_OUTPUT", "False").lower() in ("true", "1", "yes")
+    # Number of vocal segments converted together by HuBERT and the voice model generator (1 = one at a time)
+    RVC_SEGMENT_BATCH_SIZE = int(os.getenv("RVC_SEGMENT_BATCH_SIZE", "1"))
+    # Pipeline runs allowed in each stage at once across all jobs (0 = unlimited); runs beyond that wait, up to
+    # STAGE_QUEUE_LIMIT waiting runs per stage and STAGE_QUEUE_TIMEOUT seconds, then the request gets a 429
+    MDX_CONCURRENCY = int(os.getenv("MDX_CONCURRENCY", "1"))
+    RMVPE_CONCURRENCY = int(os.getenv("RMVPE_CONCURRENCY", "1"))
+    HUBERT_CONCURRENCY = int(os.getenv("HUBERT_CONCURRENCY", "1"))
+    GENERATOR_CONCURRENCY = int(os.getenv("GENERATOR_CONCURRENCY", "1"))
+    STAGE_QUEUE_LIMIT = int(os.getenv("STAGE_QUEUE_LIMIT", "16"))
+    STAGE_QUEUE_TIMEOUT = float(os.getenv("STAGE_QUEUE_TIMEOUT", "600"))
+    # CPU threading: MDX worker threads per pass on CPU, ONNX Runtime intra/inter-op threads and torch threads
+    # (0 = library default)
+    MDX_CPU_THREADS = int(os.getenv("MDX_CPU_THREADS", "1"))
+    ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+    ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+    TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+
+# Set by the job queue so display_progress can report progress of the job running in the current thread
+progress_callback = ContextVar("progress_callback", default=None)
 
 def get_logger(name: str = "app"):
     logger = logging.getLogger(name)
@@ -39,6 +112,9 @@ def get_logger(name: str = "app"):
         logger.propagate = False
 
     def display_progress(message="", progress=0):
+        callback = progress_callback.get()
+        if callback is not None:
+            callback(message, progress)
         progress = progress * 100
         logger.info(f"Progress: {progress:.2f}% - {message}")
         
@@ -12,15 +12,19 @@ from app.services.youtube_download.youtube_download import get_youtube_video_id,
 from app.services.preprocess.preprocess import preprocess_song, get_audio_paths, do_extract_chorus
 from app.services.ai_cover.ai_cover import voice_change, add_audio_effects, pitch_shift
 from app.services.postprocess.postprocess import combine_audio
+from app.services.job_queue.job_queue import job_queue
+from app.services.job_queue.stage_limiter import CapacityExceeded
+from app.services.metrics.metrics import stage
 
 logger = get_logger(__name__)
 
 
 MDX_MODEL_DIR = os.getenv('MDX_MODEL_DIR', 'mdxnet_models')
-def song_cover_pipeline(song_input=None, artist_name=None, song_name=None, extract_chorus=True, voice_model=None, pitch_change=0, keep_files=False, 
+def song_cover_pipeline(song_input=None, artist_name=None, song_name=None, extract_chorus=True, voice_model=None, pitch_change=0, keep_files=False,
                         main_gain=0, backup_gain=0, inst_gain=0, index_rate=0.5, filter_radius=3,
                         rms_mix_rate=0.25, f0_method='rmvpe', crepe_hop_length=128, protect=0.33, pitch_change_all=0,
                         reverb_rm_size=0.15, reverb_wet=0.2, reverb_dry=0.8, reverb_damping=0.7, output_format='mp3',
+                        chorus_method='allin1',
                         ):
     try:
         logger.display_progress('[~] Starting AI Cover Generation Pipeline...', 0)
@@ -56,16 +60,17 @@ def song_cover_pipeline(song_input=None, artist_name=None, song_name=None, extra
         if not os.path.exists(song_dir):
             os.makedirs(song_dir)
             orig_song_path, vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path = preprocess_song(song_input, input_type, song_dir, 
-                artist_name=artist_name, song_name=song_name, extract_chorus=extract_chorus)
+                artist_name=artist_name, song_name=song_name, extract_chorus=extract_chorus, keep_files=keep_files, chorus_method=chorus_method)
 
         else:
             vocals_path, main_vocals_path = None, None
             paths = get_audio_paths(song_dir)
 
             # if any of the audio files aren't available or keep intermediate files or extracting chorus again, rerun preprocess
+            # (separated stems are reused from the stem cache unless keep_files is set)
             if any(path is None for path in paths) or keep_files or extract_chorus:
                 orig_song_path, vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path = preprocess_song(song_input, input_type, song_dir,
-                    artist_name=artist_name, song_name=song_name, extract_chorus=extract_chorus)
+                    artist_name=artist_name, song_name=song_name, extract_chorus=extract_chorus, keep_files=keep_files, chorus_method=chorus_method)
             else:
                 orig_song_path, instrumentals_path, main_vocals_dereverb_path, backup_vocals_path = paths
 
@@ -79,16 +84,19 @@ def song_cover_pipeline(song_input=None, artist_name=None, song_name=None, extra
             voice_change(voice_model, main_vocals_dereverb_path, ai_vocals_path, pitch_change, f0_method, index_rate, filter_radius, rms_mix_rate, protect, crepe_hop_length)
 
         logger.display_progress('[~] Applying audio effects to Vocals...', 0.8)
-        ai_vocals_mixed_path = add_audio_effects(ai_vocals_path, reverb_rm_size, reverb_wet, reverb_dry, reverb_damping)
+        with stage('effects'):
+            ai_vocals_mixed_path = add_audio_effects(ai_vocals_path, reverb_rm_size, reverb_wet, reverb_dry, reverb_damping)
 
         if pitch_change_all != 0:
             logger.display_progress('[~] Applying overall pitch change', 0.85)
-            instrumentals_path = pitch_shift(instrumentals_path, pitch_change_all)
-            backup_vocals_path = pitch_shift(backup_vocals_path, pitch_change_all)
+            with stage('pitch_shift'):
+                instrumentals_path = pitch_shift(instrumentals_path, pitch_change_all)
+                backup_vocals_path = pitch_shift(backup_vocals_path, pitch_change_all)
 
         # Step 4: Combine AI Vocals and Instrumentals
         logger.display_progress('[~] Combining AI Vocals and Instrumentals...', 0.9)
-        combine_audio([ai_vocals_mixed_path, backup_vocals_path, instrumentals_path], ai_cover_path, main_gain, backup_gain, inst_gain, output_format)
+        with stage('combine'):
+            combine_audio([ai_vocals_mixed_path, backup_vocals_path, instrumentals_path], ai_cover_path, main_gain, backup_gain, inst_gain, output_format)
 
         if not keep_files:
             logger.display_progress('[~] Removing intermediate audio files...', 0.95)
@@ -101,9 +109,19 @@ def song_cover_pipeline(song_input=None, artist_name=None, song_name=None, extra
 
         return ai_cover_path
 
+    except CapacityExceeded:
+        # keeps its retry_after for the 429 response
+        raise
     except Exception as e:
         raise Exception(str(e))
 
+def submit_song_job(**params):
+    """queues song_cover_pipeline on the job queue and returns the job"""
+    return job_queue.submit(song_cover_pipeline, **params)
+
+def get_song_job(job_id):
+    return job_queue.get(job_id)
+
 def search_song_controller(artist_name, song_name):
     try:
         logger.info(f'Searching for song: {song_name} by {artist_name}')
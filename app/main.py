@@ -1,14 +1,31 @@
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from app.api import endpoints
-from app.config import get_logger
+from app.config import get_logger, Settings
+from app.services.preprocess.preprocess import warmup_mdx_models
+from app.services.job_queue.job_queue import job_queue
+from app.services.ai_cover.f0_pool import f0_pool
+import torch
 
 # Initialize logging
 logger = get_logger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if Settings.TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(Settings.TORCH_NUM_THREADS)
+    if Settings.MDX_WARMUP_ON_STARTUP:
+        warmup_mdx_models()
+    yield
+    job_queue.shutdown()
+    f0_pool.shutdown()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Include routes
 app.include_router(endpoints.router)
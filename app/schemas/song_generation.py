@@ -8,6 +8,7 @@ class SongGenerationRequest(BaseModel):
     song_name: Optional[str] = Field(default=None, description='Name of the song')
     voice_model: str = Field(description='Name of the folder in the rvc_models directory containing the RVC model file and optional index file to use')
     extract_chorus: Optional[bool] = Field(default=True, description='Whether to extract the chorus of the song only')
+    chorus_method: Optional[str] = Field(default='allin1', description='How the chorus is located: allin1 (song structure analysis) or fast (lightweight repetition detector, falls back to allin1)')
     pitch_change: Optional[int] = Field(default=0, description='Change the pitch of AI Vocals only. Generally, use 1 for male to female and -1 for vice-versa. (Octaves)')
     keep_files: Optional[bool] = Field(default=False, description='Whether to keep all intermediate audio files generated in the song_output/id directory, e.g. Isolated Vocals/Instrumentals')
     index_rate: Optional[float] = Field(default=0.5, description='A decimal number used to reduce/resolve the timbre leakage problem. If set to 1, more biased towards the timbre quality of the training dataset')
@@ -33,6 +34,12 @@ class SongGenerationRequest(BaseModel):
             raise ValueError('Either song_input must be present or both artist_name and song_name must be present')
         return values
 
+    @field_validator('chorus_method')
+    def check_chorus_method(cls, v):
+        if v is not None and v not in ('allin1', 'fast'):
+            raise ValueError('chorus_method must be allin1 or fast')
+        return v
+
     @field_validator('index_rate')
     def check_index_rate(cls, v):
         if v is not None and not (0.0 <= v <= 1.0):
@@ -80,3 +87,15 @@ class SongGenerationRequest(BaseModel):
         if v is not None and not (0.0 <= v <= 1.0):
             raise ValueError('reverb_damping must be between 0.0 and 1.0')
         return v
+
+
+class SongGenerationJob(BaseModel):
+    job_id: str = Field(description='Id of the song generation job')
+    status: str = Field(description='One of queued, running, completed or failed')
+    progress: float = Field(default=0.0, description='Progress of the job between 0 and 1')
+    message: str = Field(default='', description='Last progress message of the pipeline')
+    error: Optional[str] = Field(default=None, description='Error message if the job failed')
+    created_at: float = Field(description='Unix time the job was submitted')
+    started_at: Optional[float] = Field(default=None, description='Unix time the job started running')
+    finished_at: Optional[float] = Field(default=None, description='Unix time the job completed or failed')
+    stages: list[dict] = Field(default_factory=list, description='Timing and resource usage of every pipeline stage the job ran so far')
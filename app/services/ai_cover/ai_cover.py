@@ -2,7 +2,6 @@
 
 # default imports
 import os
-import gc
 
 from pedalboard import Pedalboard, Reverb, Compressor, HighpassFilter
 from pedalboard.io import AudioFile
@@ -11,7 +10,9 @@ import sox
 
 # module imports
 from app.config import get_logger, Settings
-from app.services.ai_cover.rvc import Config, load_hubert, get_vc, rvc_infer
+from app.services.ai_cover.rvc import rvc_infer
+from app.services.ai_cover.model_registry import model_registry
+from app.services.ai_cover.index_cache import is_approx_index
 
 logger = get_logger(__name__)
 
@@ -22,7 +23,8 @@ def get_rvc_model(voice_model):
         ext = os.path.splitext(file)[1]
         if ext == '.pth':
             rvc_model_filename = file
-        if ext == '.index':
+        # approximate variants built by index_convert are picked up by the index cache, not listed here
+        if ext == '.index' and not is_approx_index(file):
             rvc_index_filename = file
 
     if rvc_model_filename is None:
@@ -34,14 +36,13 @@ def get_rvc_model(voice_model):
 def voice_change(voice_model, vocals_path, output_path, pitch_change, f0_method, index_rate, filter_radius, rms_mix_rate, protect, crepe_hop_length):
     rvc_model_path, rvc_index_path = get_rvc_model(voice_model)
     device = 'cuda:0'
-    config = Config(device, True)
-    hubert_model = load_hubert(device, config.is_half, os.path.join(Settings.RVC_MODELS_DIR, 'hubert_base.pt'))
-    cpt, version, net_g, tgt_sr, vc = get_vc(device, config.is_half, config, rvc_model_path)
+    # models stay resident in the registry between requests
+    config = model_registry.get_config(device, True)
+    hubert_model = model_registry.get_hubert(config)
+    cpt, version, net_g, tgt_sr, vc = model_registry.get_voice_model(config, voice_model, rvc_model_path)
 
     # convert main vocals
     rvc_infer(rvc_index_path, index_rate, vocals_path, output_path, pitch_change, f0_method, cpt, version, net_g, filter_radius, tgt_sr, rms_mix_rate, protect, crepe_hop_length, vc, hubert_model)
-    del hubert_model, cpt
-    gc.collect()
 
 def add_audio_effects(audio_path, reverb_rm_size, reverb_wet, reverb_dry, reverb_damping):
     output_path = f'{os.path.splitext(audio_path)[0]}_mixed.wav'
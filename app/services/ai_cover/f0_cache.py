@@ -0,0 +1,67 @@
+# app/services/ai_cover/f0_cache.py
+
+# default imports
+import hashlib
+
+import numpy as np
+
+# module imports
+from app.config import get_logger, Settings
+from app.utils import LRUFileCache
+
+logger = get_logger(__name__)
+
+
+def get_f0_params(f0_method, filter_radius, crepe_hop_length, is_half, device):
+    """returns the parameters besides the audio that change the raw f0 contour of f0_method"""
+    params = [f0_method]
+    if f0_method == 'harvest' or 'hybrid' in f0_method:
+        params.append(f'fr{filter_radius}')
+    if 'mangio-crepe' in f0_method:
+        params.append(f'hop{crepe_hop_length}')
+    if 'rmvpe' in f0_method:
+        params.append(f'mf{Settings.RMVPE_MAX_FRAMES}_of{Settings.RMVPE_OVERLAP_FRAMES}')
+        params.append(f'dec{int(Settings.RMVPE_DECODE_ON_DEVICE)}')
+    if 'crepe' in f0_method or 'rmvpe' in f0_method:
+        # network based methods give slightly different contours in half precision and on other devices
+        params.append('half' if is_half else 'float')
+        params.append(str(device).split(':')[0])
+    return params
+
+class F0Cache:
+    """
+    Content-addressed on-disk cache of raw f0 contours, before the f0_up_key shift.
+
+    The contour only depends on the filtered vocal audio, the sample rate and hop, the f0 method and the method
+    parameters, so it is shared by every voice model and pitch setting used on the same vocals. Each entry is a
+    float32 .npy file; the cache is kept under max_mb by evicting least recently used entries.
+    """
+
+    def __init__(self, cache_dir=Settings.F0_CACHE_DIR, max_mb=Settings.F0_CACHE_MAX_MB):
+        self.files = LRUFileCache(cache_dir, max_mb * 1024 ** 2, '.npy', logger)
+
+    @staticmethod
+    def get_key(x, sr, window, f0_method, filter_radius, crepe_hop_length, is_half, device):
+        audio_hash = hashlib.blake2b(np.ascontiguousarray(x).view(np.uint8), digest_size=16).hexdigest()
+        params = get_f0_params(f0_method, filter_radius, crepe_hop_length, is_half, device)
+        key = '|'.join([audio_hash, x.dtype.str, str(sr), str(window), *params])
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        try:
+            f0 = np.load(self.files.get_path(key))
+            self.files.touch(key)
+        except (OSError, ValueError):
+            return None
+
+        logger.info(f'f0 cache hit: {key}')
+        return f0
+
+    def put(self, key, f0):
+        """stores f0 and returns it as the float32 array a later get returns"""
+        f0 = np.asarray(f0, dtype=np.float32)
+        if self.files.max_bytes > 0:
+            self.files.write(key, lambda f: np.save(f, f0))
+        return f0
+
+f0_cache = F0Cache()
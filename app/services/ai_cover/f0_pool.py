@@ -0,0 +1,200 @@
+# app/services/ai_cover/f0_pool.py
+
+# default imports
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import parselmouth
+import pyworld
+
+# module imports
+from app.config import get_logger, Settings
+
+logger = get_logger(__name__)
+
+
+def compute_pm(x, sr, time_step, f0_min, f0_max):
+    return (
+        parselmouth.Sound(x, sr)
+        .to_pitch_ac(
+            time_step=time_step / 1000,
+            voicing_threshold=0.6,
+            pitch_floor=f0_min,
+            pitch_ceiling=f0_max,
+        )
+        .selected_array["frequency"]
+    )
+
+def compute_harvest(x, sr, time_step, f0_min, f0_max):
+    f0, t = pyworld.harvest(x, fs=sr, f0_ceil=f0_max, f0_floor=f0_min, frame_period=time_step)
+    return pyworld.stonemask(x, f0, t, sr)
+
+def compute_dio(x, sr, time_step, f0_min, f0_max):
+    f0, t = pyworld.dio(x, fs=sr, f0_ceil=f0_max, f0_floor=f0_min, frame_period=time_step)
+    return pyworld.stonemask(x, f0, t, sr)
+
+F0_FUNCTIONS = {'pm': compute_pm, 'harvest': compute_harvest, 'dio': compute_dio}
+# pyworld frames are at multiples of the frame period from sample 0, so these can be computed on time slices
+# and stitched; parselmouth centers its frames on the signal and always runs on the whole audio
+SLICED_METHODS = ('harvest', 'dio')
+
+def get_slices(n_samples, hop, slice_frames, overlap_frames):
+    """
+    splits the frames of a pyworld f0 contour over n_samples into slices of slice_frames.
+    Returns (start_sample, stop_sample, first_frame, n_frames) per slice: the audio to analyse includes
+    overlap_frames of context on both sides, and n_frames starting at first_frame are kept from its result.
+    """
+    total_frames = n_samples // hop + 1
+    slices = []
+    for first in range(0, total_frames, slice_frames):
+        n_frames = min(slice_frames, total_frames - first)
+        start = max(first - overlap_frames, 0) * hop
+        stop = min((first + n_frames + overlap_frames) * hop, n_samples)
+        slices.append((start, stop, first, n_frames))
+    return slices
+
+
+class _PendingF0:
+    """result of F0Pool.submit, the f0 contour is stitched from its slices when result() is called"""
+
+    def __init__(self, pool, key, args, parts=None, value=None):
+        self.pool = pool
+        self.key = key
+        self.args = args
+        self.parts = parts
+        self.value = value
+
+    def result(self):
+        if self.value is None:
+            try:
+                self.value = np.concatenate([future.result()[begin:end] for future, begin, end in self.parts])
+            except BrokenProcessPool:
+                self.pool.disable()
+                self.value = self.pool.compute_local(*self.args)
+            self.pool.cache_put(self.key, self.value)
+        return self.value
+
+
+class F0Pool:
+    """
+    Runs the CPU-bound f0 methods (pm, harvest, dio and the same methods inside hybrid) in a process pool.
+
+    harvest and dio are split into time slices of slice_seconds with overlap_seconds of context on both sides,
+    analysed in parallel and stitched back frame-exactly. Results are kept in a small LRU keyed by the content
+    of the audio and the method parameters, so hybrid stacks and repeated runs on the same vocals reuse them.
+    workers = 0 computes everything in the calling thread, which is also what happens from the moment the pool
+    breaks (a worker killed, or the main module of the server not importable by spawned workers).
+    """
+
+    def __init__(self, workers=Settings.F0_WORKERS, slice_seconds=Settings.F0_SLICE_SECONDS,
+                 overlap_seconds=Settings.F0_OVERLAP_SECONDS, cache_size=Settings.F0_CACHE_SIZE):
+        self.workers = workers
+        self.slice_seconds = slice_seconds
+        self.overlap_seconds = overlap_seconds
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._executor = None
+        self._cache = OrderedDict()
+
+    def _get_executor(self):
+        with self._lock:
+            if self.workers <= 0:
+                # disabled by another request since this one checked
+                raise BrokenProcessPool('f0 process pool is disabled')
+            if self._executor is None:
+                # spawn keeps torch / CUDA state of the server out of the workers
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    @staticmethod
+    def get_key(method, x, sr, time_step, f0_min, f0_max):
+        audio_hash = hashlib.blake2b(np.ascontiguousarray(x).view(np.uint8)).hexdigest()
+        return (method, audio_hash, x.dtype.str, sr, time_step, f0_min, f0_max)
+
+    def cache_get(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def cache_put(self, key, f0):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = f0
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def submit(self, method, x, sr, time_step, f0_min, f0_max):
+        """starts computing the f0 contour of x with method ('pm', 'harvest' or 'dio'), time_step in ms"""
+        x = np.ascontiguousarray(x, dtype=np.double)
+        key = self.get_key(method, x, sr, time_step, f0_min, f0_max)
+        args = (method, x, sr, time_step, f0_min, f0_max)
+        f0 = self.cache_get(key)
+        if f0 is not None:
+            return _PendingF0(self, key, args, value=f0)
+
+        if self.workers <= 0:
+            f0 = self.compute_local(*args)
+            self.cache_put(key, f0)
+            return _PendingF0(self, key, args, value=f0)
+
+        if method in SLICED_METHODS:
+            hop = int(sr * time_step / 1000)
+            slices = get_slices(
+                len(x), hop, int(self.slice_seconds * 1000 / time_step), int(self.overlap_seconds * 1000 / time_step)
+            )
+        else:
+            hop = 1
+            slices = [(0, len(x), 0, None)]
+
+        function = F0_FUNCTIONS[method]
+        try:
+            executor = self._get_executor()
+            parts = []
+            for start, stop, first, n_frames in slices:
+                future = executor.submit(function, x[start:stop], sr, time_step, f0_min, f0_max)
+                begin = first - start // hop
+                parts.append((future, begin, begin + n_frames if n_frames is not None else None))
+        except BrokenProcessPool:
+            self.disable()
+            f0 = self.compute_local(*args)
+            self.cache_put(key, f0)
+            return _PendingF0(self, key, args, value=f0)
+        return _PendingF0(self, key, args, parts=parts)
+
+    @staticmethod
+    def compute_local(method, x, sr, time_step, f0_min, f0_max):
+        return F0_FUNCTIONS[method](x, sr, time_step, f0_min, f0_max)
+
+    def compute(self, method, x, sr, time_step, f0_min, f0_max):
+        return self.submit(method, x, sr, time_step, f0_min, f0_max).result()
+
+    def disable(self):
+        """stops using the pool after it broke, f0 is computed in the calling thread from then on"""
+        with self._lock:
+            if self.workers <= 0:
+                return
+            logger.warning('f0 process pool is broken, computing f0 in process from now on')
+            self.workers = 0
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+f0_pool = F0Pool()
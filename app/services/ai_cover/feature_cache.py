@@ -0,0 +1,70 @@
+# app/services/ai_cover/feature_cache.py
+
+# default imports
+import hashlib
+
+import numpy as np
+import torch
+
+# module imports
+from app.config import get_logger, Settings
+from app.utils import LRUFileCache
+
+logger = get_logger(__name__)
+
+
+class FeatureCache:
+    """
+    Content-addressed on-disk cache of HuBERT features per vocal segment.
+
+    HuBERT output only depends on the segment audio, the model version (layer 9 + final_proj for v1, layer 12
+    for v2) and the precision it ran in, not on the target voice, so every voice model rendered on the same
+    song reuses it. Features are stored as float16 .npy files, read back memory-mapped, and the cache is kept
+    under max_mb by evicting least recently used entries.
+    """
+
+    def __init__(self, cache_dir=Settings.HUBERT_CACHE_DIR, max_mb=Settings.HUBERT_CACHE_MAX_MB):
+        self.files = LRUFileCache(cache_dir, max_mb * 1024 ** 2, '.npy', logger)
+
+    @property
+    def enabled(self):
+        return self.files.max_bytes > 0
+
+    @staticmethod
+    def get_key(audio0, version, is_half):
+        audio_hash = hashlib.blake2b(np.ascontiguousarray(audio0).view(np.uint8), digest_size=16).hexdigest()
+        key = '|'.join([audio_hash, audio0.dtype.str, version, 'half' if is_half else 'float'])
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get(self, key, device, dtype):
+        """returns the cached features as a (1, frames, channels) tensor on device, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        try:
+            # copy-on-write mapping: torch reads the pages straight from the file while converting to dtype / device
+            feats = np.load(self.files.get_path(key), mmap_mode='c')
+            self.files.touch(key)
+        except (OSError, ValueError):
+            return None
+
+        logger.debug(f'HuBERT feature cache hit: {key}')
+        return torch.from_numpy(feats).unsqueeze(0).to(device, dtype)
+
+    def put(self, key, feats):
+        """stores the (1, frames, channels) features and returns them as a later get returns them"""
+        if not self.enabled:
+            return feats
+
+        stored = feats[0].to(torch.float16).cpu().numpy()
+        self.files.write(key, lambda f: np.save(f, stored))
+        return torch.from_numpy(stored).unsqueeze(0).to(feats.device, feats.dtype)
+
+    def round(self, feats):
+        """returns feats as put would return them, for features that are not stored"""
+        if not self.enabled:
+            return feats
+        # float32 runs continue with the float16 values too, so a hit and a miss convert identically
+        return feats.to(torch.float16).to(feats.dtype)
+
+feature_cache = FeatureCache()
@@ -0,0 +1,154 @@
+# app/services/ai_cover/index_cache.py
+
+# default imports
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+# module imports
+from app.config import get_logger, Settings
+
+logger = get_logger(__name__)
+
+# approximate-search variants written by index_convert next to the original index
+APPROX_INDEX_KINDS = ('ivfpq', 'hnsw')
+
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_big_npy_path(file_index, signature):
+    """sidecar path of the reconstructed feature matrix, tagged with the size and mtime of the index file"""
+    size, mtime_ns = signature
+    return f'{os.path.splitext(file_index)[0]}.big_npy.{size}_{mtime_ns}.npy'
+
+
+def get_approx_index_path(file_index, kind):
+    return f'{os.path.splitext(file_index)[0]}.{kind}.index'
+
+
+def is_approx_index(path):
+    return any(path.endswith(f'.{kind}.index') for kind in APPROX_INDEX_KINDS)
+
+
+def set_search_params(index, nprobe=0, ef_search=0):
+    """sets nprobe of IVF indexes and efSearch of HNSW indexes, 0 keeps the value stored in the index"""
+    params = faiss.ParameterSpace()
+    if nprobe > 0 and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, 'nprobe', nprobe)
+    if ef_search > 0 and hasattr(faiss.downcast_index(index), 'hnsw'):
+        params.set_index_parameter(index, 'efSearch', ef_search)
+
+
+class IndexCache:
+    """
+    Keeps loaded faiss indexes and their reconstructed feature matrix (big_npy) per voice model.
+
+    big_npy is persisted as a .npy sidecar next to the index file the first time it is reconstructed and
+    memory-mapped afterwards, so other processes reuse it as well. Both the in-memory entry and the sidecar
+    are invalidated when the size or mtime of the index file changes.
+
+    With prefer set to one of APPROX_INDEX_KINDS, searches go to the approximate variant written by index_convert
+    when it exists and is newer than the original index; big_npy always comes from the original index.
+    """
+
+    def __init__(
+        self,
+        max_entries=Settings.FAISS_INDEX_CACHE_SIZE,
+        prefer=Settings.FAISS_INDEX_PREFER,
+        nprobe=Settings.FAISS_NPROBE,
+        ef_search=Settings.FAISS_EF_SEARCH,
+    ):
+        self.max_entries = max(max_entries, 1)
+        self.prefer = prefer
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_search_path(self, file_index, signature):
+        """path of the index used for searching: the preferred approximate variant if usable, else file_index"""
+        if self.prefer not in APPROX_INDEX_KINDS:
+            return file_index
+        approx_path = get_approx_index_path(file_index, self.prefer)
+        try:
+            if os.stat(approx_path).st_mtime_ns >= signature[1]:
+                return approx_path
+            logger.warning(f'Ignoring {approx_path}, it is older than {file_index}')
+        except OSError:
+            pass
+        return file_index
+
+    def load(self, file_index):
+        """returns (index, big_npy) for file_index"""
+        signature = get_file_signature(file_index)
+        search_path = self.get_search_path(file_index, signature)
+        # a rebuilt approximate variant invalidates the entry as well
+        search_signature = (search_path, get_file_signature(search_path))
+        with self._lock:
+            entry = self._entries.get(file_index)
+            if entry is not None and entry['signature'] == signature and entry['search_signature'] == search_signature:
+                self._entries.move_to_end(file_index)
+                return entry['index'], entry['big_npy']
+
+            index = faiss.read_index(search_path)
+            big_npy = self._load_big_npy(file_index, index if search_path == file_index else None, signature, index.ntotal)
+            if index.ntotal != big_npy.shape[0]:
+                logger.warning(f'Ignoring {search_path}, it does not match {file_index}')
+                index = faiss.read_index(file_index)
+            set_search_params(index, self.nprobe, self.ef_search)
+            self._entries[file_index] = {
+                'signature': signature,
+                'search_signature': search_signature,
+                'index': index,
+                'big_npy': big_npy,
+            }
+            self._entries.move_to_end(file_index)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            return index, big_npy
+
+    def _load_big_npy(self, file_index, index, signature, ntotal):
+        """index is the already loaded original index, or None to read it only when big_npy must be reconstructed"""
+        big_npy_path = get_big_npy_path(file_index, signature)
+        if os.path.exists(big_npy_path):
+            big_npy = np.load(big_npy_path, mmap_mode='r')
+            if big_npy.shape[0] == ntotal:
+                return big_npy
+            logger.warning(f'Ignoring mismatched feature sidecar {big_npy_path}')
+
+        logger.info(f'Reconstructing features of {file_index}')
+        if index is None:
+            index = faiss.read_index(file_index)
+        big_npy = index.reconstruct_n(0, index.ntotal)
+        try:
+            self._remove_stale_sidecars(file_index, big_npy_path)
+            # write to a temporary file first so concurrent processes never map a partial sidecar
+            tmp_path = f'{big_npy_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, big_npy)
+            os.replace(tmp_path, big_npy_path)
+            return np.load(big_npy_path, mmap_mode='r')
+        except OSError as e:
+            logger.warning(f'Unable to write feature sidecar {big_npy_path}: {e}')
+            return big_npy
+
+    @staticmethod
+    def _remove_stale_sidecars(file_index, big_npy_path):
+        for path in glob.glob(f'{glob.escape(os.path.splitext(file_index)[0])}.big_npy.*.npy'):
+            if path != big_npy_path:
+                os.remove(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+index_cache = IndexCache()
@@ -0,0 +1,164 @@
+# app/services/ai_cover/index_convert.py
+"""
+Builds approximate-search variants (IVF-PQ or HNSW) of a voice model index next to the original one and reports
+their recall and latency against exact search, to pick FAISS_INDEX_PREFER / FAISS_NPROBE / FAISS_EF_SEARCH.
+
+usage (from the repository root):
+    python -m app.services.ai_cover.index_convert <voice_model or .index path> --kind ivfpq hnsw --report
+"""
+
+# default imports
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+# module imports
+from app.config import get_logger
+from app.services.ai_cover.index_cache import (
+    APPROX_INDEX_KINDS,
+    get_approx_index_path,
+    index_cache,
+    set_search_params,
+)
+from app.services.ai_cover.retrieval import IndexRetriever
+
+logger = get_logger(__name__)
+
+
+def get_default_nlist(ntotal):
+    """number of IVF lists used by the RVC training script"""
+    return max(min(int(16 * np.sqrt(ntotal)), ntotal // 39), 1)
+
+
+def build_approx_index(big_npy, kind, nlist=0, pq_m=0, refine_k_factor=4, hnsw_m=32, ef_construction=40):
+    dim = big_npy.shape[1]
+    if kind == 'ivfpq':
+        # dim // 8 sub-quantizers of 8 bits. Without refinement, neighbours and the distances used as blend weights
+        # come from the PQ codes; with it, refine_k_factor * k candidates are re-ranked with exact distances
+        factory = f'IVF{nlist or get_default_nlist(big_npy.shape[0])},PQ{pq_m or dim // 8}'
+        index = faiss.index_factory(dim, f'{factory},RFlat' if refine_k_factor > 0 else factory)
+        index.train(big_npy)
+        if refine_k_factor > 0:
+            faiss.downcast_index(index).k_factor = refine_k_factor
+    elif kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        raise ValueError(f'Unknown index kind {kind}, expected one of {APPROX_INDEX_KINDS}')
+    index.add(big_npy)
+    return index
+
+
+def convert_index(file_index, kind, **params):
+    """writes the approximate variant of file_index and returns its path"""
+    _, big_npy = index_cache.load(file_index)
+    big_npy = np.ascontiguousarray(big_npy, dtype=np.float32)
+    start = time.perf_counter()
+    index = build_approx_index(big_npy, kind, **params)
+    approx_path = get_approx_index_path(file_index, kind)
+    tmp_path = f'{approx_path}.{os.getpid()}.tmp'
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, approx_path)
+    logger.info(f'Wrote {approx_path} in {time.perf_counter() - start:.1f}s')
+    return approx_path
+
+
+def get_queries(big_npy, n_queries, noise, seed=0):
+    """training features perturbed by gaussian noise of noise times their standard deviation"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(big_npy.shape[0], size=min(n_queries, big_npy.shape[0]), replace=False)
+    queries = np.asarray(big_npy[np.sort(rows)], dtype=np.float32)
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * noise * queries.std(axis=0)
+    return queries
+
+
+def evaluate(index, big_npy, queries, ground_truth, reference_blend, k=8):
+    """(recall@k, search ms per 1000 frames, relative error of the blended features) of index against exact search"""
+    start = time.perf_counter()
+    _, ix = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+    recall = np.mean([len(np.intersect1d(ix[i], ground_truth[i])) for i in range(queries.shape[0])]) / k
+    blend = IndexRetriever(index, big_npy, k=k).blend(queries)
+    error = np.linalg.norm(blend - reference_blend) / np.linalg.norm(reference_blend)
+    return recall, elapsed * 1000 / queries.shape[0] * 1000, error
+
+
+def get_param_values(index, nprobes, ef_searches):
+    if faiss.try_extract_index_ivf(index) is not None:
+        return [('nprobe', value) for value in nprobes]
+    if hasattr(faiss.downcast_index(index), 'hnsw'):
+        return [('efSearch', value) for value in ef_searches]
+    return []
+
+
+def report(file_index, kinds, nprobes, ef_searches, queries, k=8):
+    original, big_npy = faiss.read_index(file_index), index_cache.load(file_index)[1]
+    exact = faiss.IndexFlatL2(big_npy.shape[1])
+    exact.add(np.ascontiguousarray(big_npy, dtype=np.float32))
+    _, ground_truth = exact.search(queries, k)
+    reference_blend = IndexRetriever(exact, big_npy, k=k).blend(queries).copy()
+
+    candidates = [('flat', exact), ('original', original)]
+    for kind in kinds:
+        approx_path = get_approx_index_path(file_index, kind)
+        if os.path.exists(approx_path):
+            candidates.append((kind, faiss.read_index(approx_path)))
+
+    print(f'{file_index}: {big_npy.shape[0]}x{big_npy.shape[1]}, {queries.shape[0]} queries, k={k}')
+    print(f'{"index":>9} {"param":>14} {"recall":>7} {"ms/1k frames":>13} {"blend err":>10}')
+    for name, index in candidates:
+        for param_name, value in [('stored', None)] + get_param_values(index, nprobes, ef_searches):
+            if param_name == 'nprobe':
+                set_search_params(index, nprobe=value)
+            elif param_name == 'efSearch':
+                set_search_params(index, ef_search=value)
+            param = param_name if value is None else f'{param_name}={value}'
+            recall, latency, error = evaluate(index, big_npy, queries, ground_truth, reference_blend, k)
+            print(f'{name:>9} {param:>14} {recall:>7.3f} {latency:>13.2f} {error:>10.2e}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('index', help='voice model name or path of a .index file')
+    parser.add_argument('--kind', nargs='+', default=['ivfpq'], choices=APPROX_INDEX_KINDS)
+    parser.add_argument('--nlist', type=int, default=0, help='IVF lists (0 = same rule as RVC training)')
+    parser.add_argument('--pq-m', type=int, default=0, help='PQ sub-quantizers (0 = dim // 8)')
+    parser.add_argument('--refine-k-factor', type=int, default=4, help='IVF-PQ candidates re-ranked exactly per neighbour (0 = none)')
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-construction', type=int, default=40)
+    parser.add_argument('--report', action='store_true', help='print recall and latency against exact search')
+    parser.add_argument('--no-build', action='store_true', help='only report on existing variants')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128])
+    parser.add_argument('--queries', help='.npy of (frames, dim) HuBERT features to query with')
+    parser.add_argument('--n-queries', type=int, default=4000)
+    parser.add_argument('--noise', type=float, default=0.5, help='noise of the default queries drawn from the index')
+    args = parser.parse_args()
+
+    file_index = args.index
+    if not os.path.isfile(file_index):
+        from app.services.ai_cover.ai_cover import get_rvc_model
+        file_index = get_rvc_model(args.index)[1]
+        if not file_index:
+            parser.error(f'Voice model {args.index} has no index')
+
+    if not args.no_build:
+        for kind in args.kind:
+            if kind == 'ivfpq':
+                convert_index(file_index, kind, nlist=args.nlist, pq_m=args.pq_m, refine_k_factor=args.refine_k_factor)
+            else:
+                convert_index(file_index, kind, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction)
+
+    if args.report:
+        if args.queries:
+            queries = np.ascontiguousarray(np.load(args.queries), dtype=np.float32)
+        else:
+            queries = get_queries(index_cache.load(file_index)[1], args.n_queries, args.noise)
+        report(file_index, args.kind, args.nprobe, args.ef_search, queries)
+
+
+if __name__ == '__main__':
+    main()
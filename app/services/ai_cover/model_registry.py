@@ -0,0 +1,175 @@
+# app/services/ai_cover/model_registry.py
+
+# default imports
+import gc
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import torch
+
+# module imports
+from app.config import get_logger, Settings
+from app.services.ai_cover.rmvpe import RMVPE
+from app.services.ai_cover.rvc import Config, load_hubert, get_vc
+
+logger = get_logger(__name__)
+
+
+def get_model_size(model):
+    """returns the number of bytes held by the parameters and buffers of a torch module"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of the models used by voice_change.
+
+    HuBERT and RMVPE are loaded once per device and kept resident, shared by every voice model. Voice model
+    generators are kept in an LRU keyed by the voice model folder and the mtime of its .pth file, so replacing a
+    model on disk loads the new weights. Generators are evicted least recently used first once their total size
+    exceeds max_memory_mb.
+
+    Models are loaded outside the registry lock: a request loading one model does not block requests for models
+    that are already loaded, and concurrent requests for the model being loaded wait for that single load.
+    """
+
+    def __init__(self, max_memory_mb=Settings.RVC_MODEL_CACHE_MB, hubert_path=None, rmvpe_path=None):
+        self.max_memory = max_memory_mb * 1024 ** 2
+        self.hubert_path = hubert_path or os.path.join(Settings.RVC_MODELS_DIR, 'hubert_base.pt')
+        self.rmvpe_path = rmvpe_path or os.path.join(Settings.RVC_MODELS_DIR, 'rmvpe.pt')
+        self._lock = threading.RLock()
+        self._configs = {}
+        self._huberts = {}
+        self._rmvpes = {}
+        self._voice_models = OrderedDict()
+        self._loading = {}
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_config(self, device, is_half):
+        with self._lock:
+            key = (device, is_half)
+            if key not in self._configs:
+                self._configs[key] = Config(device, is_half)
+            return self._configs[key]
+
+    def _get_resident(self, models, key, load):
+        """returns models[key], the first caller runs load() outside the lock and the others wait for its result"""
+        with self._lock:
+            future = models.get(key)
+            loader = future is None
+            if loader:
+                future = models[key] = Future()
+        if loader:
+            try:
+                future.set_result(load())
+            except Exception as e:
+                with self._lock:
+                    del models[key]
+                future.set_exception(e)
+        return future.result()
+
+    def get_hubert(self, config):
+        def load():
+            logger.info(f'Loading HuBERT on {config.device}')
+            return load_hubert(config.device, config.is_half, self.hubert_path)
+
+        return self._get_resident(self._huberts, (config.device, config.is_half), load)
+
+    def get_rmvpe(self, device, is_half):
+        def load():
+            logger.info(f'Loading RMVPE on {device}')
+            return RMVPE(
+                self.rmvpe_path, is_half=is_half, device=device,
+                decode_on_device=Settings.RMVPE_DECODE_ON_DEVICE,
+                max_frames=Settings.RMVPE_MAX_FRAMES,
+                overlap_frames=Settings.RMVPE_OVERLAP_FRAMES,
+            )
+
+        return self._get_resident(self._rmvpes, (device, is_half), load)
+
+    def get_voice_model(self, config, voice_model, model_path):
+        """returns (cpt, version, net_g, tgt_sr, vc) for the voice model, loading it on a miss"""
+        key = (voice_model, os.path.getmtime(model_path), config.device, config.is_half)
+        with self._lock:
+            entry = self._voice_models.get(key)
+            if entry is not None:
+                self._voice_models.move_to_end(key)
+                self.hits += 1
+                logger.debug(f'Voice model cache hit: {voice_model}')
+                return entry['model']
+
+            self.misses += 1
+            future = self._loading.get(key)
+            loader = future is None
+            if loader:
+                future = self._loading[key] = Future()
+        if not loader:
+            logger.debug(f'Voice model cache miss: waiting for {voice_model} to load')
+            return future.result()
+
+        logger.info(f'Voice model cache miss: loading {model_path}')
+        try:
+            cpt, version, net_g, tgt_sr, vc = get_vc(config.device, config.is_half, config, model_path)
+        except Exception as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        # the state dict has been copied into net_g, keep only the metadata
+        cpt = {k: v for k, v in cpt.items() if k != 'weight'}
+        size = get_model_size(net_g)
+
+        with self._lock:
+            del self._loading[key]
+            # drop stale entries of the same voice model, e.g. after the .pth file was replaced
+            for stale_key in [k for k in self._voice_models if k[0] == voice_model and k[2:] == key[2:]]:
+                self._evict(stale_key)
+
+            model = (cpt, version, net_g, tgt_sr, vc)
+            self._voice_models[key] = {'model': model, 'size': size}
+            self.memory += size
+            while self.memory > self.max_memory and len(self._voice_models) > 1:
+                self._evict(next(iter(self._voice_models)))
+
+        future.set_result(model)
+        return model
+
+    def _evict(self, key):
+        entry = self._voice_models.pop(key)
+        self.memory -= entry['size']
+        self.evictions += 1
+        logger.info(f'Evicting voice model {key[0]} from cache')
+        del entry
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'memory_mb': round(self.memory / 1024 ** 2, 2),
+                'max_memory_mb': round(self.max_memory / 1024 ** 2, 2),
+                'voice_models': [k[0] for k in self._voice_models],
+                'hubert_loaded': bool(self._huberts),
+                'rmvpe_loaded': bool(self._rmvpes),
+            }
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._voice_models):
+                self._evict(key)
+            self._huberts.clear()
+            self._rmvpes.clear()
+            gc.collect()
+
+
+model_registry = ModelRegistry()
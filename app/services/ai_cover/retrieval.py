@@ -0,0 +1,64 @@
+# app/services/ai_cover/retrieval.py
+
+# default imports
+import numpy as np
+
+
+class IndexRetriever:
+    """
+    Replaces HuBERT features by the weighted average of their k nearest neighbours in a voice model index.
+
+    The neighbours are gathered one rank at a time into a preallocated (frames, dim) buffer and accumulated into
+    the output, instead of materialising big_npy[ix] as a (frames, k, dim) temporary. Query, distance, label and
+    output buffers grow to the largest request seen and are reused, so a retriever is meant to be used by one
+    thread for all segments of a song. Arrays returned by blend and blend_many are views of these buffers and are
+    only valid until the next call.
+    """
+
+    def __init__(self, index, big_npy, k=8):
+        self.index = index
+        self.big_npy = big_npy
+        self.k = k
+        self.dim = big_npy.shape[1]
+        self._capacity = 0
+
+    def _reserve(self, n_frames):
+        if n_frames <= self._capacity:
+            return
+        self._capacity = n_frames
+        self._query = np.empty((n_frames, self.dim), dtype=np.float32)
+        self._score = np.empty((n_frames, self.k), dtype=np.float32)
+        self._ix = np.empty((n_frames, self.k), dtype=np.int64)
+        self._gather = np.empty((n_frames, self.dim), dtype=np.float32)
+        self._out = np.empty((n_frames, self.dim), dtype=np.float32)
+
+    def _blend(self, n_frames):
+        query, score, ix = self._query[:n_frames], self._score[:n_frames], self._ix[:n_frames]
+        gather, out = self._gather[:n_frames], self._out[:n_frames]
+        self.index.search(query, self.k, D=score, I=ix)
+        weight = np.square(1 / score)
+        weight /= weight.sum(axis=1, keepdims=True)
+        # same accumulation order as np.sum(big_npy[ix] * weight[:, :, None], axis=1)
+        for j in range(self.k):
+            np.take(self.big_npy, ix[:, j], axis=0, out=gather, mode="wrap")
+            if j == 0:
+                np.multiply(gather, weight[:, :1], out=out)
+            else:
+                gather *= weight[:, j : j + 1]
+                out += gather
+        return out
+
+    def blend(self, npy):
+        """blended features of one (frames, dim) feature matrix"""
+        self._reserve(npy.shape[0])
+        np.copyto(self._query[: npy.shape[0]], npy)
+        return self._blend(npy.shape[0])
+
+    def blend_many(self, npys):
+        """blend over several feature matrices with a single index search, returned in input order"""
+        offsets = np.cumsum([0] + [npy.shape[0] for npy in npys])
+        self._reserve(offsets[-1])
+        for npy, start, end in zip(npys, offsets[:-1], offsets[1:]):
+            np.copyto(self._query[start:end], npy)
+        out = self._blend(offsets[-1])
+        return [out[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
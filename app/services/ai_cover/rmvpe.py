@@ -326,7 +326,7 @@ class MelSpectrogram(torch.nn.Module):
 
 
 class RMVPE:
-    def __init__(self, model_path, is_half, device=None):
+    def __init__(self, model_path, is_half, device=None, decode_on_device=False, max_frames=0, overlap_frames=128):
         self.resample_kernel = {}
         model = E2E(4, 1, (2, 2))
         ckpt = torch.load(model_path, map_location="cpu")
@@ -346,6 +346,14 @@ class RMVPE:
         self.model = self.model.to(device)
         cents_mapping = 20 * np.arange(360) + 1997.3794084376191
         self.cents_mapping = np.pad(cents_mapping, (4, 4))  # 368
+        # decode the salience with torch on self.device instead of copying it back to the host first
+        self.decode_on_device = decode_on_device
+        self.cents_mapping_tensors = {}
+        # run the network over windows of at most max_frames frames (0 = whole audio at once)
+        if max_frames and max_frames <= overlap_frames:
+            raise ValueError("max_frames must be larger than overlap_frames")
+        self.max_frames = max_frames
+        self.overlap_frames = overlap_frames
 
     def mel2hidden(self, mel):
         with torch.no_grad():
@@ -356,26 +364,69 @@ class RMVPE:
             hidden = self.model(mel)
             return hidden[:, :n_frames]
 
+    def audio2hidden_chunked(self, audio):
+        """
+        Salience of (1, n_samples) audio computed over overlapping windows of max_frames frames.
+
+        Each window gets its mel spectrogram from a slice of the reflect-padded audio (identical to the frames
+        of the one-shot spectrogram) and the salience of neighbouring windows is linearly crossfaded over
+        overlap_frames, so peak memory depends on max_frames instead of the length of the audio.
+        """
+        n_fft = self.mel_extractor.n_fft
+        hop = self.mel_extractor.hop_length
+        n_frames = audio.shape[-1] // hop + 1
+        audio = F.pad(audio.unsqueeze(0), (n_fft // 2, n_fft // 2), mode="reflect").squeeze(0)
+
+        overlap = self.overlap_frames
+        fade_in = torch.arange(1, overlap + 1, device=audio.device) / (overlap + 1)
+        hidden = torch.zeros(n_frames, 360, device=audio.device)
+        weights = torch.zeros(n_frames, 1, device=audio.device)
+        for start in range(0, n_frames, self.max_frames - overlap):
+            end = min(start + self.max_frames, n_frames)
+            mel = self.mel_extractor(audio[:, start * hop : (end - 1) * hop + n_fft], center=False)
+            chunk = self.mel2hidden(mel).squeeze(0).float()
+            weight = torch.ones(end - start, 1, device=audio.device)
+            if start > 0:
+                weight[:overlap, 0] = fade_in
+            if end < n_frames:
+                weight[-overlap:, 0] = fade_in.flip(0)
+            hidden[start:end] += chunk * weight
+            weights[start:end] += weight
+            del mel, chunk
+            if end == n_frames:
+                break
+        return hidden / weights
+
     def decode(self, hidden, thred=0.03):
-        cents_pred = self.to_local_average_cents(hidden, thred=thred)
+        if isinstance(hidden, torch.Tensor):
+            cents_pred = self.to_local_average_cents_torch(hidden, thred=thred)
+        else:
+            cents_pred = self.to_local_average_cents(hidden, thred=thred)
         f0 = 10 * (2 ** (cents_pred / 1200))
         f0[f0 == 10] = 0
         # f0 = np.array([10 * (2 ** (cent_pred / 1200)) if cent_pred else 0 for cent_pred in cents_pred])
+        if isinstance(f0, torch.Tensor):
+            f0 = f0.cpu().numpy()
         return f0
 
     def infer_from_audio(self, audio, thred=0.03):
         audio = torch.from_numpy(audio).float().to(self.device).unsqueeze(0)
-        # torch.cuda.synchronize()
-        # t0=ttime()
-        mel = self.mel_extractor(audio, center=True)
-        # torch.cuda.synchronize()
-        # t1=ttime()
-        hidden = self.mel2hidden(mel)
-        # torch.cuda.synchronize()
-        # t2=ttime()
-        hidden = hidden.squeeze(0).cpu().numpy()
-        if self.is_half == True:
-            hidden = hidden.astype("float32")
+        if self.max_frames and audio.shape[-1] // self.mel_extractor.hop_length + 1 > self.max_frames:
+            hidden = self.audio2hidden_chunked(audio)
+        else:
+            # torch.cuda.synchronize()
+            # t0=ttime()
+            mel = self.mel_extractor(audio, center=True)
+            # torch.cuda.synchronize()
+            # t1=ttime()
+            hidden = self.mel2hidden(mel)
+            # torch.cuda.synchronize()
+            # t2=ttime()
+            hidden = hidden.squeeze(0)
+        if not self.decode_on_device:
+            hidden = hidden.cpu().numpy()
+            if self.is_half == True:
+                hidden = hidden.astype("float32")
         f0 = self.decode(hidden, thred=thred)
         # torch.cuda.synchronize()
         # t3=ttime()
@@ -388,16 +439,11 @@ class RMVPE:
         salience = np.pad(salience, ((0, 0), (4, 4)))  # 帧长,368
         # t1 = ttime()
         center += 4
-        todo_salience = []
-        todo_cents_mapping = []
-        starts = center - 4
-        ends = center + 5
-        for idx in range(salience.shape[0]):
-            todo_salience.append(salience[:, starts[idx] : ends[idx]][idx])
-            todo_cents_mapping.append(self.cents_mapping[starts[idx] : ends[idx]])
+        # gather the 9 bins around the peak of every frame at once
+        window = center[:, None] + np.arange(-4, 5)  # 帧长，9
         # t2 = ttime()
-        todo_salience = np.array(todo_salience)  # 帧长，9
-        todo_cents_mapping = np.array(todo_cents_mapping)  # 帧长，9
+        todo_salience = np.take_along_axis(salience, window, axis=1)  # 帧长，9
+        todo_cents_mapping = self.cents_mapping[window]  # 帧长，9
         product_sum = np.sum(todo_salience * todo_cents_mapping, 1)
         weight_sum = np.sum(todo_salience, 1)  # 帧长
         devided = product_sum / weight_sum  # 帧长
@@ -407,3 +453,25 @@ class RMVPE:
         # t4 = ttime()
         # print("decode:%s\t%s\t%s\t%s" % (t1 - t0, t2 - t1, t3 - t2, t4 - t3))
         return devided
+
+    def to_local_average_cents_torch(self, salience, thred=0.05):
+        """to_local_average_cents on a (frames, 360) tensor, computed on the tensor's device.
+        Matches the numpy path up to float32 rounding of the weight sum."""
+        device = salience.device
+        # cents are accumulated in float64 like the numpy path, except on mps which has no float64 support
+        dtype = torch.float32 if device.type == "mps" else torch.float64
+        if device not in self.cents_mapping_tensors:
+            self.cents_mapping_tensors[device] = torch.from_numpy(self.cents_mapping).to(device, dtype)
+        cents_mapping = self.cents_mapping_tensors[device]
+        salience = salience.float()
+        center = torch.argmax(salience, dim=1)  # 帧长#index
+        salience = F.pad(salience, (4, 4))  # 帧长,368
+        window = center[:, None] + 4 + torch.arange(-4, 5, device=device)  # 帧长，9
+        todo_salience = torch.gather(salience, 1, window)  # 帧长，9
+        todo_cents_mapping = cents_mapping[window]  # 帧长，9
+        product_sum = torch.sum(todo_salience.to(dtype) * todo_cents_mapping, 1)
+        weight_sum = torch.sum(todo_salience, 1)  # 帧长
+        devided = product_sum / weight_sum  # 帧长
+        maxx = torch.max(salience, dim=1).values  # 帧长
+        devided[maxx <= thred] = 0
+        return devided
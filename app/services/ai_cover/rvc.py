@@ -1,6 +1,9 @@
+import os
+import threading
 from multiprocessing import cpu_count
 from pathlib import Path
 
+import soundfile as sf
 import torch
 from fairseq import checkpoint_utils
 from scipy.io import wavfile
@@ -11,6 +14,7 @@ from app.services.ai_cover.infer_pack.models import (
     SynthesizerTrnMs768NSFsid,
     SynthesizerTrnMs768NSFsid_nono,
 )
+from app.config import Settings
 from .my_utils import load_audio
 from .vc_infer_pipeline import VC
 
@@ -143,9 +147,24 @@ def get_vc(device, is_half, config, model_path):
     return cpt, version, net_g, tgt_sr, vc
 
 
-def rvc_infer(index_path, index_rate, input_path, output_path, pitch_change, f0_method, cpt, version, net_g, filter_radius, tgt_sr, rms_mix_rate, protect, crepe_hop_length, vc, hubert_model):
+def rvc_infer(index_path, index_rate, input_path, output_path, pitch_change, f0_method, cpt, version, net_g, filter_radius, tgt_sr, rms_mix_rate, protect, crepe_hop_length, vc, hubert_model, stream=Settings.RVC_STREAM_OUTPUT):
     audio = load_audio(input_path, 16000)
     times = [0, 0, 0]
     if_f0 = cpt.get('f0', 1)
+    if stream:
+        # converted segments are appended to a temporary file as soon as they are ready, which only replaces
+        # output_path once the whole song is converted so a failed conversion never leaves partial vocals behind
+        tmp_path = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with sf.SoundFile(tmp_path, 'w', samplerate=tgt_sr, channels=1, format='WAV', subtype='PCM_16') as f:
+                for audio_seg in vc.pipeline_stream(hubert_model, net_g, 0, audio, input_path, times, pitch_change, f0_method, index_path, index_rate, if_f0, filter_radius, tgt_sr, 0, rms_mix_rate, version, protect, crepe_hop_length):
+                    f.write(audio_seg)
+                    f.flush()
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return
+
     audio_opt = vc.pipeline(hubert_model, net_g, 0, audio, input_path, times, pitch_change, f0_method, index_path, index_rate, if_f0, filter_radius, tgt_sr, 0, rms_mix_rate, version, protect, crepe_hop_length)
     wavfile.write(output_path, tgt_sr, audio_opt)
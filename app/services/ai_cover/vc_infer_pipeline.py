@@ -1,12 +1,10 @@
-from functools import lru_cache
+import itertools
 from time import time as ttime
 
-import faiss
 import librosa
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import os
-import parselmouth
-import pyworld
 import sys
 import torch
 import torch.nn.functional as F
@@ -16,49 +14,33 @@ from scipy import signal
 from torch import Tensor
 
 from app.config import Settings
+from app.services.ai_cover.index_cache import index_cache
+from app.services.ai_cover.retrieval import IndexRetriever
+from app.services.ai_cover.f0_pool import f0_pool
+from app.services.ai_cover.f0_cache import f0_cache
+from app.services.ai_cover.feature_cache import feature_cache
+from app.services.audio.rms import change_rms, RMSMatcher
+from app.services.audio.resample import resample, StreamResampler
+from app.services.audio.limiter import limit_peaks
+from app.services.metrics.metrics import stage
+from app.services.job_queue.stage_limiter import stage_limit
 
 now_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(now_dir)
 
 bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
 
-input_audio_path2wav = {}
-
-
-@lru_cache
-def cache_harvest_f0(input_audio_path, fs, f0max, f0min, frame_period):
-    audio = input_audio_path2wav[input_audio_path]
-    f0, t = pyworld.harvest(
-        audio,
-        fs=fs,
-        f0_ceil=f0max,
-        f0_floor=f0min,
-        frame_period=frame_period,
-    )
-    f0 = pyworld.stonemask(audio, f0, t, fs)
-    return f0
-
-
-def change_rms(data1, sr1, data2, sr2, rate):  # 1是输入音频，2是输出音频,rate是2的占比
-    # print(data1.max(),data2.max())
-    rms1 = librosa.feature.rms(
-        y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2
-    )  # 每半秒一个点
-    rms2 = librosa.feature.rms(y=data2, frame_length=sr2 // 2 * 2, hop_length=sr2 // 2)
-    rms1 = torch.from_numpy(rms1)
-    rms1 = F.interpolate(
-        rms1.unsqueeze(0), size=data2.shape[0], mode="linear"
-    ).squeeze()
-    rms2 = torch.from_numpy(rms2)
-    rms2 = F.interpolate(
-        rms2.unsqueeze(0), size=data2.shape[0], mode="linear"
-    ).squeeze()
-    rms2 = torch.max(rms2, torch.zeros_like(rms2) + 1e-6)
-    data2 *= (
-        torch.pow(rms1, torch.tensor(1 - rate))
-        * torch.pow(rms2, torch.tensor(rate - 1))
-    ).numpy()
-    return data2
+def get_opt_ts(audio, window, t_center, t_query):
+    """cut points near every multiple of t_center: the sample within t_query whose window-long moving sum is closest to zero"""
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+    audio_sum = np.abs(np.convolve(audio_pad, np.ones(window, dtype=audio_pad.dtype), mode="valid")[: audio.shape[0]])
+    ts = np.arange(t_center, audio.shape[0], t_center)
+    if ts.shape[0] == 0:
+        return []
+    # the last window may run past the end, inf keeps argmin inside the audio
+    audio_sum = np.concatenate([audio_sum, np.full(t_query, np.inf, dtype=audio_sum.dtype)])
+    windows = sliding_window_view(audio_sum, 2 * t_query)[ts - t_query]
+    return (ts - t_query + np.argmin(windows, axis=1)).tolist()
 
 
 class VC(object):
@@ -80,6 +62,11 @@ class VC(object):
         self.t_max = self.sr * self.x_max  # 免查询时长阈值
         self.device = config.device
 
+    def sync(self):
+        """waits for queued GPU work, so that stage metrics attribute it to the stage that queued it"""
+        if str(self.device).startswith("cuda"):
+            torch.cuda.synchronize(self.device)
+
     # Fork Feature: Get the best torch device to use for f0 algorithms that require a torch device. Will return the type (torch.device)
     def get_optimal_torch_device(self, index: int = 0) -> torch.device:
         # Get cuda device
@@ -195,20 +182,18 @@ class VC(object):
         print("Calculating f0 pitch estimations for methods: %s" % str(methods))
         x = x.astype(np.float32)
         x /= np.quantile(np.abs(x), 0.999)
+        # start the CPU methods in the f0 process pool first, they run while crepe runs here
+        pending = {}
+        for method in methods:
+            if method == "pm":
+                pending[method] = f0_pool.submit(method, x, self.sr, time_step, f0_min, f0_max)
+            elif method in ("harvest", "dio"):
+                pending[method] = f0_pool.submit(method, x, self.sr, 10, f0_min, f0_max)
         # Get f0 calculations for all methods specified
         for method in methods:
             f0 = None
             if method == "pm":
-                f0 = (
-                    parselmouth.Sound(x, self.sr)
-                    .to_pitch_ac(
-                        time_step=time_step / 1000,
-                        voicing_threshold=0.6,
-                        pitch_floor=f0_min,
-                        pitch_ceiling=f0_max,
-                    )
-                    .selected_array["frequency"]
-                )
+                f0 = pending[method].result()
                 pad_size = (p_len - len(f0) + 1) // 2
                 if pad_size > 0 or p_len - len(f0) - pad_size > 0:
                     f0 = np.pad(
@@ -229,19 +214,12 @@ class VC(object):
                     x, f0_min, f0_max, p_len, crepe_hop_length, "tiny"
                 )
             elif method == "harvest":
-                f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+                f0 = pending[method].result()
                 if filter_radius > 2:
                     f0 = signal.medfilt(f0, 3)
                 f0 = f0[1:]  # Get rid of first frame.
             elif method == "dio":  # Potentially buggy?
-                f0, t = pyworld.dio(
-                    x.astype(np.double),
-                    fs=self.sr,
-                    f0_ceil=f0_max,
-                    f0_floor=f0_min,
-                    frame_period=10,
-                )
-                f0 = pyworld.stonemask(x.astype(np.double), f0, t, self.sr)
+                f0 = pending[method].result()
                 f0 = signal.medfilt(f0, 3)
                 f0 = f0[1:]
             # elif method == "pyin": Not Working just yet
@@ -260,53 +238,31 @@ class VC(object):
             f0_median_hybrid = np.nanmedian(f0_computation_stack, axis=0)
         return f0_median_hybrid
 
-    def get_f0(
+    def get_raw_f0(
         self,
         input_audio_path,
         x,
         p_len,
-        f0_up_key,
         f0_method,
         filter_radius,
         crepe_hop_length,
-        inp_f0=None,
     ):
-        global input_audio_path2wav
         time_step = self.window / self.sr * 1000
         f0_min = 50
         f0_max = 1100
-        f0_mel_min = 1127 * np.log(1 + f0_min / 700)
-        f0_mel_max = 1127 * np.log(1 + f0_max / 700)
         if f0_method == "pm":
-            f0 = (
-                parselmouth.Sound(x, self.sr)
-                .to_pitch_ac(
-                    time_step=time_step / 1000,
-                    voicing_threshold=0.6,
-                    pitch_floor=f0_min,
-                    pitch_ceiling=f0_max,
-                )
-                .selected_array["frequency"]
-            )
+            f0 = f0_pool.compute("pm", x, self.sr, time_step, f0_min, f0_max)
             pad_size = (p_len - len(f0) + 1) // 2
             if pad_size > 0 or p_len - len(f0) - pad_size > 0:
                 f0 = np.pad(
                     f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant"
                 )
         elif f0_method == "harvest":
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
-            f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+            f0 = f0_pool.compute("harvest", x, self.sr, 10, f0_min, f0_max)
             if filter_radius > 2:
                 f0 = signal.medfilt(f0, 3)
         elif f0_method == "dio":  # Potentially Buggy?
-            f0, t = pyworld.dio(
-                x.astype(np.double),
-                fs=self.sr,
-                f0_ceil=f0_max,
-                f0_floor=f0_min,
-                frame_period=10,
-            )
-            f0 = pyworld.stonemask(x.astype(np.double), f0, t, self.sr)
+            f0 = f0_pool.compute("dio", x, self.sr, 10, f0_min, f0_max)
             f0 = signal.medfilt(f0, 3)
         elif f0_method == "crepe":
             f0 = self.get_f0_official_crepe_computation(x, f0_min, f0_max)
@@ -321,17 +277,15 @@ class VC(object):
                 x, f0_min, f0_max, p_len, crepe_hop_length, "tiny"
             )
         elif f0_method == "rmvpe":
-            if hasattr(self, "model_rmvpe") == False:
-                from .rmvpe import RMVPE
+            # one RMVPE per device is shared by every cached voice model
+            from .model_registry import model_registry
 
-                self.model_rmvpe = RMVPE(
-                    os.path.join(Settings.RVC_MODELS_DIR, 'rmvpe.pt'), is_half=self.is_half, device=self.device
-                )
-            f0 = self.model_rmvpe.infer_from_audio(x, thred=0.03)
+            model_rmvpe = model_registry.get_rmvpe(self.device, self.is_half)
+            with stage_limit("rmvpe"):
+                f0 = model_rmvpe.infer_from_audio(x, thred=0.03)
 
         elif "hybrid" in f0_method:
             # Perform hybrid median pitch estimation
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
             f0 = self.get_f0_hybrid_computation(
                 f0_method,
                 input_audio_path,
@@ -343,8 +297,31 @@ class VC(object):
                 crepe_hop_length,
                 time_step,
             )
+        return f0
 
-        f0 *= pow(2, f0_up_key / 12)
+    def get_f0(
+        self,
+        input_audio_path,
+        x,
+        p_len,
+        f0_up_key,
+        f0_method,
+        filter_radius,
+        crepe_hop_length,
+        inp_f0=None,
+    ):
+        f0_min = 50
+        f0_max = 1100
+        f0_mel_min = 1127 * np.log(1 + f0_min / 700)
+        f0_mel_max = 1127 * np.log(1 + f0_max / 700)
+        # the contour before the key shift is shared by all voice models and pitch settings on these vocals
+        key = f0_cache.get_key(x, self.sr, self.window, f0_method, filter_radius, crepe_hop_length, self.is_half, self.device)
+        f0 = f0_cache.get(key)
+        if f0 is None:
+            f0 = self.get_raw_f0(input_audio_path, x, p_len, f0_method, filter_radius, crepe_hop_length)
+            f0 = f0_cache.put(key, f0)
+
+        f0 = f0 * pow(2, f0_up_key / 12)
         # with open("test.txt","w")as f:f.write("\n".join([str(i)for i in f0.tolist()]))
         tf0 = self.sr // self.window  # 每秒f0点数
         if inp_f0 is not None:
@@ -379,55 +356,58 @@ class VC(object):
         pitch,
         pitchf,
         times,
-        index,
-        big_npy,
+        retriever,
         index_rate,
         version,
         protect,
     ):  # ,file_index,file_big_npy
-        feats = torch.from_numpy(audio0)
-        if self.is_half:
-            feats = feats.half()
-        else:
-            feats = feats.float()
-        if feats.dim() == 2:  # double channels
-            feats = feats.mean(-1)
-        assert feats.dim() == 1, feats.dim()
-        feats = feats.view(1, -1)
-        padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
-
-        inputs = {
-            "source": feats.to(self.device),
-            "padding_mask": padding_mask,
-            "output_layer": 9 if version == "v1" else 12,
-        }
         t0 = ttime()
-        with torch.no_grad():
-            logits = model.extract_features(**inputs)
-            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
+        # HuBERT features don't depend on the voice model, they are reused across voices on the same vocals
+        key = feature_cache.get_key(audio0, version, self.is_half)
+        feats = feature_cache.get(key, self.device, torch.float16 if self.is_half else torch.float32)
+        if feats is None:
+            feats = self.extract_feats(model, audio0, version)
+            feats = feature_cache.put(key, feats)
+        index_feats = None
+        if retriever is not None and index_rate != 0:
+            with stage("faiss"):
+                index_feats = retriever.blend(feats[0].cpu().numpy())
+        feats, p_len, pitch, pitchf = self.prepare_feats(
+            feats, audio0.shape[0], pitch, pitchf, index_feats, index_rate, protect
+        )
+        t1 = ttime()
+        p_len = torch.tensor([p_len], device=self.device).long()
+        with stage_limit("generator"), stage("generator"), torch.no_grad():
+            if pitch != None and pitchf != None:
+                audio1 = (
+                    (net_g.infer(feats, p_len, pitch, pitchf, sid)[0][0, 0])
+                    .data.cpu()
+                    .float()
+                    .numpy()
+                )
+            else:
+                audio1 = (
+                    (net_g.infer(feats, p_len, sid)[0][0, 0]).data.cpu().float().numpy()
+                )
+        del feats, p_len
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        t2 = ttime()
+        times[0] += t1 - t0
+        times[2] += t2 - t1
+        return audio1
+
+    def prepare_feats(
+        self, feats, n_samples, pitch, pitchf, index_feats, index_rate, protect
+    ):
+        """blends HuBERT features of one segment with their retrieved index features (IndexRetriever output, or
+        None without index), upsamples them to f0 frames and applies protect.
+        Returns (feats, p_len, pitch, pitchf) ready for net_g.infer"""
         if protect < 0.5 and pitch != None and pitchf != None:
             feats0 = feats.clone()
-        if (
-            isinstance(index, type(None)) == False
-            and isinstance(big_npy, type(None)) == False
-            and index_rate != 0
-        ):
-            npy = feats[0].cpu().numpy()
-            if self.is_half:
-                npy = npy.astype("float32")
-
-            # _, I = index.search(npy, 1)
-            # npy = big_npy[I.squeeze()]
-
-            score, ix = index.search(npy, k=8)
-            weight = np.square(1 / score)
-            weight /= weight.sum(axis=1, keepdims=True)
-            npy = np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
-
-            if self.is_half:
-                npy = npy.astype("float16")
+        if index_feats is not None and index_rate != 0:
             feats = (
-                torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate
+                torch.from_numpy(index_feats).unsqueeze(0).to(self.device, feats.dtype) * index_rate
                 + (1 - index_rate) * feats
             )
 
@@ -436,8 +416,7 @@ class VC(object):
             feats0 = F.interpolate(feats0.permute(0, 2, 1), scale_factor=2).permute(
                 0, 2, 1
             )
-        t1 = ttime()
-        p_len = audio0.shape[0] // self.window
+        p_len = n_samples // self.window
         if feats.shape[1] < p_len:
             p_len = feats.shape[1]
             if pitch != None and pitchf != None:
@@ -451,50 +430,213 @@ class VC(object):
             pitchff = pitchff.unsqueeze(-1)
             feats = feats * pitchff + feats0 * (1 - pitchff)
             feats = feats.to(feats0.dtype)
-        p_len = torch.tensor([p_len], device=self.device).long()
-        with torch.no_grad():
+        return feats, p_len, pitch, pitchf
+
+    @staticmethod
+    def hubert_frames(n_samples):
+        """number of HuBERT frames produced for n_samples of 16 kHz audio by its conv feature extractor"""
+        for kernel, stride in [(10, 5)] + [(3, 2)] * 4 + [(2, 2)] * 2:
+            n_samples = (n_samples - kernel) // stride + 1
+        return n_samples
+
+    def extract_feats(self, model, audio0, version):
+        """HuBERT features of one segment as a (1, frames, channels) tensor"""
+        feats = torch.from_numpy(audio0)
+        if self.is_half:
+            feats = feats.half()
+        else:
+            feats = feats.float()
+        if feats.dim() == 2:  # double channels
+            feats = feats.mean(-1)
+        assert feats.dim() == 1, feats.dim()
+        feats = feats.view(1, -1)
+        padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
+
+        inputs = {
+            "source": feats.to(self.device),
+            "padding_mask": padding_mask,
+            "output_layer": 9 if version == "v1" else 12,
+        }
+        with stage_limit("hubert"), stage("hubert", sync=self.sync), torch.no_grad():
+            logits = model.extract_features(**inputs)
+            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
+        return feats
+
+    def extract_feats_batch(self, model, audios, version):
+        """
+        HuBERT over several segments at once, segments found in the feature cache are skipped.
+
+        HuBERT base normalises its first conv layer over time (GroupNorm), so padding a segment before the conv
+        feature extractor would change its features. The conv feature extractor therefore runs on every segment
+        alone, as in HubertModel.forward, and only the transformer runs once over the frames zero-padded to a
+        common length with a padding mask; padded frames are zeroed before its positional conv and masked out of
+        attention, so every segment gets the features of the sequential path up to float rounding. Padded
+        segments are still not cached, so a batched run never decides what later sequential runs read.
+        """
+        dtype = torch.float16 if self.is_half else torch.float32
+        keys = [feature_cache.get_key(audio0, version, self.is_half) for audio0 in audios]
+        feats_list = [feature_cache.get(key, self.device, dtype) for key in keys]
+        missing = [i for i, feats in enumerate(feats_list) if feats is None]
+        if not missing:
+            return feats_list
+
+        with stage_limit("hubert"), stage("hubert", sync=self.sync), torch.no_grad():
+            frames = []
+            for i in missing:
+                source = torch.from_numpy(audios[i]).to(self.device, dtype).view(1, -1)
+                features = model.forward_features(source).transpose(1, 2)
+                features = model.layer_norm(features)
+                if model.post_extract_proj is not None:
+                    features = model.post_extract_proj(features)
+                frames.append(model.dropout_input(features)[0])
+
+            n_frames = [f.shape[0] for f in frames]
+            x = torch.nn.utils.rnn.pad_sequence(frames, batch_first=True)
+            padding_mask = torch.arange(x.shape[1], device=self.device)[None, :] >= torch.tensor(n_frames, device=self.device)[:, None]
+            x, _ = model.encoder(x, padding_mask=padding_mask, layer=(9 if version == "v1" else 12) - 1)
+            batch_feats = model.final_proj(x) if version == "v1" else x
+
+        for j, i in enumerate(missing):
+            feats = batch_feats[j : j + 1, : n_frames[j]]
+            # only unpadded features are stored: the cache is shared with the sequential path
+            feats_list[i] = feature_cache.put(keys[i], feats) if n_frames[j] == x.shape[1] else feature_cache.round(feats)
+        return feats_list
+
+    @staticmethod
+    def retrieve_batch(retriever, feats_list, index_rate):
+        """index features of several segments from a single search, None per segment without index"""
+        if retriever is None or index_rate == 0:
+            return [None] * len(feats_list)
+        with stage("faiss"):
+            return retriever.blend_many([feats[0].cpu().numpy() for feats in feats_list])
+
+    def infer_batch(
+        self, net_g, sid, lengths, feats_list, pitches, pitchfs, index_feats, index_rate, protect
+    ):
+        """index blending and protect per segment, then net_g.infer once over the batch with the feature lengths as
+        mask. Every output is cut back to its own length"""
+        feats_out, p_lens, pitch_list, pitchf_list = [], [], [], []
+        for i in range(len(feats_list)):
+            pitch = pitches[i] if pitches is not None else None
+            pitchf = pitchfs[i] if pitchfs is not None else None
+            feats, p_len, pitch, pitchf = self.prepare_feats(
+                feats_list[i], lengths[i], pitch, pitchf, index_feats[i], index_rate, protect
+            )
+            feats_out.append(feats[0, :p_len])
+            p_lens.append(p_len)
             if pitch != None and pitchf != None:
-                audio1 = (
-                    (net_g.infer(feats, p_len, pitch, pitchf, sid)[0][0, 0])
-                    .data.cpu()
-                    .float()
-                    .numpy()
-                )
+                pitch_list.append(pitch[0, :p_len])
+                pitchf_list.append(pitchf[0, :p_len])
+
+        feats = torch.nn.utils.rnn.pad_sequence(feats_out, batch_first=True)
+        p_len = torch.tensor(p_lens, device=self.device).long()
+        sid = sid.repeat(len(feats_list))
+        with stage_limit("generator"), stage("generator"), torch.no_grad():
+            if pitch_list:
+                pitch = torch.nn.utils.rnn.pad_sequence(pitch_list, batch_first=True)
+                pitchf = torch.nn.utils.rnn.pad_sequence(pitchf_list, batch_first=True)
+                audio1 = net_g.infer(feats, p_len, pitch, pitchf, sid)[0][:, 0]
             else:
-                audio1 = (
-                    (net_g.infer(feats, p_len, sid)[0][0, 0]).data.cpu().float().numpy()
-                )
-        del feats, p_len, padding_mask
+                audio1 = net_g.infer(feats, p_len, sid)[0][:, 0]
+            audio1 = audio1.data.cpu().float().numpy()
+        upp = audio1.shape[-1] // feats.shape[1]
+        audio_opt = [audio1[i, : p_lens[i] * upp] for i in range(len(feats_list))]
+        del feats, p_len
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        t2 = ttime()
-        times[0] += t1 - t0
-        times[2] += t2 - t1
-        return audio1
+        return audio_opt
 
-    def pipeline(
+    def vc_batch(
         self,
         model,
         net_g,
         sid,
-        audio,
-        input_audio_path,
+        audios,
+        pitches,
+        pitchfs,
         times,
-        f0_up_key,
-        f0_method,
-        file_index,
-        # file_big_npy,
+        retriever,
         index_rate,
-        if_f0,
-        filter_radius,
-        tgt_sr,
-        resample_sr,
-        rms_mix_rate,
         version,
         protect,
-        crepe_hop_length,
-        f0_file=None,
     ):
+        """VC.vc over several segments at once, see extract_feats_batch and infer_batch"""
+        lengths = [audio0.shape[0] for audio0 in audios]
+        t0 = ttime()
+        feats_list = self.extract_feats_batch(model, audios, version)
+        index_feats = self.retrieve_batch(retriever, feats_list, index_rate)
+        t1 = ttime()
+        audio_opt = self.infer_batch(
+            net_g, sid, lengths, feats_list, pitches, pitchfs, index_feats, index_rate, protect
+        )
+        t2 = ttime()
+        times[0] += t1 - t0
+        times[2] += t2 - t1
+        return audio_opt
+
+    def vc_segments_batched(
+        self, model, net_g, sid, segments, batch_size, times, retriever, index_rate, version, protect, search_all=False
+    ):
+        """
+        converts segments batch_size at a time and returns the trimmed outputs in segment order. Segments are
+        batched by length to keep padding small.
+
+        With search_all, HuBERT features of every segment are extracted first and the index is searched once for
+        the whole song before running the generator, at the cost of keeping all features in memory.
+        """
+        audio_opt = [None] * len(segments)
+        order = sorted(range(len(segments)), key=lambda i: segments[i][0].shape[0])
+        batches = [order[b : b + batch_size] for b in range(0, len(order), batch_size)]
+        for i, output in self.iter_batches(
+            model, net_g, sid, segments, batches, times, retriever, index_rate, version, protect, search_all
+        ):
+            audio_opt[i] = output
+        return audio_opt
+
+    def iter_batches(
+        self, model, net_g, sid, segments, batches, times, retriever, index_rate, version, protect, search_all=False
+    ):
+        """converts segments in the given batches of segment indices, yields (index, trimmed output) per segment"""
+        has_f0 = segments[0][1] is not None
+
+        if search_all:
+            t0 = ttime()
+            feats_list = [None] * len(segments)
+            for batch in batches:
+                batch_feats = self.extract_feats_batch(model, [segments[i][0] for i in batch], version)
+                for i, feats in zip(batch, batch_feats):
+                    feats_list[i] = feats
+            index_feats = self.retrieve_batch(retriever, feats_list, index_rate)
+            t1 = ttime()
+            times[0] += t1 - t0
+
+        for batch in batches:
+            audios = [segments[i][0] for i in batch]
+            pitches = [segments[i][1] for i in batch] if has_f0 else None
+            pitchfs = [segments[i][2] for i in batch] if has_f0 else None
+            if search_all:
+                t1 = ttime()
+                outputs = self.infer_batch(
+                    net_g,
+                    sid,
+                    [audio0.shape[0] for audio0 in audios],
+                    [feats_list[i] for i in batch],
+                    pitches,
+                    pitchfs,
+                    [index_feats[i] for i in batch],
+                    index_rate,
+                    protect,
+                )
+                times[2] += ttime() - t1
+            else:
+                outputs = self.vc_batch(
+                    model, net_g, sid, audios, pitches, pitchfs, times, retriever, index_rate, version, protect
+                )
+            for i, output in zip(batch, outputs):
+                yield i, output[self.t_pad_tgt : -self.t_pad_tgt]
+
+    @staticmethod
+    def get_retriever(file_index, index_rate):
         if (
             file_index != ""
             # and file_big_npy != ""
@@ -503,32 +645,35 @@ class VC(object):
             and index_rate != 0
         ):
             try:
-                index = faiss.read_index(file_index)
-                # big_npy = np.load(file_big_npy)
-                big_npy = index.reconstruct_n(0, index.ntotal)
+                # loaded once per index file, big_npy is memory-mapped from a .npy sidecar
+                index, big_npy = index_cache.load(file_index)
+                # buffers of the retriever are reused by every segment of this song
+                return IndexRetriever(index, big_npy)
             except:
                 traceback.print_exc()
-                index = big_npy = None
-        else:
-            index = big_npy = None
+        return None
+
+    def get_segments(
+        self,
+        audio,
+        input_audio_path,
+        times,
+        f0_up_key,
+        f0_method,
+        if_f0,
+        filter_radius,
+        crepe_hop_length,
+        f0_file=None,
+    ):
+        """
+        high-pass filters the vocals, computes f0 and splits them at silence points.
+        Returns the filtered audio and a list of (audio_seg, pitch_seg, pitchf_seg), pitch being None without f0
+        """
         audio = signal.filtfilt(bh, ah, audio)
-        audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
         opt_ts = []
-        if audio_pad.shape[0] > self.t_max:
-            audio_sum = np.zeros_like(audio)
-            for i in range(self.window):
-                audio_sum += audio_pad[i : i - self.window]
-            for t in range(self.t_center, audio.shape[0], self.t_center):
-                opt_ts.append(
-                    t
-                    - self.t_query
-                    + np.where(
-                        np.abs(audio_sum[t - self.t_query : t + self.t_query])
-                        == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
-                    )[0][0]
-                )
+        if audio.shape[0] + self.window // 2 * 2 > self.t_max:
+            opt_ts = get_opt_ts(audio, self.window, self.t_center, self.t_query)
         s = 0
-        audio_opt = []
         t = None
         t1 = ttime()
         audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
@@ -544,19 +689,19 @@ class VC(object):
                 inp_f0 = np.array(inp_f0, dtype="float32")
             except:
                 traceback.print_exc()
-        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
         pitch, pitchf = None, None
         if if_f0 == 1:
-            pitch, pitchf = self.get_f0(
-                input_audio_path,
-                audio_pad,
-                p_len,
-                f0_up_key,
-                f0_method,
-                filter_radius,
-                crepe_hop_length,
-                inp_f0,
-            )
+            with stage("f0"):
+                pitch, pitchf = self.get_f0(
+                    input_audio_path,
+                    audio_pad,
+                    p_len,
+                    f0_up_key,
+                    f0_method,
+                    filter_radius,
+                    crepe_hop_length,
+                    inp_f0,
+                )
             pitch = pitch[:p_len]
             pitchf = pitchf[:p_len]
             if self.device == "mps":
@@ -565,90 +710,202 @@ class VC(object):
             pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
         t2 = ttime()
         times[1] += t2 - t1
+        # split at the silence points, every segment keeps t_pad of context on both sides
+        segments = []
         for t in opt_ts:
             t = t // self.window * self.window
             if if_f0 == 1:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        pitch[:, s // self.window : (t + self.t_pad2) // self.window],
-                        pitchf[:, s // self.window : (t + self.t_pad2) // self.window],
-                        times,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
+                segments.append((
+                    audio_pad[s : t + self.t_pad2 + self.window],
+                    pitch[:, s // self.window : (t + self.t_pad2) // self.window],
+                    pitchf[:, s // self.window : (t + self.t_pad2) // self.window],
+                ))
             else:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        None,
-                        None,
-                        times,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
+                segments.append((audio_pad[s : t + self.t_pad2 + self.window], None, None))
             s = t
         if if_f0 == 1:
-            audio_opt.append(
-                self.vc(
+            segments.append((
+                audio_pad[t:],
+                pitch[:, t // self.window :] if t is not None else pitch,
+                pitchf[:, t // self.window :] if t is not None else pitchf,
+            ))
+        else:
+            segments.append((audio_pad[t:], None, None))
+        return audio, segments
+
+    def get_output_length(self, segments, tgt_sr):
+        """length of the converted audio of segments, for a generator producing tgt_sr // 100 samples per f0 frame"""
+        n_samples = 0
+        for audio_seg, _, _ in segments:
+            p_len = min(audio_seg.shape[0] // self.window, self.hubert_frames(audio_seg.shape[0]) * 2)
+            n_samples += p_len * (tgt_sr // 100) - 2 * self.t_pad_tgt
+        return n_samples
+
+    def convert_segments(
+        self,
+        model,
+        net_g,
+        sid,
+        segments,
+        times,
+        retriever,
+        index_rate,
+        version,
+        protect,
+        batch_size,
+        search_all_segments,
+        in_order=False,
+    ):
+        """yields the trimmed output of every segment. With in_order, outputs come in segment order as soon as they
+        are converted, otherwise batches are formed by length and everything is returned at the end"""
+        if len(segments) > 1 and (batch_size > 1 or search_all_segments and retriever is not None):
+            if in_order:
+                batches = [list(range(b, min(b + batch_size, len(segments)))) for b in range(0, len(segments), batch_size)]
+                for _, output in self.iter_batches(
+                    model, net_g, sid, segments, batches, times, retriever, index_rate, version, protect,
+                    search_all=search_all_segments,
+                ):
+                    yield output
+            else:
+                yield from self.vc_segments_batched(
                     model,
                     net_g,
                     sid,
-                    audio_pad[t:],
-                    pitch[:, t // self.window :] if t is not None else pitch,
-                    pitchf[:, t // self.window :] if t is not None else pitchf,
+                    segments,
+                    batch_size,
                     times,
-                    index,
-                    big_npy,
+                    retriever,
                     index_rate,
                     version,
                     protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
+                    search_all=search_all_segments,
+                )
         else:
-            audio_opt.append(
-                self.vc(
+            for audio_seg, pitch_seg, pitchf_seg in segments:
+                yield self.vc(
                     model,
                     net_g,
                     sid,
-                    audio_pad[t:],
-                    None,
-                    None,
+                    audio_seg,
+                    pitch_seg,
+                    pitchf_seg,
                     times,
-                    index,
-                    big_npy,
+                    retriever,
                     index_rate,
                     version,
                     protect,
                 )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
+
+    def pipeline(
+        self,
+        model,
+        net_g,
+        sid,
+        audio,
+        input_audio_path,
+        times,
+        f0_up_key,
+        f0_method,
+        file_index,
+        # file_big_npy,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        crepe_hop_length,
+        f0_file=None,
+        batch_size=Settings.RVC_SEGMENT_BATCH_SIZE,
+        search_all_segments=Settings.FAISS_SEARCH_ALL_SEGMENTS,
+    ):
+        retriever = self.get_retriever(file_index, index_rate)
+        audio, segments = self.get_segments(
+            audio, input_audio_path, times, f0_up_key, f0_method, if_f0, filter_radius, crepe_hop_length, f0_file
+        )
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        audio_opt = list(self.convert_segments(
+            model, net_g, sid, segments, times, retriever, index_rate, version, protect, batch_size, search_all_segments
+        ))
         audio_opt = np.concatenate(audio_opt)
         if rms_mix_rate != 1:
             audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
         if resample_sr >= 16000 and tgt_sr != resample_sr:
-            audio_opt = librosa.resample(
-                audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
-            )
+            audio_opt = resample(audio_opt, tgt_sr, resample_sr)
         audio_max = np.abs(audio_opt).max() / 0.99
         max_int16 = 32768
         if audio_max > 1:
             max_int16 /= audio_max
         audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
+        del segments, sid
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         return audio_opt
+
+    def pipeline_stream(
+        self,
+        model,
+        net_g,
+        sid,
+        audio,
+        input_audio_path,
+        times,
+        f0_up_key,
+        f0_method,
+        file_index,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        crepe_hop_length,
+        f0_file=None,
+        batch_size=Settings.RVC_SEGMENT_BATCH_SIZE,
+        search_all_segments=Settings.FAISS_SEARCH_ALL_SEGMENTS,
+    ):
+        """
+        VC.pipeline that yields int16 audio segment by segment as soon as it is converted, so only the segments in
+        flight are held in memory.
+
+        RMS matching runs incrementally on the converted audio (RMSMatcher, about a second behind the generator).
+        The song's peak is not known until the end, so instead of pipeline's normalization of the whole song when
+        it peaks above 0.99 full scale, the int16 scale is fixed and peaks are soft-clipped by limit_peaks. Output
+        that stays below its 0.9 threshold (the common case) is identical to pipeline's; louder passages keep their
+        gain and only their peaks are bent below 0.99.
+        """
+        retriever = self.get_retriever(file_index, index_rate)
+        audio, segments = self.get_segments(
+            audio, input_audio_path, times, f0_up_key, f0_method, if_f0, filter_radius, crepe_hop_length, f0_file
+        )
+        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+        rms_matcher = None
+        if rms_mix_rate != 1:
+            rms_matcher = RMSMatcher(audio, 16000, tgt_sr, rms_mix_rate, self.get_output_length(segments, tgt_sr))
+        resampler = None
+        if resample_sr >= 16000 and tgt_sr != resample_sr:
+            resampler = StreamResampler(tgt_sr, resample_sr)
+        converted = self.convert_segments(
+            model, net_g, sid, segments, times, retriever, index_rate, version, protect, batch_size,
+            search_all_segments, in_order=True,
+        )
+        for audio_seg in itertools.chain(converted, [None]):
+            # None marks the end of the song, the matcher and resampler return the audio they held back
+            final = audio_seg is None
+            if rms_matcher is not None:
+                audio_seg = rms_matcher.flush() if final else rms_matcher.process(audio_seg)
+            if resampler is not None:
+                parts = [resampler.process(audio_seg)] if audio_seg is not None else []
+                if final:
+                    parts.append(resampler.flush())
+                audio_seg = np.concatenate(parts)
+            if audio_seg is None or audio_seg.shape[0] == 0:
+                continue
+            yield (limit_peaks(audio_seg) * 32768).astype(np.int16)
+        del segments, sid
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -0,0 +1,124 @@
+# app/services/audio/decode.py
+
+# default imports
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile as sf
+
+# module imports
+from app.config import get_logger
+from app.services.audio.resample import resample
+
+logger = get_logger(__name__)
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+@dataclass
+class AudioInfo:
+    samplerate: int
+    channels: int
+    frames: int
+
+    @property
+    def duration(self):
+        return self.frames / self.samplerate
+
+
+def open_audio(path):
+    """
+    opens path for reading with libsndfile (WAV, FLAC, OGG and, with libsndfile >= 1.1, MP3), or with pedalboard's
+    decoders for the formats it can't read (m4a / webm downloads, older libsndfile builds without MP3)
+    """
+    try:
+        return sf.SoundFile(path)
+    except RuntimeError:
+        from pedalboard.io import AudioFile
+        return AudioFile(path)
+
+def get_info(path):
+    with open_audio(path) as f:
+        if isinstance(f, sf.SoundFile):
+            return AudioInfo(f.samplerate, f.channels, f.frames)
+        return AudioInfo(int(f.samplerate), f.num_channels, f.frames)
+
+def read_audio(path, sr=None, mono=False, offset=0.0, duration=None):
+    """
+    decodes duration seconds of path starting at offset (the whole file by default) in process.
+
+    Returns (wave, sr): a float32 array of (channels, samples), or (samples,) with mono, resampled to sr when it
+    differs from the file's rate, and the sample rate of wave.
+    """
+    with open_audio(path) as f:
+        is_soundfile = isinstance(f, sf.SoundFile)
+        file_sr = int(f.samplerate)
+        channels = f.channels if is_soundfile else f.num_channels
+        start = min(int(round(offset * file_sr)), f.frames)
+        frames = f.frames - start
+        if duration is not None:
+            frames = min(int(round(duration * file_sr)), frames)
+
+        f.seek(start)
+        if is_soundfile:
+            # libsndfile decodes straight into the preallocated buffer, the returned view is trimmed to the frames
+            # actually read, which can be fewer than the header announces for a truncated file
+            wave = np.empty((frames, channels), dtype=np.float32)
+            wave = f.read(frames, dtype='float32', always_2d=True, out=wave)
+            wave = wave.T
+        else:
+            wave = f.read(frames).astype(np.float32, copy=False)
+
+    if mono:
+        wave = wave.mean(axis=0) if channels > 1 else wave[0]
+    if sr is not None and sr != file_sr:
+        wave = resample(np.ascontiguousarray(wave), file_sr, sr)
+        file_sr = sr
+    return np.ascontiguousarray(wave, dtype=np.float32), file_sr
+
+def map_wav(path):
+    """
+    memory-maps the samples of a 16-bit PCM WAV file without decoding it.
+
+    Returns (frames, sr): a read-only int16 array of (frames, channels) and the sample rate. Raises ValueError for
+    anything else, which read_audio decodes instead.
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f'{path} is not a WAV file')
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{path} has no data chunk')
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                chunk = f.read(size)
+                fmt = struct.unpack('<HHIIHH', chunk[:16])
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                    # the sub format GUID starts with the actual format tag
+                    fmt = (struct.unpack('<H', chunk[24:26])[0],) + fmt[1:]
+                f.seek(size % 2, 1)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                # chunks are padded to an even size
+                f.seek(size + size % 2, 1)
+        file_size = f.seek(0, 2)
+
+    if fmt is None:
+        raise ValueError(f'{path} has no fmt chunk')
+    audio_format, channels, sr, _, block_align, bits = fmt
+    if audio_format != WAVE_FORMAT_PCM or bits != 16 or block_align != 2 * channels:
+        raise ValueError(f'{path} is not 16-bit PCM')
+
+    # the size of a truncated file, or of one still being written, can be larger than what is there
+    n_frames = min(size, file_size - offset) // block_align
+    if n_frames == 0:
+        return np.zeros((0, channels), dtype=np.int16), sr
+    return np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(n_frames, channels)), sr
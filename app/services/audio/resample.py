@@ -0,0 +1,96 @@
+# app/services/audio/resample.py
+
+# default imports
+import math
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+# output samples computed at a time by StreamResampler, bounds its temporary buffers
+BLOCK_SIZE = 1 << 14
+
+
+def get_ratio(orig_sr, target_sr):
+    """(up, down) factors taking orig_sr to target_sr"""
+    g = math.gcd(int(orig_sr), int(target_sr))
+    return int(target_sr) // g, int(orig_sr) // g
+
+@lru_cache(maxsize=32)
+def get_filter(up, down):
+    """the anti-aliasing filter scipy.signal.resample_poly designs by default, designed once per ratio"""
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = signal.firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0))
+    h.setflags(write=False)
+    return h
+
+def resample(y, orig_sr, target_sr, axis=-1):
+    """polyphase resampling of y along axis, the same as scipy.signal.resample_poly with its default filter"""
+    if orig_sr == target_sr:
+        return y
+    up, down = get_ratio(orig_sr, target_sr)
+    h = get_filter(up, down)
+    if np.issubdtype(y.dtype, np.floating):
+        h = h.astype(y.dtype)
+    return signal.resample_poly(y, up, down, axis=axis, window=h)
+
+
+class StreamResampler:
+    """
+    resample over mono audio arriving in blocks.
+
+    Uses the same filter and output alignment as resample, so the concatenated output of process and flush
+    matches resample on the concatenated input up to float rounding. The filter is split into up polyphase banks,
+    banks[p, i] = h[p + i * up], and every output sample is the dot product of one bank with the last input
+    samples, so only a filter length of input is kept between blocks.
+    """
+
+    def __init__(self, orig_sr, target_sr, dtype=np.float32):
+        self.up, self.down = get_ratio(orig_sr, target_sr)
+        h = get_filter(self.up, self.down) * self.up
+        self.half_len = (h.shape[0] - 1) // 2
+        self.taps = -(-h.shape[0] // self.up)
+        h = np.concatenate([h, np.zeros(self.taps * self.up - h.shape[0])])
+        # banks reversed along the taps so they run against the input in time order
+        self.banks = np.ascontiguousarray(h.reshape(self.taps, self.up).T[:, ::-1], dtype=dtype)
+        self.dtype = dtype
+        # input kept for the next outputs, _buffer[0] is input sample _buffer_start (zeros before the start)
+        self._buffer = np.zeros(self.taps - 1, dtype=dtype)
+        self._buffer_start = -(self.taps - 1)
+        self._n_in = 0
+        self._n_out = 0
+
+    def _produce(self, stop):
+        """output samples _n_out to stop, all of their input being in the buffer"""
+        outputs = []
+        windows = sliding_window_view(self._buffer, self.taps)
+        for start in range(self._n_out, stop, BLOCK_SIZE):
+            t = np.arange(start, min(start + BLOCK_SIZE, stop), dtype=np.int64) * self.down + self.half_len
+            rows = t // self.up - (self.taps - 1) - self._buffer_start
+            outputs.append(np.einsum('nk,nk->n', windows[rows], self.banks[t % self.up]))
+
+        if stop > self._n_out:
+            next_start = (stop * self.down + self.half_len) // self.up - (self.taps - 1)
+            self._buffer = self._buffer[next_start - self._buffer_start :]
+            self._buffer_start = next_start
+            self._n_out = stop
+        return np.concatenate(outputs) if outputs else np.zeros(0, dtype=self.dtype)
+
+    def process(self, block):
+        self._buffer = np.concatenate([self._buffer, np.asarray(block, dtype=self.dtype)])
+        self._n_in += block.shape[0]
+        # output m needs input up to (m * down + half_len) // up
+        stop = max(-(-(self._n_in * self.up - self.half_len) // self.down), self._n_out)
+        return self._produce(stop)
+
+    def flush(self):
+        n_out = -(-self._n_in * self.up // self.down)
+        if n_out <= self._n_out:
+            return np.zeros(0, dtype=self.dtype)
+        last = ((n_out - 1) * self.down + self.half_len) // self.up
+        pad = last + 1 - (self._buffer_start + self._buffer.shape[0])
+        if pad > 0:
+            self._buffer = np.concatenate([self._buffer, np.zeros(pad, dtype=self.dtype)])
+        return self._produce(n_out)
@@ -0,0 +1,133 @@
+# app/services/audio/rms.py
+
+# default imports
+import librosa
+import numpy as np
+
+# output samples processed at a time, bounds the temporary buffers to a few times this size
+BLOCK_SIZE = 1 << 16
+
+
+def get_rms(y, sr):
+    """rms curve of y with a point every half second"""
+    return librosa.feature.rms(y=y, frame_length=sr // 2 * 2, hop_length=sr // 2)[0]
+
+def interpolate_linear(curve, n_in, n_out, start, stop):
+    """
+    samples [start, stop) of a float32 curve of n_in points stretched to n_out samples, like
+    F.interpolate(mode='linear', align_corners=False). Points past the end of curve repeat its last value.
+
+    torch computes the source position and the blend with fused multiply-adds on CPUs with FMA; they are
+    emulated in float64, where the float32 products are exact. The result is within 1e-6 relative of torch's (equal
+    where torch uses FMA), and change_rms within 1e-6 relative of the original torch implementation, whose
+    torch.pow rounds differently from np.power.
+    """
+    scale = np.float32(n_in) / np.float32(n_out)
+    src = np.arange(start, stop, dtype=np.float32)
+    src += np.float32(0.5)
+    src = (np.float64(scale) * src - 0.5).astype(np.float32)
+    np.maximum(src, 0, out=src)
+    i0 = src.astype(np.int64)
+    np.minimum(i0, n_in - 1, out=i0)
+    lam = src
+    lam -= i0
+    np.clip(lam, 0, 1, out=lam)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    last = curve.shape[0] - 1
+    np.minimum(i0, last, out=i0)
+    np.minimum(i1, last, out=i1)
+
+    out = curve[i1] * lam
+    out = out.astype(np.float64)
+    lam -= 1
+    out -= curve[i0].astype(np.float64) * lam
+    return out.astype(np.float32)
+
+def apply_rms_gain(block, start, n_out, rms1, rms2, rate, n_frames2=None):
+    """
+    multiplies block, holding output samples [start, start + len(block)) of n_out, in place by the gain that
+    mixes the rms envelope rms1 of the input with rate of the output's own envelope rms2
+    """
+    n_frames2 = n_frames2 or rms2.shape[0]
+    for b in range(0, block.shape[0], BLOCK_SIZE):
+        stop = min(b + BLOCK_SIZE, block.shape[0])
+        env1 = interpolate_linear(rms1, rms1.shape[0], n_out, start + b, start + stop)
+        env2 = interpolate_linear(rms2, n_frames2, n_out, start + b, start + stop)
+        np.maximum(env2, np.float32(1e-6), out=env2)
+        np.power(env1, np.float32(1 - rate), out=env1)
+        np.power(env2, np.float32(rate - 1), out=env2)
+        env1 *= env2
+        block[b:stop] *= env1
+    return block
+
+def change_rms(data1, sr1, data2, sr2, rate):
+    """mixes the rms envelope of data1 (input audio) into data2 (output audio) in place, rate being the share of
+    data2's own envelope"""
+    rms1 = get_rms(data1, sr1)
+    rms2 = get_rms(data2, sr2)
+    return apply_rms_gain(data2, 0, data2.shape[0], rms1, rms2, rate)
+
+
+class RMSMatcher:
+    """
+    change_rms over output that arrives in blocks.
+
+    The envelope of the input is computed once, the one of the output frame by frame as blocks come in.
+    process returns the samples whose gain is known, which lags the input by about a second, and flush returns
+    the rest. n_out is the expected length of the whole output; when it is exact the result is identical to
+    change_rms on the concatenated output.
+    """
+
+    def __init__(self, data1, sr1, sr2, rate, n_out):
+        self.rms1 = get_rms(data1, sr1)
+        self.rate = rate
+        self.n_out = n_out
+        self.frame_length = sr2 // 2 * 2
+        self.hop_length = sr2 // 2
+        self.n_frames2 = n_out // self.hop_length + 1
+        self.rms2 = np.zeros(0, dtype=np.float32)
+        # output not analysed yet, starting at the next rms frame, with the centering pad in front
+        self._frame_buffer = np.zeros(self.frame_length // 2, dtype=np.float32)
+        self._pending = []
+        self._pending_start = 0
+
+    def _add_frames(self):
+        n = (self._frame_buffer.shape[0] - self.frame_length) // self.hop_length + 1
+        if n <= 0:
+            return
+        frames = librosa.feature.rms(
+            y=self._frame_buffer[: (n - 1) * self.hop_length + self.frame_length],
+            frame_length=self.frame_length,
+            hop_length=self.hop_length,
+            center=False,
+        )[0]
+        self.rms2 = np.concatenate([self.rms2, frames])
+        self._frame_buffer = self._frame_buffer[n * self.hop_length :]
+
+    def _emit(self, n):
+        if n <= 0:
+            return np.zeros(0, dtype=np.float32)
+        pending = np.concatenate(self._pending)
+        self._pending = [pending[n:]]
+        block = apply_rms_gain(pending[:n], self._pending_start, self.n_out, self.rms1, self.rms2, self.rate, self.n_frames2)
+        self._pending_start += n
+        return block
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        self._pending.append(block)
+        self._frame_buffer = np.concatenate([self._frame_buffer, block])
+        self._add_frames()
+        if self.rms2.shape[0] >= self.n_frames2:
+            ready = self._pending_start + sum(p.shape[0] for p in self._pending)
+        else:
+            # output sample i blends rms frames floor(src) and floor(src) + 1, src = (i + 0.5) * n_frames2 / n_out - 0.5
+            ready = min(int((self.rms2.shape[0] - 1.5) * self.n_out / self.n_frames2 - 0.5) - 1,
+                        self._pending_start + sum(p.shape[0] for p in self._pending))
+        return self._emit(ready - self._pending_start)
+
+    def flush(self):
+        pad = np.zeros(self.frame_length // 2, dtype=np.float32)
+        self._frame_buffer = np.concatenate([self._frame_buffer, pad])
+        self._add_frames()
+        return self._emit(sum(p.shape[0] for p in self._pending))
@@ -0,0 +1,133 @@
+# app/services/job_queue/job_queue.py
+
+# default imports
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# module imports
+from app.config import get_logger, Settings, progress_callback
+from app.services.metrics.metrics import job_spans
+from app.services.job_queue.stage_limiter import CapacityExceeded
+
+logger = get_logger(__name__)
+
+
+class QueueFullError(CapacityExceeded):
+    pass
+
+
+class Job:
+    def __init__(self, fn, params):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.params = params
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.spans = []
+
+    @property
+    def done(self):
+        return self.status in ('completed', 'failed')
+
+    def update_progress(self, message, progress):
+        self.message = message
+        self.progress = progress
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'stages': list(self.spans),
+        }
+
+
+class JobQueue:
+    """
+    Runs long jobs on a bounded pool of worker threads, outside of the event loop.
+
+    At most max_workers jobs run at once and at most max_pending more wait for a worker; further submissions
+    raise QueueFullError. The last max_history finished jobs are kept so their status and result can be fetched.
+    """
+
+    def __init__(self, max_workers=Settings.JOB_WORKERS, max_pending=Settings.JOB_QUEUE_SIZE, max_history=Settings.JOB_HISTORY_SIZE):
+        self.max_workers = max(max_workers, 1)
+        self.max_pending = max(max_pending, 0)
+        self.max_history = max(max_history, 0)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        # moving average of how long a job runs, in seconds
+        self._job_seconds = None
+
+    def submit(self, fn, **params):
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if not job.done)
+            if active >= self.max_workers + self.max_pending:
+                retry_after = (self._job_seconds or 60) * (active - self.max_workers + 1) / self.max_workers
+                raise QueueFullError(f'Job queue is full ({active} jobs queued or running).', retry_after)
+
+            job = Job(fn, params)
+            self._jobs[job.id] = job
+            self._prune()
+            job.future = self._executor.submit(self._run, job)
+
+        logger.info(f'Job {job.id} queued')
+        return job
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        token = progress_callback.set(job.update_progress)
+        spans_token = job_spans.set(job.spans)
+        try:
+            job.result = job.fn(**job.params)
+            job.status = 'completed'
+            job.progress = 1.0
+            logger.info(f'Job {job.id} completed')
+            return job.result
+        except Exception as e:
+            job.error = str(e)
+            # set before the status, so whoever sees 'failed' can read it without waiting for the future
+            job.exception = e
+            job.status = 'failed'
+            logger.error(f'Job {job.id} failed: {e}', exc_info=True)
+            raise
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                seconds = job.finished_at - job.started_at
+                self._job_seconds = seconds if self._job_seconds is None else 0.8 * self._job_seconds + 0.2 * seconds
+            progress_callback.reset(token)
+            job_spans.reset(spans_token)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.max_history, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_queue = JobQueue()
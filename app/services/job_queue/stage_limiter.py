@@ -0,0 +1,116 @@
+# app/services/job_queue/stage_limiter.py
+
+# default imports
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# module imports
+from app.config import get_logger, Settings
+from app.services.metrics.metrics import stage
+
+logger = get_logger(__name__)
+
+
+class CapacityExceeded(Exception):
+    """raised when a request can't be admitted, retry_after is a hint in seconds for the client"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+class StageLimiter:
+    """
+    Bounds how many pipeline runs use a stage (an MDX pass, RMVPE, HuBERT or the generator) at the same time,
+    across all jobs.
+
+    Up to concurrency callers hold the stage, at most max_waiting more wait for it in FIFO order, and a caller
+    that waited timeout seconds gives up. Both cases raise CapacityExceeded with a Retry-After estimate based on
+    how long the stage is usually held. concurrency <= 0 disables the limit.
+    """
+
+    def __init__(self, name, concurrency, max_waiting, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_waiting = max(max_waiting, 0)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._active = 0
+        self._waiting = []
+        # moving average of how long the stage is held, in seconds
+        self._hold_seconds = None
+
+    def retry_after(self):
+        hold_seconds = self._hold_seconds or 1
+        return hold_seconds * (len(self._waiting) + self._active) / max(self.concurrency, 1)
+
+    def _acquire(self):
+        with self._condition:
+            if not self._waiting and self._active < self.concurrency:
+                self._active += 1
+                return
+            if len(self._waiting) >= self.max_waiting:
+                raise CapacityExceeded(f'Too many requests waiting for {self.name}', self.retry_after())
+
+            ticket = object()
+            self._waiting.append(ticket)
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self._waiting[0] is not ticket or self._active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise CapacityExceeded(f'Timed out waiting for {self.name}', self.retry_after())
+                    self._condition.wait(remaining)
+                self._active += 1
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+
+    def _release(self, hold_seconds):
+        with self._condition:
+            self._active -= 1
+            self._hold_seconds = hold_seconds if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * hold_seconds
+            self._condition.notify_all()
+
+    @contextmanager
+    def hold(self):
+        if self.concurrency <= 0:
+            yield
+            return
+
+        # time spent waiting shows up as its own stage in the metrics
+        with stage(f'queue:{self.name}'):
+            self._acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'hold_seconds': self._hold_seconds,
+            }
+
+
+stage_limiters = {
+    name: StageLimiter(name, concurrency, Settings.STAGE_QUEUE_LIMIT, Settings.STAGE_QUEUE_TIMEOUT)
+    for name, concurrency in [
+        ('mdx', Settings.MDX_CONCURRENCY),
+        ('rmvpe', Settings.RMVPE_CONCURRENCY),
+        ('hubert', Settings.HUBERT_CONCURRENCY),
+        ('generator', Settings.GENERATOR_CONCURRENCY),
+    ]
+}
+
+
+def stage_limit(name):
+    """context manager holding the named stage for the enclosed block"""
+    return stage_limiters[name].hold()
@@ -0,0 +1,200 @@
+# app/services/metrics/metrics.py
+
+# default imports
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Set by the job queue to collect the spans of the job running in the current thread
+job_spans = ContextVar("job_spans", default=None)
+
+# upper bounds of the stage duration histogram, in seconds
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# how often the RSS of the process is sampled while a stage runs, in seconds
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def read_io_bytes():
+    """(bytes read, bytes written) by this process through read/write syscalls, including page cache hits"""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def get_max_rss():
+    """peak resident set size of this process since it started in bytes (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_rss():
+    """current resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return get_max_rss()
+
+
+class RSSSampler:
+    """
+    Peak RSS of the process over open spans.
+
+    ru_maxrss is the peak since the process started: once a stage reaches it, every later stage would report
+    the same number. Instead a background thread samples the current RSS every interval seconds while any span
+    is open and keeps the highest value seen by each. Peaks shorter than the interval can be missed.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._thread = None
+
+    def start(self):
+        """opens a span and returns its token for stop"""
+        token = object()
+        rss = get_rss()
+        with self._lock:
+            self._peaks[token] = rss
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+                self._thread.start()
+        return token
+
+    def stop(self, token):
+        """closes the span of token and returns its peak RSS in bytes"""
+        rss = get_rss()
+        with self._lock:
+            return max(self._peaks.pop(token), rss)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            rss = get_rss()
+            with self._lock:
+                if not self._peaks:
+                    # the next start spawns a new thread
+                    self._thread = None
+                    return
+                for token, peak in self._peaks.items():
+                    self._peaks[token] = max(peak, rss)
+
+
+class StageMetrics:
+    """
+    Totals of every stage of the pipeline since startup, rendered in the Prometheus text format.
+
+    CPU time, RSS and I/O bytes are process-wide, so with several job workers a span also includes the work and
+    memory of the other jobs running at the same time.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, span):
+        with self._lock:
+            stage = self._stages.setdefault(span['stage'], {
+                'count': 0,
+                'wall_seconds': 0.0,
+                'cpu_seconds': 0.0,
+                'read_bytes': 0,
+                'write_bytes': 0,
+                'max_rss_bytes': 0,
+                'buckets': [0] * len(self.buckets),
+            })
+            stage['count'] += 1
+            stage['wall_seconds'] += span['wall_seconds']
+            stage['cpu_seconds'] += span['cpu_seconds']
+            stage['read_bytes'] += span['read_bytes']
+            stage['write_bytes'] += span['write_bytes']
+            stage['max_rss_bytes'] = max(stage['max_rss_bytes'], span['max_rss_bytes'])
+            for i, bound in enumerate(self.buckets):
+                if span['wall_seconds'] <= bound:
+                    stage['buckets'][i] += 1
+
+    def render(self):
+        with self._lock:
+            stages = {name: {**stage, 'buckets': list(stage['buckets'])} for name, stage in sorted(self._stages.items())}
+
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(samples)
+
+        def per_stage(key):
+            return [f'{{stage="{name}"}} {stage[key]}' for name, stage in stages.items()]
+
+        for name, key, metric_type, help_text in [
+            ('aicover_stage_runs_total', 'count', 'counter', 'Number of times a pipeline stage ran.'),
+            ('aicover_stage_cpu_seconds_total', 'cpu_seconds', 'counter', 'Process CPU time spent in a pipeline stage.'),
+            ('aicover_stage_read_bytes_total', 'read_bytes', 'counter', 'Bytes read by the process during a pipeline stage.'),
+            ('aicover_stage_write_bytes_total', 'write_bytes', 'counter', 'Bytes written by the process during a pipeline stage.'),
+            ('aicover_stage_max_rss_bytes', 'max_rss_bytes', 'gauge', 'Highest resident set size of the process sampled during a run of a pipeline stage.'),
+        ]:
+            family(name, metric_type, help_text, [f'{name}{sample}' for sample in per_stage(key)])
+
+        samples = []
+        for name, stage in stages.items():
+            for bound, count in zip(self.buckets, stage['buckets']):
+                samples.append(f'aicover_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            samples.append(f'aicover_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            samples.append(f'aicover_stage_duration_seconds_sum{{stage="{name}"}} {stage["wall_seconds"]}')
+            samples.append(f'aicover_stage_duration_seconds_count{{stage="{name}"}} {stage["count"]}')
+        family('aicover_stage_duration_seconds', 'histogram', 'Wall time of a pipeline stage.', samples)
+
+        family('aicover_process_max_rss_bytes', 'gauge', 'Peak resident set size of the process since it started.',
+               [f'aicover_process_max_rss_bytes {get_max_rss()}'])
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+stage_metrics = StageMetrics()
+rss_sampler = RSSSampler()
+
+
+@contextmanager
+def stage(name, sync=None):
+    """
+    Records a span for the enclosed pipeline stage: wall time, process CPU time, peak RSS sampled during the span
+    and bytes read/written.
+    The span is added to the totals served on /metrics and to the spans of the current job. sync is called before
+    the span ends, e.g. to wait for queued GPU work so that it is attributed to this stage.
+    """
+    start_time, start_wall, start_cpu = time.time(), time.perf_counter(), time.process_time()
+    start_read, start_write = read_io_bytes()
+    start_rss = get_rss()
+    rss_token = rss_sampler.start()
+    try:
+        yield
+    finally:
+        if sync is not None:
+            sync()
+        end_read, end_write = read_io_bytes()
+        max_rss = rss_sampler.stop(rss_token)
+        span = {
+            'stage': name,
+            'start': start_time,
+            'wall_seconds': time.perf_counter() - start_wall,
+            'cpu_seconds': time.process_time() - start_cpu,
+            'max_rss_bytes': max_rss,
+            'rss_growth_bytes': max_rss - start_rss,
+            'read_bytes': end_read - start_read,
+            'write_bytes': end_write - start_write,
+        }
+        stage_metrics.record(span)
+        spans = job_spans.get()
+        if spans is not None:
+            spans.append(span)
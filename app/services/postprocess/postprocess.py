@@ -1,10 +1,210 @@
 # app/services/postprocess/postprocess.py
 
 # default imports
-from pydub import AudioSegment
+import math
+import subprocess
+import wave
+
+import numpy as np
+import soundfile as sf
+
+# module imports
+from app.config import get_logger
+from app.services.audio.decode import map_wav
+
+logger = get_logger(__name__)
+
+# output frames mixed and written at a time
+BLOCK_SIZE = 1 << 16
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+def db_to_float(db):
+    return 10 ** (float(db) / 20)
+
+
+class Stem:
+    """
+    a 16-bit stem read block by block from its memory-mapped file, with its gains applied as pydub's apply_gain
+    does (audioop.mul: every gain scales, clips and floors the samples)
+    """
+
+    def __init__(self, path, gains):
+        try:
+            self.data, self.sr = map_wav(path)
+        except ValueError:
+            logger.debug(f'{path} is not a 16-bit PCM WAV file, converting it to one')
+            self.data, self.sr = sf.read(path, dtype='int16', always_2d=True)
+        self.frames, self.channels = self.data.shape
+        # a gain of 0 dB leaves the samples as they are
+        self.factors = [db_to_float(gain) for gain in gains if gain != 0]
+
+    def read(self, start, stop):
+        block = self.data[start:stop]
+        if not self.factors:
+            return block.astype(np.int32)
+        block = block.astype(np.float64)
+        for factor in self.factors:
+            block *= factor
+            np.clip(block, INT16_MIN, INT16_MAX, out=block)
+            np.floor(block, out=block)
+        return block.astype(np.int32)
+
+
+class Channels:
+    """source with its mono audio copied to every channel, as pydub's set_channels"""
+
+    def __init__(self, source, channels):
+        if source.channels != 1:
+            raise ValueError(f'Unable to convert {source.channels} channels to {channels}')
+        self.source = source
+        self.sr = source.sr
+        self.frames = source.frames
+        self.channels = channels
+
+    def read(self, start, stop):
+        return np.repeat(self.source.read(start, stop), self.channels, axis=1)
+
+
+class RateConverter:
+    """
+    source converted to sr the way pydub's set_frame_rate does with audioop.ratecv.
+
+    ratecv walks the input and output with a counter d, so output j interpolates linearly between input
+    k - 1 and k, k = ceil(j * inrate / outrate), with weights d = k * outrate - j * inrate and outrate - d, both
+    rates divided by their gcd. Any block of output is computed from those indices directly. ratecv scales the
+    samples to 32 bits and divides in double precision, which is exact at these magnitudes, so the same
+    truncating division is done on integers.
+    """
+
+    def __init__(self, source, sr):
+        g = math.gcd(source.sr, sr)
+        self.inrate, self.outrate = source.sr // g, sr // g
+        self.source = source
+        self.sr = sr
+        self.frames = (source.frames - 1) * self.outrate // self.inrate + 1 if source.frames else 0
+        self.channels = source.channels
+
+    def read(self, start, stop):
+        if stop <= start:
+            return np.zeros((0, self.channels), dtype=np.int32)
+        j = np.arange(start, stop, dtype=np.int64)
+        k = -(-j * self.inrate // self.outrate)
+        d = (k * self.outrate - j * self.inrate)[:, None]
+
+        # ratecv starts from a sample of 0 before the input
+        base = k[0] - 1
+        x = self.source.read(max(base, 0), k[-1] + 1).astype(np.int64)
+        if base < 0:
+            x = np.concatenate([np.zeros((1, self.channels), dtype=np.int64), x])
+        cur = x[k - base]
+        # prev * d + cur * (outrate - d)
+        out = x[k - 1 - base]
+        out -= cur
+        out *= d
+        cur *= self.outrate
+        out += cur
+        out <<= 16
+        negative = out < 0
+        np.abs(out, out=out)
+        out //= self.outrate
+        np.negative(out, out=out, where=negative)
+        out >>= 16
+        return out
+
+
+class Overlay:
+    """
+    b mixed into a with int16 saturation, as pydub's overlay (audioop.add).
+
+    overlay takes a through a millisecond slice, so the mix is as long as a rounded to whole milliseconds: cut or
+    padded with silence by a frame or so.
+    """
+
+    def __init__(self, a, b):
+        self.a, self.b = sync(a, b)
+        self.sr = self.a.sr
+        self.frames = int(round(1000 * (self.a.frames / self.sr)) * (self.sr / 1000.0))
+        self.channels = self.a.channels
+
+    def read(self, start, stop):
+        n = min(stop, self.a.frames) - start
+        if n == stop - start:
+            block = self.a.read(start, stop)
+        else:
+            block = np.zeros((stop - start, self.channels), dtype=np.int32)
+            if n > 0:
+                block[:n] = self.a.read(start, start + n)
+        n = min(stop, self.b.frames) - start
+        if n > 0:
+            block[:n] += self.b.read(start, start + n)
+            np.clip(block[:n], INT16_MIN, INT16_MAX, out=block[:n])
+        return block
+
+
+def sync(*sources):
+    """sources converted to their most channels and highest sample rate, as pydub's AudioSegment._sync"""
+    channels = max(source.channels for source in sources)
+    sr = max(source.sr for source in sources)
+    synced = []
+    for source in sources:
+        # channels are converted independently, so mono audio is resampled before it is copied to the others
+        if source.sr != sr:
+            source = RateConverter(source, sr)
+        if source.channels != channels:
+            source = Channels(source, channels)
+        synced.append(source)
+    return synced
+
+
+def iter_blocks(source):
+    for start in range(0, source.frames, BLOCK_SIZE):
+        yield source.read(start, min(start + BLOCK_SIZE, source.frames)).astype('<i2').tobytes()
+
+
+def write_wav(source, output_path):
+    """writes source as 16-bit PCM with the same header pydub's wav export writes"""
+    with wave.open(output_path, 'wb') as f:
+        f.setnchannels(source.channels)
+        f.setsampwidth(2)
+        f.setframerate(source.sr)
+        f.setnframes(source.frames)
+        for block in iter_blocks(source):
+            f.writeframesraw(block)
+
+def encode(source, output_path, output_format):
+    """streams source as raw PCM into one ffmpeg process encoding it to output_format"""
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 's16le', '-ar', str(source.sr), '-ac', str(source.channels), '-i', 'pipe:0',
+        '-f', output_format, output_path,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for block in iter_blocks(source):
+            process.stdin.write(block)
+    except BrokenPipeError:
+        # ffmpeg exited early, its error is reported below
+        pass
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f'Unable to encode {output_path}: {stderr.decode(errors="replace").strip()}')
 
 def combine_audio(audio_paths, output_path, main_gain, backup_gain, inst_gain, output_format):
-    main_vocal_audio = AudioSegment.from_wav(audio_paths[0]) - 4 + main_gain
-    backup_vocal_audio = AudioSegment.from_wav(audio_paths[1]) - 6 + backup_gain
-    instrumental_audio = AudioSegment.from_wav(audio_paths[2]) - 7 + inst_gain
-    main_vocal_audio.overlay(backup_vocal_audio).overlay(instrumental_audio).export(output_path, format=output_format)
\ No newline at end of file
+    """
+    mixes the main vocals, backup vocals and instrumentals into output_path.
+
+    The stems are memory-mapped and mixed block by block with the exact integer arithmetic pydub used (gains,
+    channel and sample rate conversion, saturating overlays), so the output is the same as with AudioSegment,
+    without holding the songs in memory. wav is written directly, other formats go through a single ffmpeg pass.
+    """
+    main_vocal_audio = Stem(audio_paths[0], [-4, main_gain])
+    backup_vocal_audio = Stem(audio_paths[1], [-6, backup_gain])
+    instrumental_audio = Stem(audio_paths[2], [-7, inst_gain])
+    mix = Overlay(Overlay(main_vocal_audio, backup_vocal_audio), instrumental_audio)
+
+    if output_format == 'wav':
+        write_wav(mix, output_path)
+    else:
+        encode(mix, output_path, output_format)
@@ -0,0 +1,93 @@
+# app/services/preprocess/analysis_cache.py
+
+# default imports
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+import allin1
+
+# module imports
+from app.config import get_logger, Settings
+from app.utils import get_hash, prune_dir_lru, LRUFileCache
+
+logger = get_logger(__name__)
+
+# model used by allin1.analyze, part of the cache key
+ALLIN1_MODEL = 'harmonix-all'
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    label: str
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of allin1 music structure analysis (bpm, beats, downbeats and labelled segments).
+
+    Results are stored as small JSON files keyed by the content hash of the analysed audio, so the same song is
+    analysed once whatever its file name. allin1 also leaves demixed stems in DEMIX_DIR and spectrograms in
+    SPEC_DIR that are only useful to re-analyse the same file; both are pruned least recently used first after
+    every analysis.
+    """
+
+    def __init__(self, cache_dir=Settings.ANALYSIS_CACHE_DIR, max_mb=Settings.ANALYSIS_CACHE_MAX_MB,
+                 demix_max_mb=Settings.DEMIX_MAX_MB, spec_max_mb=Settings.SPEC_MAX_MB):
+        self.files = LRUFileCache(cache_dir, max_mb * 1024 ** 2, f'_{ALLIN1_MODEL}.json', logger)
+        self.demix_max_bytes = demix_max_mb * 1024 ** 2
+        self.spec_max_bytes = spec_max_mb * 1024 ** 2
+        self._lock = threading.Lock()
+
+    def get(self, audio_hash):
+        try:
+            with open(self.files.get_path(audio_hash)) as f:
+                analysis = json.load(f)
+            self.files.touch(audio_hash)
+        except (OSError, ValueError):
+            return None
+
+        logger.info(f'Analysis cache hit: {audio_hash}')
+        return analysis
+
+    def put(self, audio_hash, analysis):
+        self.files.write(audio_hash, lambda f: f.write(json.dumps(analysis).encode()))
+
+    def analyze(self, audio_path, audio_hash=None):
+        """returns the analysis of audio_path as a dict, running allin1 only on a cache miss"""
+        audio_hash = audio_hash or get_hash(audio_path)
+        analysis = self.get(audio_hash)
+        if analysis is not None:
+            return analysis
+
+        result = allin1.analyze(audio_path, model=ALLIN1_MODEL, demix_dir=Settings.DEMIX_DIR, spec_dir=Settings.SPEC_DIR)
+        analysis = {
+            'bpm': result.bpm,
+            'beats': [float(t) for t in result.beats],
+            'downbeats': [float(t) for t in result.downbeats],
+            'beat_positions': [int(p) for p in result.beat_positions],
+            'segments': [{'start': float(s.start), 'end': float(s.end), 'label': s.label} for s in result.segments],
+        }
+        self.put(audio_hash, analysis)
+        self.prune_artifacts()
+        return analysis
+
+    def prune_artifacts(self):
+        with self._lock:
+            removed = prune_dir_lru(Settings.SPEC_DIR, self.spec_max_bytes)
+            # demixed stems are grouped by demucs model: DEMIX_DIR/<model>/<song>/
+            if os.path.isdir(Settings.DEMIX_DIR):
+                for name in os.listdir(Settings.DEMIX_DIR):
+                    removed += prune_dir_lru(os.path.join(Settings.DEMIX_DIR, name), self.demix_max_bytes)
+        if removed:
+            logger.info(f'Removed {len(removed)} old allin1 artifacts')
+
+    @staticmethod
+    def get_segments(analysis, label=None):
+        return [Segment(**s) for s in analysis['segments'] if label is None or s['label'] == label]
+
+
+analysis_cache = AnalysisCache()
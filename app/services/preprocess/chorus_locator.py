@@ -0,0 +1,57 @@
+# app/services/preprocess/chorus_locator.py
+
+# default imports
+import librosa
+import numpy as np
+
+# module imports
+from app.services.preprocess.analysis_cache import Segment
+from app.services.audio.decode import read_audio
+
+
+def moving_average(x, width):
+    width = max(int(width), 1)
+    return np.convolve(x, np.ones(width) / width, mode='same')
+
+
+def locate_chorus(audio_path, sr=22050, hop_length=4096, memory_seconds=4, min_lag_seconds=10, min_duration=10,
+                  quantile=0.65):
+    """
+    Lightweight chorus locator: finds the loud, most repeated parts of a song from a self-similarity matrix of
+    time-delay embedded chroma, without source separation or a neural network.
+
+    Chroma is computed on a 22.05 kHz mono decode with ~0.19 s frames and stacked over memory_seconds, so that
+    similarity compares short chord sequences rather than single chords. Every frame is scored by its mean cosine
+    similarity to its best matches at least min_lag_seconds away, weighted by loudness and smoothed over
+    min_duration. Regions scoring above the quantile and lasting at least min_duration / 2 are returned as
+    'chorus' segments, in time order.
+    """
+    y, sr = read_audio(audio_path, sr=sr, mono=True)
+    frame_seconds = hop_length / sr
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_fft=hop_length * 2, hop_length=hop_length, tuning=0.0)
+    rms = librosa.feature.rms(y=y, frame_length=hop_length * 2, hop_length=hop_length)[0]
+    n_frames = min(chroma.shape[1], rms.shape[0])
+    if n_frames * frame_seconds < min_duration * 2:
+        return []
+
+    features = librosa.feature.stack_memory(chroma[:, :n_frames], n_steps=max(int(memory_seconds / frame_seconds), 1))
+    features /= np.linalg.norm(features, axis=0, keepdims=True) + 1e-9
+    similarity = features.T @ features
+
+    # ignore the frame itself and its neighbourhood, a repetition has to be at least min_lag_seconds away
+    frames = np.arange(n_frames)
+    similarity[np.abs(frames[:, None] - frames[None, :]) < int(min_lag_seconds / frame_seconds)] = 0
+    n_matches = max(int(min_duration / frame_seconds) // 4, 1)
+    repetition = np.partition(similarity, -n_matches, axis=1)[:, -n_matches:].mean(axis=1)
+
+    loudness = rms[:n_frames] / (rms[:n_frames].max() + 1e-9)
+    score = moving_average(np.clip(repetition, 0, None) * (0.5 + 0.5 * loudness), min_duration / frame_seconds)
+    selected = score >= np.quantile(score, quantile)
+
+    # contiguous runs of selected frames
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], selected.astype(np.int8), [0]])))
+    segments = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if (end - start) * frame_seconds >= min_duration / 2:
+            segments.append(Segment(start=float(start * frame_seconds), end=float(end * frame_seconds), label='chorus'))
+    return segments
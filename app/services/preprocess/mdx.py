@@ -7,14 +7,22 @@ import os
 import queue
 import threading
 import warnings
+from contextlib import contextmanager
 
-import librosa
 import numpy as np
 import torch
 import onnxruntime as ort
 import soundfile as sf
 from tqdm import tqdm
 
+# module imports
+from app.config import get_logger, Settings
+from app.services.metrics.metrics import stage
+from app.services.job_queue.stage_limiter import stage_limit
+from app.services.audio.decode import read_audio
+
+logger = get_logger(__name__)
+
 warnings.filterwarnings("ignore")
 stem_naming = {'Vocals': 'Instrumental', 'Other': 'Instruments', 'Instrumental': 'Vocals', 'Drums': 'Drumless', 'Bass': 'Bassless'}
 
@@ -65,23 +73,40 @@ class MDX:
 
     DEFAULT_PROCESSOR = 0
 
-    def __init__(self, model_path: str, params: MDXModel, processor=DEFAULT_PROCESSOR):
+    def __init__(self, model_path: str, params: MDXModel, processor=DEFAULT_PROCESSOR, session=None, batch_size=1):
 
         # Set the device and the provider (CPU or CUDA)
         self.device = torch.device(f'cuda:{processor}') if (processor >= 0 and torch.cuda.is_available()) else torch.device('cpu')
         print('init MDX, device: ', self.device)
-        self.provider = ['CUDAExecutionProvider'] if (processor >= 0 and torch.cuda.is_available()) else ['CPUExecutionProvider']
+        self.provider = self.get_provider(processor)
 
         self.model = params
 
-        # Load the ONNX model using ONNX Runtime
-        self.ort = ort.InferenceSession(model_path, providers=self.provider)
-        # Preload the model for faster performance
-        self.ort.run(None, {'input': torch.rand(1, 4, params.dim_f, params.dim_t).numpy()})
+        if session is None:
+            # Load the ONNX model using ONNX Runtime
+            session = self.create_session(model_path, params, self.provider)
+        self.ort = session
         self.process = lambda spec: self.ort.run(None, {'input': spec.cpu().numpy()})[0]
+        self.batch_size = max(batch_size, 1)
 
         self.prog = None
 
+    @staticmethod
+    def get_provider(processor=DEFAULT_PROCESSOR):
+        return ['CUDAExecutionProvider'] if (processor >= 0 and torch.cuda.is_available()) else ['CPUExecutionProvider']
+
+    @staticmethod
+    def create_session(model_path, params: MDXModel, provider):
+        options = ort.SessionOptions()
+        if Settings.ORT_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = Settings.ORT_INTRA_OP_THREADS
+        if Settings.ORT_INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = Settings.ORT_INTER_OP_THREADS
+        session = ort.InferenceSession(model_path, sess_options=options, providers=provider)
+        # Preload the model for faster performance
+        session.run(None, {'input': torch.rand(1, 4, params.dim_f, params.dim_t).numpy()})
+        return session
+
     @staticmethod
     def get_hash(model_path):
         try:
@@ -178,6 +203,9 @@ class MDX:
         """
         Process each wave segment in a multi-threaded environment
 
+        Chunks are processed batch_size at a time: STFT, ONNX inference and iSTFT each run once over the
+        stacked batch.
+
         Args:
             mix_waves: (torch.Tensor) Wave segments to be processed
             trim: (int) Number of samples trimmed during padding
@@ -188,13 +216,13 @@ class MDX:
         Returns:
             numpy array: Processed wave segment
         """
-        mix_waves = mix_waves.split(1)
+        mix_waves = mix_waves.split(self.batch_size)
         with torch.no_grad():
             pw = []
             for mix_wave in mix_waves:
-                self.prog.update()
+                self.prog.update(mix_wave.shape[0])
                 spec = self.model.stft(mix_wave)
-                processed_spec = torch.tensor(self.process(spec))
+                processed_spec = torch.from_numpy(self.process(spec))
                 processed_wav = self.model.istft(processed_spec.to(self.device))
                 processed_wav = processed_wav[:, :, trim:-trim].transpose(0, 1).reshape(2, -1).cpu().numpy()
                 pw.append(processed_wav)
@@ -239,7 +267,106 @@ class MDX:
         return self.segment(processed_batches, True, chunk)
 
 
-def run_mdx(model_params, output_dir, model_path, filename, exclude_main=False, exclude_inversion=False, suffix=None, invert_suffix=None, denoise=False, keep_orig=True, m_threads=2):
+class MDXSessionPool:
+    """
+    Long-lived ONNX Runtime sessions shared across requests
+
+    Holds up to `size` warmed-up sessions per (model path, provider). A session is checked out for the duration of
+    a separation pass; when all sessions of a model are busy, callers wait for one to be released.
+    Model hashes are cached per model path and mtime so the file is only hashed once.
+    """
+
+    def __init__(self, size=Settings.MDX_SESSION_POOL_SIZE):
+        self.size = max(size, 1)
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._created = {}
+        self._hashes = {}
+
+    def get_hash(self, model_path):
+        key = (model_path, os.path.getmtime(model_path))
+        with self._lock:
+            if key not in self._hashes:
+                self._hashes[key] = MDX.get_hash(model_path)
+            return self._hashes[key]
+
+    def get_model(self, model_params, model_path, device):
+        """builds the MDXModel for model_path from its entry in model_data.json"""
+        mp = model_params.get(self.get_hash(model_path))
+        return MDXModel(
+            device,
+            dim_f=mp["mdx_dim_f_set"],
+            dim_t=2 ** mp["mdx_dim_t_set"],
+            n_fft=mp["mdx_n_fft_scale_set"],
+            stem_name=mp["primary_stem"],
+            compensation=mp["compensate"]
+        )
+
+    @contextmanager
+    def session(self, model_path, params: MDXModel, provider):
+        key = (model_path, tuple(provider))
+        with self._lock:
+            idle = self._idle.setdefault(key, queue.Queue())
+            create = idle.empty() and self._created.get(key, 0) < self.size
+            if create:
+                self._created[key] = self._created.get(key, 0) + 1
+
+        if create:
+            try:
+                logger.info(f'Creating ONNX session for {os.path.basename(model_path)} ({provider[0]})')
+                session = MDX.create_session(model_path, params, provider)
+            except Exception:
+                with self._lock:
+                    self._created[key] -= 1
+                raise
+        else:
+            # blocks until another request releases a session of this model
+            session = idle.get()
+
+        try:
+            yield session
+        finally:
+            idle.put(session)
+
+    def warmup(self, model_params, model_paths, processor=MDX.DEFAULT_PROCESSOR):
+        """creates and warms up one session per model so the first request doesn't pay for it"""
+        device = torch.device(f'cuda:{processor}') if (processor >= 0 and torch.cuda.is_available()) else torch.device('cpu')
+        provider = MDX.get_provider(processor)
+        for model_path in model_paths:
+            model = self.get_model(model_params, model_path, device)
+            with self.session(model_path, model, provider):
+                pass
+
+
+mdx_session_pool = MDXSessionPool()
+
+
+def get_stem_names(model: MDXModel, suffix=None, invert_suffix=None):
+    """returns the names of the main and inverted stems produced by model"""
+    stem_name = model.stem_name if suffix is None else suffix
+    diff_stem_name = stem_naming.get(stem_name) if invert_suffix is None else invert_suffix
+    invert_stem_name = f"{stem_name}_diff" if diff_stem_name is None else diff_stem_name
+    return stem_name, invert_stem_name
+
+
+def run_mdx_wave(model_params, model_path, wave, denoise=False, m_threads=2, batch_size=Settings.MDX_BATCH_SIZE):
+    """
+    Separate an in-memory wave with an MDX model
+
+    Args:
+        model_params: (dict) Model parameters from model_data.json, keyed by model hash
+        model_path: (str) Path to the ONNX model
+        wave: (np.array) Stereo wave of shape (2, n_samples) at 44.1 kHz
+        denoise: (bool) Average the outputs of the wave and its inversion to cancel model noise
+        m_threads: (int) Number of threads used on GPU
+        batch_size: (int) Number of chunks per ONNX Runtime call
+
+    Returns:
+        tuple: (model, wave_processed, wave_inverted)
+            - model: MDXModel used for the separation
+            - wave_processed: Primary stem of the model
+            - wave_inverted: Input wave minus the primary stem
+    """
     # Set the device to GPU if available; otherwise, use CPU
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
     
@@ -249,38 +376,43 @@ def run_mdx(model_params, output_dir, model_path, filename, exclude_main=False,
         vram_gb = device_properties.total_memory / 1024**3
         m_threads = 1 if vram_gb < 8 else 2
     else:
-        m_threads = 1  # Default for CPU
+        m_threads = Settings.MDX_CPU_THREADS
 
     # Load model parameters based on model hash
-    model_hash = MDX.get_hash(model_path)
-    mp = model_params.get(model_hash)
-    model = MDXModel(
-        device,
-        dim_f=mp["mdx_dim_f_set"],
-        dim_t=2 ** mp["mdx_dim_t_set"],
-        n_fft=mp["mdx_n_fft_scale_set"],
-        stem_name=mp["primary_stem"],
-        compensation=mp["compensate"]
-    )
-
-    # Initialize MDX session
-    mdx_sess = MDX(model_path, model)
-    
-    # Load and normalize the audio file
-    wave, sr = librosa.load(filename, mono=False, sr=44100)
+    model = mdx_session_pool.get_model(model_params, model_path, device)
+
+    # Normalize the audio
     peak = max(np.max(wave), abs(np.min(wave)))
-    wave /= peak
-    
-    # Process the wave data
-    if denoise:
-        wave_processed = -(mdx_sess.process_wave(-wave, m_threads)) + (mdx_sess.process_wave(wave, m_threads))
-        wave_processed *= 0.5
-    else:
-        wave_processed = mdx_sess.process_wave(wave, m_threads)
+    wave = wave / peak
+
+    # Check out a warmed-up session from the pool and process the wave data
+    with stage_limit('mdx'), stage(f'mdx:{os.path.splitext(os.path.basename(model_path))[0]}'), \
+            mdx_session_pool.session(model_path, model, MDX.get_provider()) as session:
+        mdx_sess = MDX(model_path, model, session=session, batch_size=batch_size)
+        if denoise:
+            wave_processed = -(mdx_sess.process_wave(-wave, m_threads)) + (mdx_sess.process_wave(wave, m_threads))
+            wave_processed *= 0.5
+        else:
+            wave_processed = mdx_sess.process_wave(wave, m_threads)
 
     # Restore original peak level
     wave_processed *= peak
-    stem_name = model.stem_name if suffix is None else suffix
+    wave_inverted = (-wave_processed * model.compensation) + wave
+
+    # Cleanup to free memory
+    del mdx_sess, wave
+    gc.collect()
+
+    return model, wave_processed, wave_inverted
+
+
+def run_mdx(model_params, output_dir, model_path, filename, exclude_main=False, exclude_inversion=False, suffix=None, invert_suffix=None, denoise=False, keep_orig=True, m_threads=2, batch_size=Settings.MDX_BATCH_SIZE):
+    # Load the audio file
+    wave, sr = read_audio(filename, sr=44100)
+    if wave.shape[0] == 1:
+        wave = np.concatenate([wave, wave])
+    model, wave_processed, wave_inverted = run_mdx_wave(model_params, model_path, wave, denoise=denoise, m_threads=m_threads, batch_size=batch_size)
+    stem_name, invert_stem_name = get_stem_names(model, suffix, invert_suffix)
 
     # Save main output if not excluded
     main_filepath = None
@@ -291,17 +423,15 @@ def run_mdx(model_params, output_dir, model_path, filename, exclude_main=False,
     # Save inverted output if not excluded
     invert_filepath = None
     if not exclude_inversion:
-        diff_stem_name = stem_naming.get(stem_name) if invert_suffix is None else invert_suffix
-        stem_name = f"{stem_name}_diff" if diff_stem_name is None else diff_stem_name
-        invert_filepath = os.path.join(output_dir, f"{os.path.basename(os.path.splitext(filename)[0])}_{stem_name}.wav")
-        sf.write(invert_filepath, (-wave_processed.T * model.compensation) + wave.T, sr)
+        invert_filepath = os.path.join(output_dir, f"{os.path.basename(os.path.splitext(filename)[0])}_{invert_stem_name}.wav")
+        sf.write(invert_filepath, wave_inverted.T, sr)
 
     # Optionally delete original file
     if not keep_orig:
         os.remove(filename)
 
     # Cleanup to free memory
-    del mdx_sess, wave_processed, wave
+    del wave_processed, wave_inverted, wave
     gc.collect()
     
     return main_filepath, invert_filepath
@@ -3,18 +3,19 @@
 # default imports
 import os
 import json
-import shlex
-import subprocess
-import allin1.analyze
-import librosa
 import numpy as np
+import soundfile as sf
 
 # module imports
 from app.config import get_logger, Settings
+from app.utils import get_hash
 from app.services.youtube_download.youtube_download import yt_download
-from app.services.preprocess.mdx import run_mdx
-
-import allin1
+from app.services.preprocess.mdx import run_mdx, run_mdx_wave, get_stem_names, mdx_session_pool
+from app.services.preprocess.stem_cache import stem_cache
+from app.services.preprocess.analysis_cache import analysis_cache
+from app.services.preprocess.chorus_locator import locate_chorus
+from app.services.metrics.metrics import stage
+from app.services.audio.decode import get_info, read_audio
 
 import warnings
 
@@ -26,6 +27,18 @@ mdx_model_params = None
 with open(os.path.join(Settings.MDX_MODEL_DIR, 'model_data.json')) as infile:
     mdx_model_params = json.load(infile)
 
+mdx_model_names = ['UVR-MDX-NET-Voc_FT.onnx', 'UVR_MDXNET_KARA_2.onnx', 'Reverb_HQ_By_FoxJoy.onnx']
+
+# chorus window cut by do_extract_chorus, in seconds
+CHORUS_PADDING = 3
+CHORUS_MAX_DURATION = 90
+# allin1: song structure analysis, fast: lightweight chroma self-similarity locator with allin1 as fallback
+CHORUS_METHODS = ('allin1', 'fast')
+
+def warmup_mdx_models():
+    logger.info('Warming up MDX sessions...')
+    mdx_session_pool.warmup(mdx_model_params, [os.path.join(Settings.MDX_MODEL_DIR, name) for name in mdx_model_names])
+
 def get_audio_paths(song_dir):
     orig_song_path = None
     instrumentals_path = None
@@ -46,23 +59,66 @@ def get_audio_paths(song_dir):
     return orig_song_path, instrumentals_path, main_vocals_dereverb_path, backup_vocals_path
 
 def convert_to_stereo(audio_path):
-    wave, sr = librosa.load(audio_path, mono=False, sr=44100)
-
     # check if mono
-    if type(wave[0]) != np.ndarray:
+    if get_info(audio_path).channels == 1:
         stereo_path = f'{os.path.splitext(audio_path)[0]}_stereo.wav'
-        command = shlex.split(f'ffmpeg -y -loglevel error -i "{audio_path}" -ac 2 -f wav "{stereo_path}"')
-        subprocess.run(command)
+        wave, sr = read_audio(audio_path)
+        sf.write(stereo_path, np.concatenate([wave, wave]).T, sr)
         return stereo_path
     else:
         return audio_path
 
-def preprocess_song(song_input, input_type, song_output_dir, artist_name=None, song_name=None, extract_chorus=True):
+def get_chorus_window(extract_chorus, padding=CHORUS_PADDING, max_duration=CHORUS_MAX_DURATION, choose_longest=False, method='allin1'):
+    """describes the part of the song that gets separated, used in the stem cache key"""
+    if not extract_chorus:
+        return 'full'
+    return f'chorus_p{padding}_d{max_duration}_{"longest" if choose_longest else "first"}{"" if method == "allin1" else f"_{method}"}'
+
+def separate_song_in_memory(orig_song_path, song_output_dir, keep_orig=True, keep_files=False):
+    """decodes the song once and runs the three MDX passes on in-memory waves.
+    Only the stems used by the rest of the pipeline are written, plus the intermediate stems if keep_files is set."""
+    wave, sr = read_audio(orig_song_path, sr=44100)
+    if wave.shape[0] == 1:
+        wave = np.concatenate([wave, wave])
+    if not keep_orig:
+        os.remove(orig_song_path)
+
+    def write_stem(name, stem_wave):
+        path = os.path.join(song_output_dir, f'{name}.wav')
+        sf.write(path, stem_wave.T, sr)
+        return path
+
+    name = os.path.splitext(os.path.basename(orig_song_path))[0]
+    vocals_path, main_vocals_path = None, None
+
+    logger.display_progress('[~] Separating Vocals from Instrumental...', 0.1)
+    model, vocals, instrumentals = run_mdx_wave(mdx_model_params, os.path.join(Settings.MDX_MODEL_DIR, 'UVR-MDX-NET-Voc_FT.onnx'), wave, denoise=True)
+    vocals_name, instrumentals_name = get_stem_names(model)
+    instrumentals_path = write_stem(f'{name}_{instrumentals_name}', instrumentals)
+    if keep_files:
+        vocals_path = write_stem(f'{name}_{vocals_name}', vocals)
+    del wave, instrumentals
+
+    logger.display_progress('[~] Separating Main Vocals from Backup Vocals...', 0.2)
+    model, backup_vocals, main_vocals = run_mdx_wave(mdx_model_params, os.path.join(Settings.MDX_MODEL_DIR, 'UVR_MDXNET_KARA_2.onnx'), vocals, denoise=True)
+    backup_vocals_path = write_stem(f'{name}_{vocals_name}_Backup', backup_vocals)
+    if keep_files:
+        main_vocals_path = write_stem(f'{name}_{vocals_name}_Main', main_vocals)
+    del vocals, backup_vocals
+
+    logger.display_progress('[~] Applying DeReverb to Vocals...', 0.3)
+    model, _, main_vocals_dereverb = run_mdx_wave(mdx_model_params, os.path.join(Settings.MDX_MODEL_DIR, 'Reverb_HQ_By_FoxJoy.onnx'), main_vocals, denoise=True)
+    main_vocals_dereverb_path = write_stem(f'{name}_{vocals_name}_Main_DeReverb', main_vocals_dereverb)
+
+    return vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path
+
+def preprocess_song(song_input, input_type, song_output_dir, artist_name=None, song_name=None, extract_chorus=True, keep_files=False, in_memory=Settings.PREPROCESS_IN_MEMORY, chorus_method='allin1'):
     keep_orig = False
     if input_type == 'yt':
         logger.display_progress('[~] Downloading song...', 0)
         song_link = song_input.split('&')[0] if song_input else None
-        orig_song_path = yt_download(song_link, artist_name, song_name)
+        with stage('download'):
+            orig_song_path = yt_download(song_link, artist_name, song_name)
     elif input_type == 'local':
         orig_song_path = song_input
         keep_orig = True
@@ -70,12 +126,34 @@ def preprocess_song(song_input, input_type, song_output_dir, artist_name=None, s
         orig_song_path = None
 
     logger.info(f'orig_song_path: {orig_song_path}')
-    
+
+    # the content hash keys both the stem cache and the song structure analysis cache
+    song_hash = get_hash(orig_song_path)
+
+    # the same song with the same chorus window and MDX models was separated before
+    model_hashes = [mdx_session_pool.get_hash(os.path.join(Settings.MDX_MODEL_DIR, name)) for name in mdx_model_names]
+    stem_key = stem_cache.get_key(song_hash, get_chorus_window(extract_chorus, method=chorus_method), model_hashes)
+    if not keep_files:
+        cached_paths = stem_cache.get(stem_key, song_output_dir)
+        if cached_paths is not None:
+            logger.display_progress('[~] Using cached Vocals and Instrumental...', 0.3)
+            if not keep_orig:
+                os.remove(orig_song_path)
+            orig_song_path, instrumentals_path, backup_vocals_path, main_vocals_dereverb_path = cached_paths
+            return orig_song_path, None, instrumentals_path, None, backup_vocals_path, main_vocals_dereverb_path
+
     if extract_chorus:
         chorus_path = os.path.join(song_output_dir, f'{os.path.basename(orig_song_path).replace(".wav", "")}_Chorus.wav')
-        do_extract_chorus(orig_song_path, chorus_path)
+        with stage('chorus'):
+            do_extract_chorus(orig_song_path, chorus_path, audio_hash=song_hash, method=chorus_method)
         orig_song_path = chorus_path
 
+    if in_memory:
+        vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path = separate_song_in_memory(
+            orig_song_path, song_output_dir, keep_orig=keep_orig, keep_files=keep_files)
+        stem_cache.put(stem_key, orig_song_path, instrumentals_path, backup_vocals_path, main_vocals_dereverb_path)
+        return orig_song_path, vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path
+
     orig_song_path = convert_to_stereo(orig_song_path)
 
     logger.display_progress('[~] Separating Vocals from Instrumental...', 0.1)
@@ -87,17 +165,33 @@ def preprocess_song(song_input, input_type, song_output_dir, artist_name=None, s
     logger.display_progress('[~] Applying DeReverb to Vocals...', 0.3)
     _, main_vocals_dereverb_path = run_mdx(mdx_model_params, song_output_dir, os.path.join(Settings.MDX_MODEL_DIR, 'Reverb_HQ_By_FoxJoy.onnx'), main_vocals_path, invert_suffix='DeReverb', exclude_main=True, denoise=True)
 
-    return orig_song_path, vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path
+    stem_cache.put(stem_key, orig_song_path, instrumentals_path, backup_vocals_path, main_vocals_dereverb_path)
 
-def do_extract_chorus(audio_path, chorus_path, padding=3, max_duration=90, choose_longest=False):
-    result = allin1.analyze(audio_path, demix_dir=Settings.DEMIX_DIR, spec_dir=Settings.SPEC_DIR)
-    chorus_info = []
-    if result.segments:
-        chorus_info = [s for s in result.segments if s.label == 'chorus']
-    logger.info(f'Chorus segments: {chorus_info}')
-    if not chorus_info:
-        raise Exception("No chorus found in the song")
+    return orig_song_path, vocals_path, instrumentals_path, main_vocals_path, backup_vocals_path, main_vocals_dereverb_path
 
+def get_chorus_segments(audio_path, method='allin1', audio_hash=None):
+    """chorus segments of the song, in time order.
+    The fast method prefers an allin1 analysis already in the cache and falls back to allin1 if the locator finds nothing."""
+    audio_hash = audio_hash or get_hash(audio_path)
+    if method == 'fast':
+        analysis = analysis_cache.get(audio_hash)
+        if analysis is not None:
+            return analysis_cache.get_segments(analysis, label='chorus')
+        try:
+            chorus_info = locate_chorus(audio_path)
+        except Exception as e:
+            logger.warning(f'Fast chorus locator failed on {audio_path}: {e}')
+            chorus_info = []
+        if chorus_info:
+            return chorus_info
+        logger.info('Fast chorus locator found no chorus, falling back to allin1')
+
+    # allin1 runs only the first time a song is analysed
+    analysis = analysis_cache.analyze(audio_path, audio_hash=audio_hash)
+    return analysis_cache.get_segments(analysis, label='chorus')
+
+def get_chorus_bounds(chorus_info, padding=CHORUS_PADDING, max_duration=CHORUS_MAX_DURATION, choose_longest=False):
+    """(start, duration) in seconds of the chorus cut from the chorus segments"""
     # Merge back-to-back chorus segments
     merged_chorus_segments = []
     current_segment = chorus_info[0]
@@ -117,7 +211,6 @@ def do_extract_chorus(audio_path, chorus_path, padding=3, max_duration=90, choos
 
     if choose_longest:
         # Find the longest merged chorus segment
-        logger.info(f'Extracting longest chorus from {audio_path} to {chorus_path}')
         longest_chorus_segment = max(merged_chorus_segments, key=lambda s: s.end - s.start)
         # Extract the longest chorus segment
         chorus_start = max(longest_chorus_segment.start - padding, 0)
@@ -125,10 +218,20 @@ def do_extract_chorus(audio_path, chorus_path, padding=3, max_duration=90, choos
         chorus_duration = min(chorus_end - chorus_start, max_duration)
     else:
         # Extract the first merged chorus segment
-        logger.info(f'Extracting first chorus from {audio_path} to {chorus_path}')
         chorus_start = max(merged_chorus_segments[0].start - padding, 0)
         chorus_end = merged_chorus_segments[0].end + padding
         chorus_duration = min(chorus_end - chorus_start, max_duration)
         logger.info(f'chorus_duration: {chorus_duration}')
-    command = shlex.split(f'ffmpeg -y -loglevel error -i "{audio_path}" -ss {chorus_start} -t {chorus_duration} "{chorus_path}"')
-    subprocess.run(command)
\ No newline at end of file
+    return chorus_start, chorus_duration
+
+def do_extract_chorus(audio_path, chorus_path, padding=CHORUS_PADDING, max_duration=CHORUS_MAX_DURATION, choose_longest=False, audio_hash=None, method='allin1'):
+    chorus_info = get_chorus_segments(audio_path, method=method, audio_hash=audio_hash)
+    logger.info(f'Chorus segments: {chorus_info}')
+    if not chorus_info:
+        raise Exception("No chorus found in the song")
+
+    logger.info(f'Extracting {"longest" if choose_longest else "first"} chorus from {audio_path} to {chorus_path}')
+    chorus_start, chorus_duration = get_chorus_bounds(chorus_info, padding, max_duration, choose_longest)
+    # only the chorus is decoded, and written without re-encoding the rest of the song
+    wave, sr = read_audio(audio_path, offset=chorus_start, duration=chorus_duration)
+    sf.write(chorus_path, wave.T, sr)
\ No newline at end of file
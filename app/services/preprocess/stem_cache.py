@@ -0,0 +1,93 @@
+# app/services/preprocess/stem_cache.py
+
+# default imports
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+# module imports
+from app.config import get_logger, Settings
+from app.utils import prune_dir_lru
+
+logger = get_logger(__name__)
+
+# stems needed by the rest of the pipeline, in the order returned by StemCache.get
+STEM_SUFFIXES = ['Instrumental', 'Vocals_Backup', 'Vocals_Main_DeReverb']
+
+
+def copy_stem(src, dst):
+    """copies src over dst. Entries are not hardlinked: stems are rewritten in place with sf.write, which would
+    change the cached file through the other name"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    shutil.copyfile(src, dst)
+
+
+class StemCache:
+    """
+    Content-addressed on-disk cache of the separated stems of a song.
+
+    Entries are keyed by the content hash of the input audio, the chorus window and the hashes of the MDX
+    models, so the same song requested with another voice model skips all MDX passes. Each entry is a folder
+    holding the Instrumental, Vocals_Backup and Vocals_Main_DeReverb stems plus a meta.json. The cache is kept
+    under max_mb by evicting least recently used entries.
+    """
+
+    def __init__(self, cache_dir=Settings.STEM_CACHE_DIR, max_mb=Settings.STEM_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 ** 2
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(audio_hash, chorus_window, model_hashes):
+        key = '|'.join([audio_hash, chorus_window, *model_hashes])
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get(self, key, output_dir):
+        """copies the cached stems into output_dir.
+        Returns (orig_song_path, instrumentals_path, backup_vocals_path, main_vocals_dereverb_path) or None on a miss."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, 'meta.json')) as f:
+                meta = json.load(f)
+            name = os.path.splitext(meta['name'])[0]
+            paths = []
+            for suffix in STEM_SUFFIXES:
+                path = os.path.join(output_dir, f'{name}_{suffix}.wav')
+                copy_stem(os.path.join(entry_dir, f'{suffix}.wav'), path)
+                paths.append(path)
+            # mark as recently used for eviction
+            os.utime(entry_dir)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        logger.info(f'Stem cache hit: {key}')
+        return os.path.join(output_dir, meta['name']), *paths
+
+    def put(self, key, orig_song_path, instrumentals_path, backup_vocals_path, main_vocals_dereverb_path):
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = os.path.join(self.cache_dir, f'.{key}.{uuid.uuid4().hex}')
+        try:
+            os.makedirs(tmp_dir)
+            for suffix, path in zip(STEM_SUFFIXES, [instrumentals_path, backup_vocals_path, main_vocals_dereverb_path]):
+                copy_stem(path, os.path.join(tmp_dir, f'{suffix}.wav'))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump({'name': os.path.basename(orig_song_path)}, f)
+
+            with self._lock:
+                if os.path.exists(entry_dir):
+                    shutil.rmtree(entry_dir)
+                os.rename(tmp_dir, entry_dir)
+                removed = prune_dir_lru(self.cache_dir, self.max_bytes)
+            if removed:
+                logger.info(f'Evicted {len(removed)} entries from the stem cache')
+        except OSError as e:
+            logger.warning(f'Unable to cache stems for {orig_song_path}: {e}')
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+stem_cache = StemCache()
@@ -1,6 +1,9 @@
 # app/utils.py
 
 import hashlib
+import os
+import shutil
+import threading
 
 def get_hash(filepath):
     with open(filepath, 'rb') as f:
@@ -8,4 +11,95 @@ def get_hash(filepath):
         while chunk := f.read(8192):
             file_hash.update(chunk)
 
-    return file_hash.hexdigest()[:11]
\ No newline at end of file
+    return file_hash.hexdigest()[:11]
+
+def get_path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+def prune_dir_lru(cache_dir, max_bytes):
+    """deletes the least recently used entries (files or folders) of cache_dir until it fits in max_bytes.
+    Entries are ordered by mtime, so callers should touch an entry with os.utime when they use it."""
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), get_path_size(path), path))
+        except FileNotFoundError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        total -= size
+        removed.append(path)
+
+    return removed
+
+
+class LRUFileCache:
+    """
+    Directory of one file per cache entry, kept under max_bytes by evicting least recently used entries.
+
+    Files are written to a temporary name and renamed into place, so readers never see a partial entry. The
+    size of the directory is listed once and then tracked as entries are written; when it goes over max_bytes
+    the directory is pruned down to PRUNE_TARGET of it, so it is only listed again every few writes.
+    """
+
+    PRUNE_TARGET = 0.9
+
+    def __init__(self, cache_dir, max_bytes, suffix, logger):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.logger = logger
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}{self.suffix}')
+
+    def touch(self, key):
+        """marks key as recently used for eviction, raises OSError when it is not cached"""
+        os.utime(self.get_path(key))
+
+    def write(self, key, write_fn):
+        """stores an entry by calling write_fn with a binary file opened for it. Returns whether it was stored."""
+        path = self.get_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                write_fn(f)
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                if self._size is None:
+                    self._size = get_path_size(self.cache_dir) - size
+                if os.path.exists(path):
+                    self._size -= os.path.getsize(path)
+                os.replace(tmp_path, path)
+                self._size += size
+                if self._size > self.max_bytes:
+                    prune_dir_lru(self.cache_dir, int(self.max_bytes * self.PRUNE_TARGET))
+                    self._size = get_path_size(self.cache_dir)
+        except OSError as e:
+            self.logger.warning(f'Unable to cache {path}: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
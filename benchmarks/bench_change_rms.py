@@ -0,0 +1,102 @@
+# benchmarks/bench_change_rms.py
+"""
+Compares the block-wise RMS envelope matching (change_rms and the streaming RMSMatcher) against the original
+torch implementation: wall time, extra peak memory and the largest difference of the output.
+
+Every run happens in a fresh process so peak RSS is not shared between implementations.
+
+usage (from the repository root):
+    python -m benchmarks.bench_change_rms --minutes 1 5 10 --rate 0.25
+"""
+
+# default imports
+import argparse
+import multiprocessing
+import time
+
+import librosa
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# module imports
+from app.services.audio.rms import change_rms, RMSMatcher
+from app.services.metrics.metrics import get_max_rss
+
+SR_IN = 16000
+SR_OUT = 40000
+STREAM_BLOCK = SR_OUT * 30
+
+
+def change_rms_torch(data1, sr1, data2, sr2, rate):
+    """original implementation from vc_infer_pipeline"""
+    rms1 = librosa.feature.rms(y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2)
+    rms2 = librosa.feature.rms(y=data2, frame_length=sr2 // 2 * 2, hop_length=sr2 // 2)
+    rms1 = torch.from_numpy(rms1)
+    rms1 = F.interpolate(rms1.unsqueeze(0), size=data2.shape[0], mode="linear").squeeze()
+    rms2 = torch.from_numpy(rms2)
+    rms2 = F.interpolate(rms2.unsqueeze(0), size=data2.shape[0], mode="linear").squeeze()
+    rms2 = torch.max(rms2, torch.zeros_like(rms2) + 1e-6)
+    data2 *= (torch.pow(rms1, torch.tensor(1 - rate)) * torch.pow(rms2, torch.tensor(rate - 1))).numpy()
+    return data2
+
+
+def change_rms_stream(data1, sr1, data2, sr2, rate):
+    matcher = RMSMatcher(data1, sr1, sr2, rate, data2.shape[0])
+    out = [matcher.process(data2[b : b + STREAM_BLOCK]) for b in range(0, data2.shape[0], STREAM_BLOCK)]
+    out.append(matcher.flush())
+    return np.concatenate(out)
+
+
+IMPLEMENTATIONS = {'torch': change_rms_torch, 'block': change_rms, 'stream': change_rms_stream}
+
+
+def synthetic_pair(minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    n_in = int(minutes * 60 * SR_IN)
+    data1 = rng.standard_normal(n_in) * np.abs(np.sin(np.arange(n_in) / SR_IN * 0.5))
+    n_out = int(minutes * 60 * SR_OUT)
+    data2 = (rng.standard_normal(n_out) * np.abs(np.cos(np.arange(n_out) / SR_OUT * 0.3))).astype(np.float32)
+    return data1, data2
+
+
+def run(name, minutes, rate, queue):
+    data1, data2 = synthetic_pair(minutes)
+    # warm up librosa / torch so imports and first-call setup are not measured
+    IMPLEMENTATIONS[name](data1[:SR_IN * 5], SR_IN, data2[:SR_OUT * 5].copy(), SR_OUT, rate)
+    rss = get_max_rss()
+    start = time.perf_counter()
+    out = IMPLEMENTATIONS[name](data1, SR_IN, data2, SR_OUT, rate)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, get_max_rss() - rss, out))
+
+
+def measure(name, minutes, rate):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run, args=(name, minutes, rate, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--rate', type=float, default=0.25)
+    args = parser.parse_args()
+
+    print(f'{"minutes":>8} {"impl":>7} {"time (s)":>9} {"peak +MB":>9} {"max diff":>10}')
+    for minutes in args.minutes:
+        expected = None
+        for name in IMPLEMENTATIONS:
+            elapsed, peak, out = measure(name, minutes, args.rate)
+            if expected is None:
+                expected = out
+            diff = np.abs(out.astype(np.float64) - expected).max()
+            print(f'{minutes:>8g} {name:>7} {elapsed:>9.3f} {peak / 1024 ** 2:>9.1f} {diff:>10.2e}')
+
+
+if __name__ == '__main__':
+    main()
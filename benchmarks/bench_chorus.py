@@ -0,0 +1,89 @@
+# benchmarks/bench_chorus.py
+"""
+Compares the fast chorus locator against allin1 on a local corpus of songs: latency of both, and agreement of
+the chorus segments and of the chorus window that would be cut.
+
+usage (from the repository root, with allin1 installed):
+    python -m benchmarks.bench_chorus --corpus /path/to/songs
+"""
+
+# default imports
+import argparse
+import dataclasses
+import os
+import time
+
+import numpy as np
+
+# module imports
+from app.services.preprocess.analysis_cache import analysis_cache
+from app.services.preprocess.chorus_locator import locate_chorus
+from app.services.preprocess.preprocess import get_chorus_bounds
+from app.utils import get_hash
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+
+
+def overlap(a_start, a_end, b_start, b_end):
+    return max(0.0, min(a_end, b_end) - max(a_start, b_start))
+
+
+def segments_overlap(segments, others):
+    return sum(overlap(s.start, s.end, o.start, o.end) for s in segments for o in others)
+
+
+def total_duration(segments):
+    return sum(s.end - s.start for s in segments)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', required=True, help='folder of songs')
+    parser.add_argument('--use-cache', action='store_true', help='reuse cached allin1 analyses (allin1 latency is then not measured)')
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus) if name.lower().endswith(AUDIO_EXTENSIONS))
+    print(f'{"song":<40} {"fast (s)":>9} {"allin1 (s)":>11} {"precision":>10} {"recall":>7} {"window IoU":>11}')
+    rows = []
+    for path in paths:
+        fast_segments, fast_time = timed(locate_chorus, path)
+
+        audio_hash = get_hash(path)
+        analysis = analysis_cache.get(audio_hash) if args.use_cache else None
+        allin1_time = float('nan')
+        if analysis is None:
+            if not args.use_cache:
+                # drop the cached analysis so that allin1 really runs
+                path_json = analysis_cache.files.get_path(audio_hash)
+                if os.path.exists(path_json):
+                    os.remove(path_json)
+            analysis, allin1_time = timed(analysis_cache.analyze, path, audio_hash=audio_hash)
+        allin1_segments = analysis_cache.get_segments(analysis, label='chorus')
+
+        matched = segments_overlap(fast_segments, allin1_segments)
+        precision = matched / total_duration(fast_segments) if fast_segments else float('nan')
+        recall = matched / total_duration(allin1_segments) if allin1_segments else float('nan')
+        iou = float('nan')
+        if fast_segments and allin1_segments:
+            # get_chorus_bounds merges segments in place, pass copies
+            fast_start, fast_duration = get_chorus_bounds([dataclasses.replace(s) for s in fast_segments])
+            allin1_start, allin1_duration = get_chorus_bounds([dataclasses.replace(s) for s in allin1_segments])
+            intersection = overlap(fast_start, fast_start + fast_duration, allin1_start, allin1_start + allin1_duration)
+            iou = intersection / (fast_duration + allin1_duration - intersection)
+
+        rows.append((fast_time, allin1_time, precision, recall, iou))
+        print(f'{os.path.basename(path)[:40]:<40} {fast_time:>9.2f} {allin1_time:>11.2f} {precision:>10.2f} {recall:>7.2f} {iou:>11.2f}')
+
+    if rows:
+        means = np.nanmean(np.array(rows, dtype=float), axis=0)
+        print(f'{"mean":<40} {means[0]:>9.2f} {means[1]:>11.2f} {means[2]:>10.2f} {means[3]:>7.2f} {means[4]:>11.2f}')
+
+
+if __name__ == '__main__':
+    main()
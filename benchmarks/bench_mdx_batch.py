@@ -0,0 +1,59 @@
+# benchmarks/bench_mdx_batch.py
+"""
+Compares batched MDX inference against the per-chunk path on synthetic audio.
+
+usage (from the repository root, with the MDX models downloaded):
+    python -m benchmarks.bench_mdx_batch --model UVR-MDX-NET-Voc_FT.onnx --seconds 120 --batch-sizes 1 2 4 8
+"""
+
+# default imports
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+# module imports
+from app.config import Settings
+from app.services.preprocess.mdx import MDX, mdx_session_pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='UVR-MDX-NET-Voc_FT.onnx')
+    parser.add_argument('--seconds', type=float, default=120)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    with open(os.path.join(Settings.MDX_MODEL_DIR, 'model_data.json')) as infile:
+        model_params = json.load(infile)
+    model_path = os.path.join(Settings.MDX_MODEL_DIR, args.model)
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    model = mdx_session_pool.get_model(model_params, model_path, device)
+
+    rng = np.random.default_rng(0)
+    wave = rng.uniform(-0.5, 0.5, (2, int(args.seconds * MDX.DEFAULT_SR))).astype(np.float32)
+
+    print(f'model: {args.model}, device: {device}, audio: {args.seconds}s')
+    print(f'{"batch":>6} {"best (s)":>10} {"x realtime":>11} {"speedup":>8} {"max abs diff":>13}')
+    reference, baseline = None, None
+    with mdx_session_pool.session(model_path, model, MDX.get_provider()) as session:
+        for batch_size in args.batch_sizes:
+            mdx_sess = MDX(model_path, model, session=session, batch_size=batch_size)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                processed = mdx_sess.process_wave(wave, 1)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            if reference is None:
+                reference, baseline = processed, best
+            diff = np.max(np.abs(processed - reference))
+            print(f'{batch_size:>6} {best:>10.2f} {args.seconds / best:>11.2f} {baseline / best:>8.2f} {diff:>13.2e}')
+
+
+if __name__ == '__main__':
+    main()
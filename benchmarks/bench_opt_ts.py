@@ -0,0 +1,79 @@
+# benchmarks/bench_opt_ts.py
+"""
+Compares the vectorized silence-point search used to split long vocals against the original loop on synthetic audio.
+
+usage (from the repository root):
+    python -m benchmarks.bench_opt_ts --minutes 1 5 10 --trials 5
+"""
+
+# default imports
+import argparse
+import time
+
+import numpy as np
+from scipy import signal
+
+# module imports
+from app.services.ai_cover.vc_infer_pipeline import bh, ah, get_opt_ts
+
+SR = 16000
+WINDOW = 160
+T_CENTER = SR * 38
+T_QUERY = SR * 6
+
+
+def get_opt_ts_loop(audio, window, t_center, t_query):
+    """original implementation from VC.pipeline"""
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+    opt_ts = []
+    audio_sum = np.zeros_like(audio)
+    for i in range(window):
+        audio_sum += audio_pad[i : i - window]
+    for t in range(t_center, audio.shape[0], t_center):
+        opt_ts.append(
+            t
+            - t_query
+            + np.where(
+                np.abs(audio_sum[t - t_query : t + t_query])
+                == np.abs(audio_sum[t - t_query : t + t_query]).min()
+            )[0][0]
+        )
+    return opt_ts
+
+
+def synthetic_vocal(rng, n_samples):
+    # noise gated on and off to get phrase-like gaps, high-passed like the pipeline input
+    gate = np.sin(np.arange(n_samples) / SR * rng.uniform(1, 4)) > rng.uniform(0, 0.5)
+    audio = rng.standard_normal(n_samples).astype(np.float32) * 0.1 * gate
+    return signal.filtfilt(bh, ah, audio)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--trials', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f'{"minutes":>8} {"loop (s)":>9} {"vector (s)":>11} {"speedup":>8} {"identical":>10}')
+    for minutes in args.minutes:
+        loop_time, vector_time, identical = 0.0, 0.0, 0
+        for _ in range(args.trials):
+            audio = synthetic_vocal(rng, int(minutes * 60 * SR))
+            expected, elapsed = timed(get_opt_ts_loop, audio, WINDOW, T_CENTER, T_QUERY)
+            loop_time += elapsed
+            opt_ts, elapsed = timed(get_opt_ts, audio, WINDOW, T_CENTER, T_QUERY)
+            vector_time += elapsed
+            identical += [int(t) for t in expected] == opt_ts
+        print(f'{minutes:>8g} {loop_time / args.trials:>9.3f} {vector_time / args.trials:>11.3f} '
+              f'{loop_time / vector_time:>8.1f} {identical:>6}/{args.trials}')
+
+
+if __name__ == '__main__':
+    main()
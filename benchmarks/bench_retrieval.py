@@ -0,0 +1,91 @@
+# benchmarks/bench_retrieval.py
+"""
+Compares index retrieval and blending of IndexRetriever against the original per-segment code on a synthetic
+768-dim (v2) index built like the RVC training script (IVF with flat lists).
+
+usage (from the repository root):
+    python -m benchmarks.bench_retrieval --index-rows 50000 --segments 8 --segment-frames 2000
+"""
+
+# default imports
+import argparse
+import time
+import tracemalloc
+
+import faiss
+import numpy as np
+
+# module imports
+from app.services.ai_cover.retrieval import IndexRetriever
+
+
+def blend_reference(index, big_npy, npy):
+    """original blend from VC.vc"""
+    score, ix = index.search(npy.astype("float32"), k=8)
+    weight = np.square(1 / score)
+    weight /= weight.sum(axis=1, keepdims=True)
+    return np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
+
+
+def build_index(rng, rows, dim):
+    big_npy = rng.standard_normal((rows, dim)).astype(np.float32)
+    n_ivf = min(int(16 * np.sqrt(rows)), rows // 39)
+    index = faiss.index_factory(dim, f"IVF{n_ivf},Flat")
+    index.train(big_npy)
+    index.add(big_npy)
+    return index, big_npy
+
+
+def measure(fn, repeat):
+    """best wall time and peak traced numpy allocation of fn"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--segment-frames', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index, big_npy = build_index(rng, args.index_rows, args.dim)
+    # HuBERT features arrive as float16 when running half precision
+    segments = [
+        rng.standard_normal((args.segment_frames, args.dim)).astype(np.float16) for _ in range(args.segments)
+    ]
+    retriever = IndexRetriever(index, big_npy)
+
+    def reference():
+        return [blend_reference(index, big_npy, npy) for npy in segments]
+
+    def per_segment():
+        return [retriever.blend(npy).copy() for npy in segments]
+
+    def all_segments():
+        return [out.copy() for out in retriever.blend_many(segments)]
+
+    print(f'index: {args.index_rows}x{args.dim}, segments: {args.segments}x{args.segment_frames} frames')
+    print(f'{"method":>14} {"best (s)":>9} {"speedup":>8} {"peak (MB)":>10} {"max abs diff":>13}')
+    expected, baseline = None, None
+    for name, fn in [('reference', reference), ('per segment', per_segment), ('all segments', all_segments)]:
+        result, best, peak = measure(fn, args.repeat)
+        if expected is None:
+            expected, baseline = result, best
+        diff = max(np.max(np.abs(a - b)) for a, b in zip(result, expected))
+        print(f'{name:>14} {best:>9.3f} {baseline / best:>8.2f} {peak / 1024 ** 2:>10.1f} {diff:>13.2e}')
+
+
+if __name__ == '__main__':
+    main()
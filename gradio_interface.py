@@ -95,4 +95,5 @@ with gr.Blocks() as demo:
                                                       crepe_hop_length, protect, pitch_change_all, reverb_rm_size, reverb_wet, reverb_dry, 
                                                       reverb_damping, output_format], outputs=output)
 
-demo.launch()
\ No newline at end of file
+if __name__ == '__main__':
+    demo.launch()
\ No newline at end of file
@@ -0,0 +1,52 @@
+# tests/test_audio_stream.py
+
+# default imports
+import numpy as np
+import pytest
+from scipy import signal
+
+# module imports
+from app.services.audio.resample import resample, StreamResampler
+from app.services.audio.rms import change_rms, RMSMatcher
+
+
+def blocks(x, sizes=(1000, 17000, 333, 40000)):
+    """x cut into blocks of uneven sizes, as the generator hands them out"""
+    start, i = 0, 0
+    while start < x.shape[0]:
+        yield x[start : start + sizes[i % len(sizes)]]
+        start += sizes[i % len(sizes)]
+        i += 1
+
+
+@pytest.mark.parametrize('orig_sr, target_sr', [(40000, 44100), (48000, 44100), (32000, 48000), (40000, 16000)])
+def test_resample_matches_resample_poly(orig_sr, target_sr):
+    x = np.random.default_rng(0).standard_normal(orig_sr * 2)
+    g = np.gcd(orig_sr, target_sr)
+    np.testing.assert_allclose(
+        resample(x, orig_sr, target_sr), signal.resample_poly(x, target_sr // g, orig_sr // g), rtol=0, atol=1e-12
+    )
+
+
+@pytest.mark.parametrize('orig_sr, target_sr', [(40000, 44100), (48000, 44100), (32000, 48000), (40000, 16000)])
+def test_stream_resampler_matches_resample(orig_sr, target_sr):
+    x = (np.random.default_rng(0).standard_normal(orig_sr * 3 + 7) * 0.3).astype(np.float32)
+    resampler = StreamResampler(orig_sr, target_sr)
+    y = np.concatenate([resampler.process(block) for block in blocks(x)] + [resampler.flush()])
+
+    expected = resample(x, orig_sr, target_sr)
+    assert y.shape == expected.shape
+    np.testing.assert_allclose(y, expected, rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize('rate', [0.0, 0.25, 1.0])
+def test_rms_matcher_matches_change_rms(rate):
+    rng = np.random.default_rng(0)
+    data1 = (rng.standard_normal(16000 * 6) * np.linspace(0.01, 0.5, 16000 * 6)).astype(np.float32)
+    data2 = (rng.standard_normal(40000 * 6 + 321) * 0.2).astype(np.float32)
+
+    matcher = RMSMatcher(data1, 16000, 40000, rate, data2.shape[0])
+    y = np.concatenate([matcher.process(block.copy()) for block in blocks(data2)] + [matcher.flush()])
+
+    expected = change_rms(data1, 16000, data2.copy(), 40000, rate)
+    np.testing.assert_array_equal(y, expected)
@@ -0,0 +1,60 @@
+# tests/test_f0_pool.py
+
+# default imports
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+# module imports
+from app.services.ai_cover.f0_pool import F0Pool, get_slices
+
+SR = 16000
+
+
+def vibrato(seconds=7):
+    t = np.arange(SR * seconds) / SR
+    noise = np.random.default_rng(0).standard_normal(t.shape[0]) * 0.01
+    return 0.3 * np.sin(2 * np.pi * (180 + 40 * np.sin(np.pi * t)) * t) + noise
+
+
+def sliced_pool():
+    # threads instead of spawned processes, the slicing and stitching are the same
+    pool = F0Pool(workers=2, slice_seconds=2, overlap_seconds=1, cache_size=0)
+    pool._executor = ThreadPoolExecutor(2)
+    return pool
+
+
+def pool_broken():
+    raise BrokenProcessPool('worker died')
+
+
+def test_slices_cover_every_frame_once():
+    slices = get_slices(SR * 7 + 123, 160, 200, 100)
+    frames = [frame for _, _, first, n_frames in slices for frame in range(first, first + n_frames)]
+    assert frames == list(range((SR * 7 + 123) // 160 + 1))
+
+
+@pytest.mark.parametrize('method, rtol', [('dio', 1e-9), ('harvest', 1e-3)])
+def test_sliced_f0_matches_whole(method, rtol):
+    x = vibrato()
+    expected = F0Pool(workers=0, cache_size=0).compute(method, x, SR, 10, 50, 1100)
+    f0 = sliced_pool().compute(method, x, SR, 10, 50, 1100)
+
+    assert f0.shape == expected.shape
+    # harvest refines its estimate over neighbouring frames, slicing moves some voiced frames by about a cent
+    assert ((f0 > 0) == (expected > 0)).all()
+    np.testing.assert_allclose(f0, expected, rtol=rtol)
+
+
+def test_broken_pool_falls_back_in_process():
+    x = vibrato(3)
+    expected = F0Pool(workers=0, cache_size=0).compute('dio', x, SR, 10, 50, 1100)
+
+    pool = sliced_pool()
+    pending = pool.submit('dio', x, SR, 10, 50, 1100)
+    pending.parts[0] = (pool._executor.submit(pool_broken), 0, None)
+    np.testing.assert_array_equal(pending.result(), expected)
+    assert pool.workers == 0 and pool._executor is None
+    np.testing.assert_array_equal(pool.compute('dio', x, SR, 10, 50, 1100), expected)
@@ -0,0 +1,115 @@
+# tests/test_hubert_batch.py
+
+# default imports
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+# module imports
+from app.services.ai_cover.feature_cache import feature_cache
+from app.services.ai_cover.vc_infer_pipeline import VC
+
+# (kernel, stride) of the HuBERT base conv feature extractor
+HUBERT_CONV = [(10, 5)] + [(3, 2)] * 4 + [(2, 2)] * 2
+
+
+class Config:
+    x_pad, x_query, x_center, x_max = 1, 6, 38, 41
+    is_half = False
+    device = 'cpu'
+
+
+class Encoder(nn.Module):
+    """small stand-in for fairseq's TransformerEncoder: zeroed padding, positional conv, masked attention"""
+
+    def __init__(self, dim):
+        super().__init__()
+        self.pos_conv = nn.Conv1d(dim, dim, kernel_size=16, padding=8, groups=4)
+        self.layer_norm = nn.LayerNorm(dim)
+        self.layers = nn.ModuleList(
+            nn.TransformerEncoderLayer(dim, 2, 2 * dim, dropout=0.0, batch_first=True) for _ in range(2)
+        )
+
+    def forward(self, x, padding_mask=None, layer=None):
+        if padding_mask is not None:
+            x = x.masked_fill(padding_mask[..., None], 0)
+        # SamePad drops the extra frame of the even kernel
+        x = x + nn.functional.gelu(self.pos_conv(x.transpose(1, 2))[:, :, :-1]).transpose(1, 2)
+        x = self.layer_norm(x)
+        for i, transformer_layer in enumerate(self.layers):
+            x = transformer_layer(x, src_key_padding_mask=padding_mask)
+            if i == layer:
+                break
+        return x, []
+
+
+class TinyHubert(nn.Module):
+    """HubertModel with the structure VC relies on, a GroupNorm over time after the first conv included"""
+
+    def __init__(self, channels=16, dim=32):
+        super().__init__()
+        convs = []
+        for i, (kernel, stride) in enumerate(HUBERT_CONV):
+            conv = [nn.Conv1d(1 if i == 0 else channels, channels, kernel, stride, bias=False)]
+            if i == 0:
+                conv.append(nn.GroupNorm(channels, channels))
+            convs.append(nn.Sequential(*conv, nn.GELU()))
+        self.convs = nn.Sequential(*convs)
+        self.layer_norm = nn.LayerNorm(channels)
+        self.post_extract_proj = nn.Linear(channels, dim)
+        self.dropout_input = nn.Dropout(0.0)
+        self.encoder = Encoder(dim)
+        self.final_proj = nn.Linear(dim, 8)
+
+    def forward_features(self, source):
+        return self.convs(source.unsqueeze(1))
+
+    def extract_features(self, source, padding_mask=None, output_layer=None):
+        features = self.layer_norm(self.forward_features(source).transpose(1, 2))
+        if padding_mask is not None:
+            extra = padding_mask.size(1) % features.size(1)
+            if extra > 0:
+                padding_mask = padding_mask[:, :-extra]
+            padding_mask = padding_mask.view(padding_mask.size(0), features.size(1), -1).all(-1)
+        x = self.dropout_input(self.post_extract_proj(features))
+        x, _ = self.encoder(x, padding_mask=padding_mask, layer=None if output_layer is None else output_layer - 1)
+        return x, padding_mask
+
+
+@pytest.mark.parametrize('version', ['v1', 'v2'])
+def test_batched_features_match_sequential(monkeypatch, version):
+    monkeypatch.setattr(feature_cache.files, 'max_bytes', 0)
+    torch.manual_seed(0)
+    model = TinyHubert().eval()
+    vc = VC(40000, Config())
+
+    rng = np.random.default_rng(0)
+    # a full segment and the short tail segment that ends the song
+    audios = [rng.standard_normal(16000 * 8).astype(np.float32) * 0.1,
+              rng.standard_normal(16000 + 123).astype(np.float32) * 0.1]
+
+    sequential = [vc.extract_feats(model, audio0, version) for audio0 in audios]
+    batched = vc.extract_feats_batch(model, audios, version)
+
+    for feats, expected in zip(batched, sequential):
+        assert feats.shape == expected.shape
+        torch.testing.assert_close(feats, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_padded_features_are_not_cached(monkeypatch, tmp_path):
+    monkeypatch.setattr(feature_cache.files, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(feature_cache.files, 'max_bytes', 1024 ** 2)
+    monkeypatch.setattr(feature_cache.files, '_size', None)
+    torch.manual_seed(0)
+    model = TinyHubert().eval()
+    vc = VC(40000, Config())
+
+    rng = np.random.default_rng(1)
+    audios = [rng.standard_normal(16000 * 4).astype(np.float32) * 0.1,
+              rng.standard_normal(8000).astype(np.float32) * 0.1]
+    vc.extract_feats_batch(model, audios, 'v2')
+
+    keys = [feature_cache.get_key(audio0, 'v2', False) for audio0 in audios]
+    assert feature_cache.get(keys[0], 'cpu', torch.float32) is not None
+    assert feature_cache.get(keys[1], 'cpu', torch.float32) is None
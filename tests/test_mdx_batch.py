@@ -0,0 +1,53 @@
+# tests/test_mdx_batch.py
+
+# default imports
+import importlib
+import importlib.util
+import sys
+import types
+
+import numpy as np
+import pytest
+
+
+class Session:
+    """stand-in for the ONNX Runtime session, a model acting on every chunk of the batch on its own"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def run(self, output_names, inputs):
+        spec = inputs['input']
+        self.batch_sizes.append(spec.shape[0])
+        return [np.tanh(spec) * 0.5]
+
+
+@pytest.fixture
+def mdx():
+    module_name = 'app.services.preprocess.mdx'
+    loaded = module_name in sys.modules
+    fake_ort = importlib.util.find_spec('onnxruntime') is None
+    if fake_ort:
+        # the session is passed in, ONNX Runtime itself is never called
+        sys.modules['onnxruntime'] = types.ModuleType('onnxruntime')
+    try:
+        yield importlib.import_module(module_name)
+    finally:
+        if fake_ort:
+            sys.modules.pop('onnxruntime', None)
+        if not loaded:
+            sys.modules.pop(module_name, None)
+
+
+@pytest.mark.parametrize('batch_size', [2, 3, 16])
+def test_batched_chunks_match_one_at_a_time(mdx, batch_size):
+    params = mdx.MDXModel('cpu', dim_f=64, dim_t=16, n_fft=256, hop=64)
+    wave = np.random.default_rng(0).standard_normal((2, 44100)).astype(np.float32) * 0.1
+
+    sequential = mdx.MDX(None, params, processor=-1, session=Session(), batch_size=1).process_wave(wave, 2)
+    session = Session()
+    batched = mdx.MDX(None, params, processor=-1, session=session, batch_size=batch_size).process_wave(wave, 2)
+
+    assert max(session.batch_sizes) == batch_size
+    assert batched.shape == sequential.shape == wave.shape
+    np.testing.assert_allclose(batched, sequential, rtol=0, atol=1e-6)
@@ -0,0 +1,30 @@
+# tests/test_opt_ts.py
+
+# default imports
+import numpy as np
+import pytest
+
+# module imports
+from app.services.ai_cover.vc_infer_pipeline import get_opt_ts
+
+WINDOW, T_CENTER, T_QUERY = 160, 16000 * 38, 16000 * 6
+
+
+def get_opt_ts_loop(audio, window, t_center, t_query):
+    """one argmin per cut point, as before"""
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+    audio_sum = np.abs(np.convolve(audio_pad, np.ones(window, dtype=audio_pad.dtype), mode="valid")[: audio.shape[0]])
+    return [
+        t - t_query + int(np.argmin(audio_sum[t - t_query : t + t_query]))
+        for t in range(t_center, audio.shape[0], t_center)
+    ]
+
+
+# no cut, cuts whose window ends before, at and past the end of the audio
+@pytest.mark.parametrize('n_samples', [16000 * 5, T_CENTER * 3 + T_QUERY - 1, T_CENTER * 3 + T_QUERY, T_CENTER * 4 - 1])
+def test_opt_ts_matches_loop(n_samples):
+    audio = np.random.default_rng(0).standard_normal(n_samples) * 0.1
+    assert get_opt_ts(audio, WINDOW, T_CENTER, T_QUERY) == get_opt_ts_loop(audio, WINDOW, T_CENTER, T_QUERY)
+    # silence ties, the first minimum wins
+    audio[: n_samples // 2] = 0
+    assert get_opt_ts(audio, WINDOW, T_CENTER, T_QUERY) == get_opt_ts_loop(audio, WINDOW, T_CENTER, T_QUERY)
@@ -0,0 +1,50 @@
+# tests/test_postprocess.py
+
+# default imports
+import warnings
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# module imports
+from app.services.postprocess import postprocess
+
+with warnings.catch_warnings():
+    # pydub warns when ffmpeg is not on the path, wav does not need it
+    warnings.simplefilter('ignore')
+    pydub = pytest.importorskip('pydub')
+
+# (sample rate, channels, seconds) of the main vocals, backup vocals and instrumentals
+STEMS = [
+    ((40000, 1, 3.1), (44100, 2, 3.0), (44100, 2, 3.3)),
+    ((48000, 1, 3.0), (44100, 2, 3.2), (44100, 2, 2.9)),
+    ((44100, 2, 2.0), (44100, 1, 2.5), (32000, 1, 1.0)),
+]
+
+
+def combine_audio_pydub(audio_paths, output_path, main_gain, backup_gain, inst_gain):
+    """combine_audio as it was written with AudioSegment"""
+    main_vocal_audio = pydub.AudioSegment.from_wav(audio_paths[0]) - 4 + main_gain
+    backup_vocal_audio = pydub.AudioSegment.from_wav(audio_paths[1]) - 6 + backup_gain
+    instrumental_audio = pydub.AudioSegment.from_wav(audio_paths[2]) - 7 + inst_gain
+    main_vocal_audio.overlay(backup_vocal_audio).overlay(instrumental_audio).export(output_path, format='wav')
+
+
+@pytest.mark.parametrize('stems', STEMS)
+@pytest.mark.parametrize('gains', [(0, 0, 0), (3, -2, 12)])
+@pytest.mark.parametrize('amplitude', [3000, 30000])
+def test_mix_matches_pydub(tmp_path, monkeypatch, stems, gains, amplitude):
+    rng = np.random.default_rng(0)
+    audio_paths = []
+    for name, (sr, channels, seconds) in zip(('main', 'backup', 'inst'), stems):
+        audio = (rng.standard_normal((int(sr * seconds), channels)) * amplitude).clip(-32768, 32767)
+        audio_paths.append(str(tmp_path / f'{name}.wav'))
+        sf.write(audio_paths[-1], audio.astype(np.int16), sr, subtype='PCM_16')
+
+    combine_audio_pydub(audio_paths, str(tmp_path / 'expected.wav'), *gains)
+    # small blocks so the rate conversion and overlays cross block boundaries
+    monkeypatch.setattr(postprocess, 'BLOCK_SIZE', 1000)
+    postprocess.combine_audio(audio_paths, str(tmp_path / 'mix.wav'), *gains, 'wav')
+
+    assert (tmp_path / 'mix.wav').read_bytes() == (tmp_path / 'expected.wav').read_bytes()
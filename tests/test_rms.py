@@ -0,0 +1,45 @@
+# tests/test_rms.py
+
+# default imports
+import librosa
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+# module imports
+from app.services.audio.rms import change_rms, interpolate_linear
+
+
+def change_rms_torch(data1, sr1, data2, sr2, rate):
+    """original implementation from vc_infer_pipeline"""
+    rms1 = librosa.feature.rms(y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2)
+    rms2 = librosa.feature.rms(y=data2, frame_length=sr2 // 2 * 2, hop_length=sr2 // 2)
+    rms1 = torch.from_numpy(rms1)
+    rms1 = F.interpolate(rms1.unsqueeze(0), size=data2.shape[0], mode="linear").squeeze()
+    rms2 = torch.from_numpy(rms2)
+    rms2 = F.interpolate(rms2.unsqueeze(0), size=data2.shape[0], mode="linear").squeeze()
+    rms2 = torch.max(rms2, torch.zeros_like(rms2) + 1e-6)
+    data2 *= (torch.pow(rms1, torch.tensor(1 - rate)) * torch.pow(rms2, torch.tensor(rate - 1))).numpy()
+    return data2
+
+
+@pytest.mark.parametrize('n_in, n_out', [(2, 5), (7, 100), (13, 240321), (101, 441000)])
+def test_interpolate_linear_matches_torch(n_in, n_out):
+    curve = np.random.default_rng(0).random(n_in).astype(np.float32)
+    expected = F.interpolate(torch.from_numpy(curve)[None, None], size=n_out, mode='linear').squeeze().numpy()
+    # in blocks, as apply_rms_gain calls it
+    out = np.concatenate([interpolate_linear(curve, n_in, n_out, start, min(start + 65536, n_out))
+                          for start in range(0, n_out, 65536)])
+    np.testing.assert_allclose(out, expected, rtol=1e-6, atol=0)
+
+
+@pytest.mark.parametrize('rate', [0.0, 0.25, 0.75, 1.0])
+def test_change_rms_matches_torch(rate):
+    rng = np.random.default_rng(0)
+    n_in, n_out = 16000 * 12, 40000 * 12
+    data1 = rng.standard_normal(n_in) * np.abs(np.sin(np.arange(n_in) / 16000 * 0.5))
+    data2 = (rng.standard_normal(n_out) * np.abs(np.cos(np.arange(n_out) / 40000 * 0.3))).astype(np.float32)
+
+    expected = change_rms_torch(data1, 16000, data2.copy(), 40000, rate)
+    np.testing.assert_allclose(change_rms(data1, 16000, data2.copy(), 40000, rate), expected, rtol=1e-6, atol=0)
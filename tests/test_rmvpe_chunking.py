@@ -0,0 +1,57 @@
+# tests/test_rmvpe_chunking.py
+
+# default imports
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+# module imports
+from app.services.ai_cover import rmvpe
+
+
+class FrameModel(nn.Module):
+    """stand-in for E2E mapping every mel frame to its salience on its own, so chunking changes nothing but rounding"""
+
+    def __init__(self):
+        super().__init__()
+        self.proj = nn.Linear(128, 360)
+
+    def forward(self, mel):
+        return torch.sigmoid(self.proj(mel.transpose(-1, -2)) - 2)
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    torch.manual_seed(0)
+    path = tmp_path / 'rmvpe.pt'
+    torch.save(FrameModel().state_dict(), path)
+    monkeypatch.setattr(rmvpe, 'E2E', lambda *args: FrameModel())
+    return str(path)
+
+
+def test_chunked_salience_matches_whole(model_path):
+    audio = (np.random.default_rng(0).standard_normal(16000 * 5) * 0.1).astype(np.float32)
+    whole = rmvpe.RMVPE(model_path, is_half=False, device='cpu')
+    chunked = rmvpe.RMVPE(model_path, is_half=False, device='cpu', max_frames=128, overlap_frames=32)
+
+    x = torch.from_numpy(audio).unsqueeze(0)
+    expected = whole.mel2hidden(whole.mel_extractor(x, center=True)).squeeze(0)
+    hidden = chunked.audio2hidden_chunked(x)
+    assert hidden.shape == expected.shape
+    torch.testing.assert_close(hidden, expected, rtol=0, atol=1e-6)
+
+    f0 = chunked.infer_from_audio(audio)
+    np.testing.assert_allclose(f0, whole.infer_from_audio(audio), rtol=1e-6)
+
+
+def test_short_audio_is_not_chunked(model_path, monkeypatch):
+    chunked = rmvpe.RMVPE(model_path, is_half=False, device='cpu', max_frames=128, overlap_frames=32)
+    monkeypatch.setattr(chunked, 'audio2hidden_chunked', None)
+    audio = np.zeros(160 * 100, dtype=np.float32)
+    assert chunked.infer_from_audio(audio).shape == (101,)
+
+
+def test_max_frames_must_exceed_overlap(model_path):
+    with pytest.raises(ValueError):
+        rmvpe.RMVPE(model_path, is_half=False, device='cpu', max_frames=32, overlap_frames=32)
@@ -0,0 +1,45 @@
+# tests/test_song_generation.py
+
+# default imports
+import pytest
+
+song_generation = pytest.importorskip('app.controllers.song_generation')
+
+
+def test_song_cover_pipeline_positional_arguments(tmp_path, monkeypatch):
+    """gradio_interface passes every argument by position, in this order"""
+    calls = {}
+
+    def preprocess_song(song_input, input_type, song_dir, **kwargs):
+        calls['preprocess_song'] = kwargs
+        paths = [str(tmp_path / f'{name}.wav') for name in ('orig', 'vocals', 'inst', 'main', 'backup', 'dereverb')]
+        return tuple(paths)
+
+    def voice_change(*args):
+        calls['voice_change'] = args
+
+    def add_audio_effects(*args):
+        calls['add_audio_effects'] = args
+        return str(tmp_path / 'mixed.wav')
+
+    def combine_audio(*args):
+        calls['combine_audio'] = args
+
+    monkeypatch.setattr(song_generation.Settings, 'OUTPUT_DIR', str(tmp_path))
+    monkeypatch.setattr(song_generation, 'preprocess_song', preprocess_song)
+    monkeypatch.setattr(song_generation, 'voice_change', voice_change)
+    monkeypatch.setattr(song_generation, 'add_audio_effects', add_audio_effects)
+    monkeypatch.setattr(song_generation, 'combine_audio', combine_audio)
+
+    ai_cover_path = song_generation.song_cover_pipeline(
+        None, 'artist', 'song', True, 'voice', 1, False,
+        1, 2, 3, 0.6, 4,
+        0.3, 'rmvpe', 64, 0.4, 0,
+        0.1, 0.25, 0.75, 0.5, 'wav',
+    )
+
+    assert ai_cover_path.endswith('orig (voice Ver).wav')
+    assert calls['preprocess_song']['chorus_method'] == 'allin1'
+    assert calls['voice_change'][3:] == (12, 'rmvpe', 0.6, 4, 0.3, 0.4, 64)
+    assert calls['add_audio_effects'][1:] == (0.1, 0.25, 0.75, 0.5)
+    assert calls['combine_audio'][2:] == (1, 2, 3, 'wav')